@@ -8,7 +8,7 @@ setup(
     author_email="brian.seel@baltimorecity.gov",
     description="Interface with the Ridesystems website",
     packages=find_packages('src'),
-    package_data={'trafficstat': ['py.typed'], },
+    package_data={'trafficstat': ['py.typed', 'baltimore-topojson.json'], },
     python_requires='>=3.0',
     package_dir={'': 'src'},
     install_requires=[
@@ -21,6 +21,7 @@ setup(
         'loguru~=0.5.3',
         'sqlalchemy~=1.4.27',
         'openpyxl~=3.0.9',
+        'pyarrow~=6.0.1',
         'numpy~=1.21.4',
         'arcgis~=1.9.1',
         'pyvin@git+https://github.com/cylussec/pyvin@added_testing#egg=pyvin',
@@ -1,5 +1,12 @@
 """Sets up namespace for the creds to be imported"""
+import importlib
 
-from . import enrich_data, crash_data_ingester, ms2generator, viewer
+__all__ = ['enrich_data', 'crash_data_ingester', 'ms2generator', 'parquet_export', 'viewer']
 
-__all__ = ['enrich_data', 'crash_data_ingester', 'ms2generator', 'viewer']
+
+def __getattr__(name: str):
+    # The submodules are imported on first use, so that importing one of them does not import the others (and their
+    # dependencies, like pyarrow)
+    if name in __all__:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
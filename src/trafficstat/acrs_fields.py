@@ -0,0 +1,412 @@
+"""
+Declarative mappings from the ACRS tags in each section of a report to the columns of its table in crash_data_schema.
+Each mapping is compiled once into a row builder, which is a function that takes the OrderedDict of the section and
+returns a plain dictionary of column values, ready to be passed to the ORM object or written as a row. Adding a field
+to the ingester is one line in FIELD_MAPS.
+
+The values are read like CrashDataReader.get_single_attr: missing, empty and nil (<TAG i:nil="true"/>) tags are None,
+and tags that contain other tags raise an AssertionError. The converter of the column is then applied to the value.
+"""
+import collections.abc
+from collections import OrderedDict
+from datetime import datetime, time
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from sqlalchemy.ext.declarative import DeclarativeMeta  # type: ignore
+
+from .crash_data_schema import Approval, Crash, Circumstance, CitationCode, CommercialVehicle, CrashDiagram, \
+    DamagedArea, Ems, Event, PdfReport, Person, PersonInfo, Roadway, TowedUnit, Vehicle, VehicleUse, Witness
+from .datetime_parser import parse_datetime
+
+Converter = Callable[[Any], Any]
+RowBuilder = Callable[[Mapping], Dict[str, Any]]
+
+
+def single_value(tag: str, value: Any) -> Any:
+    """
+    Checks the value of a tag, like CrashDataReader.get_single_attr
+    :param tag: Name of the tag, for the error message
+    :param value: The value of the tag in the section
+    :return: The value, or None if it is empty or nil
+    """
+    if not value:
+        return None
+
+    if isinstance(value, str):
+        return value
+
+    if isinstance(value, OrderedDict) and len(value) == 1 and value.get('@i:nil') == 'true':
+        return None
+
+    if isinstance(value, collections.abc.Iterable):
+        raise AssertionError(f'Expected {tag} to have only a single element.')
+    return value
+
+
+def convert_to_bool(val: Any) -> Optional[int]:
+    """
+    Converts the XML style 'y', 'n', and 'u' (unknown) to a bit value
+    :param val: Value to convert to a bool
+    :return: Either True, False, or None (if the input was empty or 'u' for unknown)
+    """
+    if val is None:
+        return None
+
+    if isinstance(val, bool):
+        return int(val)
+
+    val = val.lower()
+    if val not in ['y', 'n', 'u']:
+        raise AssertionError(f'Expected y or n and got {val}')
+    if val == 'u':
+        return None
+    return int(bool(val == 'y'))
+
+
+def to_uniqueidentifier(uid: Any) -> Optional[str]:
+    """Checks for null uniqueidentifiers"""
+    return uid or None
+
+
+def to_time(time_str: str) -> time:
+    """Converts the CRASHTIME, which is either a time or a datetime, to a time"""
+    parts = time_str.split('T')
+    return time.fromisoformat(parts[1] if len(parts) > 1 else time_str)
+
+
+def to_datetime(dt_str: str) -> Optional[datetime]:
+    """Converts a date string to a datetime, and returns None if it is outside of the range that pandas supports"""
+    return parse_datetime(dt_str)
+
+
+# Column converters. Text columns are passed through as they are
+# pylint:disable=invalid-name
+TEXT = None
+BOOL = convert_to_bool
+DATETIME = to_datetime
+TIME = to_time
+UUID = to_uniqueidentifier
+# pylint:enable=invalid-name
+
+# The ACRS tags read from each section of the report, and how to convert them. The tag and the column have the same
+# name. Columns that are not from a single tag of the section (like CENSUS_TRACT and PERSONTYPE) are filled in by the
+# CrashDataReader._read_* methods.
+FIELD_MAPS: Dict[DeclarativeMeta, Dict[str, Optional[Converter]]] = {
+    Approval: {
+        'AGENCY': TEXT,
+        'APPROVALDATE': DATETIME,
+        'CADSENT': TEXT,
+        'CADSENT_DATE': DATETIME,
+        'CC_NUMBER': TEXT,
+        'DATE_INITIATED2': DATETIME,
+        'GROUP_NUMBER': TEXT,
+        'HISTORICALAPPROVALDATAs': TEXT,
+        'INCIDENT_DATE': DATETIME,
+        'INVESTIGATOR': TEXT,
+        'REPORT_TYPE': TEXT,
+        'SEQ_GUID': TEXT,
+        'STATUS_CHANGE_DATE': DATETIME,
+        'STATUS_ID': TEXT,
+        'STEP_NUMBER': TEXT,
+        'TR_USERNAME': TEXT,
+        'UNIT_CODE': TEXT,
+    },
+    Circumstance: {
+        'CIRCUMSTANCECODE': TEXT,
+        'CIRCUMSTANCEID': TEXT,
+        'CIRCUMSTANCETYPE': TEXT,
+        'PERSONID': UUID,
+        'REPORTNUMBER': TEXT,
+        'VEHICLEID': UUID,
+    },
+    CitationCode: {
+        'CITATIONNUMBER': TEXT,
+        'PERSONID': UUID,
+        'REPORTNUMBER': TEXT,
+    },
+    CommercialVehicle: {
+        'BODYTYPE': TEXT,
+        'BUSUSE': TEXT,
+        'CARRIERCLASSIFICATION': TEXT,
+        'CITY': TEXT,
+        'CONFIGURATION': TEXT,
+        'COUNTRY': TEXT,
+        'DOTNUMBER': TEXT,
+        'GVW': TEXT,
+        'HAZMATCLASS': TEXT,
+        'HAZMATNAME': TEXT,
+        'HAZMATNUMBER': TEXT,
+        'HAZMATSPILL': TEXT,
+        'MCNUMBER': TEXT,
+        'NAME': TEXT,
+        'NUMBEROFAXLES': TEXT,
+        'PLACARDVISIBLE': TEXT,
+        'POSTALCODE': TEXT,
+        'STATE': TEXT,
+        'STREET': TEXT,
+        'VEHICLEID': TEXT,
+        'WEIGHT': TEXT,
+        'WEIGHTUNIT': TEXT,
+    },
+    Crash: {
+        'ACRSREPORTTIMESTAMP': DATETIME,
+        'AGENCYIDENTIFIER': TEXT,
+        'AGENCYNAME': TEXT,
+        'AREA': TEXT,
+        'COLLISIONTYPE': TEXT,
+        'CONMAINCLOSURE': TEXT,
+        'CONMAINLOCATION': TEXT,
+        'CONMAINWORKERSPRESENT': BOOL,
+        'CONMAINZONE': BOOL,
+        'CRASHDATE': DATETIME,
+        'CRASHTIME': TIME,
+        'CURRENTASSIGNMENT': TEXT,
+        'CURRENTGROUP': TEXT,
+        'DEFAULTASSIGNMENT': TEXT,
+        'DEFAULTGROUP': TEXT,
+        'DOCTYPE': TEXT,
+        'FIXEDOBJECTSTRUCK': TEXT,
+        'HARMFULEVENTONE': TEXT,
+        'HARMFULEVENTTWO': TEXT,
+        'HITANDRUN': BOOL,
+        'INSERTDATE': DATETIME,
+        'INTERCHANGEAREA': TEXT,
+        'INTERCHANGEIDENTIFICATION': TEXT,
+        'INTERSECTIONTYPE': TEXT,
+        'INVESTIGATINGOFFICERUSERNAME': TEXT,
+        'INVESTIGATOR': TEXT,
+        'JUNCTION': TEXT,
+        'LANEDIRECTION': TEXT,
+        'LANENUMBER': TEXT,
+        'LANETYPE': TEXT,
+        'LATITUDE': TEXT,
+        'LIGHT': TEXT,
+        'LOCALCASENUMBER': TEXT,
+        'LOCALCODES': TEXT,
+        'LONGITUDE': TEXT,
+        'MILEPOINTDIRECTION': TEXT,
+        'MILEPOINTDISTANCE': TEXT,
+        'MILEPOINTDISTANCEUNITS': TEXT,
+        'NARRATIVE': TEXT,
+        'NONTRAFFIC': BOOL,
+        'NUMBEROFLANES': TEXT,
+        'OFFROADDESCRIPTION': TEXT,
+        'PHOTOSTAKEN': BOOL,
+        'RAMP': TEXT,
+        'REPORTCOUNTYLOCATION': TEXT,
+        'REPORTNUMBER': TEXT,
+        'REPORTTYPE': TEXT,
+        'ROADALIGNMENT': TEXT,
+        'ROADCONDITION': TEXT,
+        'ROADDIVISION': TEXT,
+        'ROADGRADE': TEXT,
+        'ROADID': TEXT,
+        'SCHOOLBUSINVOLVEMENT': TEXT,
+        'STATEGOVERNMENTPROPERTYNAME': TEXT,
+        'SUPERVISOR': TEXT,
+        'SUPERVISORUSERNAME': TEXT,
+        'SUPERVISORYDATE': DATETIME,
+        'SURFACECONDITION': TEXT,
+        'TRAFFICCONTROL': TEXT,
+        'TRAFFICCONTROLFUNCTIONING': BOOL,
+        'UPDATEDATE': DATETIME,
+        'UPLOADVERSION': TEXT,
+        'VERSIONNUMBER': TEXT,
+        'WEATHER': TEXT,
+    },
+    CrashDiagram: {
+        'CRASHDIAGRAM': TEXT,
+        'CRASHDIAGRAMNATIVE': TEXT,
+        'REPORTNUMBER': TEXT,
+    },
+    DamagedArea: {
+        'DAMAGEID': TEXT,
+        'IMPACTTYPE': TEXT,
+        'VEHICLEID': UUID,
+    },
+    Ems: {
+        'EMSTRANSPORTATIONTYPE': TEXT,
+        'EMSUNITNUMBER': TEXT,
+        'INJUREDTAKENBY': TEXT,
+        'INJUREDTAKENTO': TEXT,
+        'REPORTNUMBER': TEXT,
+    },
+    Event: {
+        'EVENTID': TEXT,
+        'EVENTSEQUENCE': TEXT,
+        'EVENTTYPE': TEXT,
+        'VEHICLEID': UUID,
+    },
+    PdfReport: {
+        'CHANGEDBY': TEXT,
+        'DATESTATUSCHANGED': DATETIME,
+        'PDFREPORT1': TEXT,
+        'PDF_ID': TEXT,
+        'REPORTNUMBER': TEXT,
+        'STATUS': TEXT,
+    },
+    Person: {
+        'ADDRESS': TEXT,
+        'CITY': TEXT,
+        'COMPANY': TEXT,
+        'COUNTRY': TEXT,
+        'COUNTY': TEXT,
+        'DLCLASS': TEXT,
+        'DLNUMBER': TEXT,
+        'DLSTATE': TEXT,
+        'DOB': DATETIME,
+        'FIRSTNAME': TEXT,
+        'HOMEPHONE': TEXT,
+        'LASTNAME': TEXT,
+        'MIDDLENAME': TEXT,
+        'OTHERPHONE': TEXT,
+        'PERSONID': UUID,
+        'RACE': TEXT,
+        'REPORTNUMBER': TEXT,
+        'SEX': TEXT,
+        'STATE': TEXT,
+        'ZIP': TEXT,
+    },
+    PersonInfo: {
+        'AIRBAGDEPLOYED': TEXT,
+        'ALCOHOLTESTINDICATOR': TEXT,
+        'ALCOHOLTESTTYPE': TEXT,
+        'ATFAULT': BOOL,
+        'BAC': TEXT,
+        'CONDITION': TEXT,
+        'CONTINUEDIRECTION': TEXT,
+        'DRIVERDISTRACTEDBY': TEXT,
+        'DRUGTESTINDICATOR': TEXT,
+        'DRUGTESTRESULT': TEXT,
+        'EJECTION': TEXT,
+        'EMSRUNREPORTNUMBER': TEXT,
+        'EMSUNITNUMBER': TEXT,
+        'EQUIPMENTPROBLEM': TEXT,
+        'GOINGDIRECTION': TEXT,
+        'HASCDL': BOOL,
+        'INJURYSEVERITY': TEXT,
+        'PEDESTRIANACTIONS': TEXT,
+        'PEDESTRIANLOCATION': TEXT,
+        'PEDESTRIANMOVEMENT': TEXT,
+        'PEDESTRIANOBEYTRAFFICSIGNAL': TEXT,
+        'PEDESTRIANTYPE': TEXT,
+        'PEDESTRIANVISIBILITY': TEXT,
+        'PERSONID': UUID,
+        'SAFETYEQUIPMENT': TEXT,
+        'SEAT': TEXT,
+        'SEATINGLOCATION': TEXT,
+        'SEATINGROW': TEXT,
+        'SUBSTANCEUSE': TEXT,
+        'UNITNUMBERFIRSTSTRIKE': TEXT,
+        'VEHICLEID': UUID,
+    },
+    Roadway: {
+        'COUNTY': TEXT,
+        'LOGMILE_DIR': TEXT,
+        'MILEPOINT': TEXT,
+        'MUNICIPAL': TEXT,
+        'MUNICIPAL_AREA_CODE': TEXT,
+        'REFERENCE_MUNI': TEXT,
+        'REFERENCE_ROADNAME': TEXT,
+        'REFERENCE_ROUTE_NUMBER': TEXT,
+        'REFERENCE_ROUTE_SUFFIX': TEXT,
+        'REFERENCE_ROUTE_TYPE': TEXT,
+        'ROADID': TEXT,
+        'ROAD_NAME': TEXT,
+        'ROUTE_NUMBER': TEXT,
+        'ROUTE_SUFFIX': TEXT,
+        'ROUTE_TYPE': TEXT,
+    },
+    TowedUnit: {
+        'INSURANCEPOLICYNUMBER': TEXT,
+        'INSURER': TEXT,
+        'LICENSEPLATENUMBER': TEXT,
+        'LICENSEPLATESTATE': TEXT,
+        'OWNERID': UUID,
+        'TOWEDID': UUID,
+        'UNITNUMBER': TEXT,
+        'VEHICLEID': UUID,
+        'VEHICLEMAKE': TEXT,
+        'VEHICLEMODEL': TEXT,
+        'VEHICLEYEAR': TEXT,
+        'VIN': TEXT,
+    },
+    Vehicle: {
+        'CONTINUEDIRECTION': TEXT,
+        'DAMAGEEXTENT': TEXT,
+        'DRIVERLESSVEHICLE': BOOL,
+        'EMERGENCYMOTORVEHICLEUSE': BOOL,
+        'FIRE': BOOL,
+        'FIRSTIMPACT': TEXT,
+        'GOINGDIRECTION': TEXT,
+        'HITANDRUN': BOOL,
+        'INSURANCEPOLICYNUMBER': TEXT,
+        'INSURER': TEXT,
+        'LICENSEPLATENUMBER': TEXT,
+        'LICENSEPLATESTATE': TEXT,
+        'MAINIMPACT': TEXT,
+        'MOSTHARMFULEVENT': TEXT,
+        'OWNERID': UUID,
+        'PARKEDVEHICLE': BOOL,
+        'REGISTRATIONEXPIRATIONYEAR': TEXT,
+        'REPORTNUMBER': TEXT,
+        'SFVEHICLEINTRANSPORT': TEXT,
+        'SPEEDLIMIT': TEXT,
+        'TOWEDUNITTYPE': TEXT,
+        'UNITNUMBER': TEXT,
+        'VEHICLEBODYTYPE': TEXT,
+        'VEHICLEID': UUID,
+        'VEHICLEMAKE': TEXT,
+        'VEHICLEMODEL': TEXT,
+        'VEHICLEMOVEMENT': TEXT,
+        'VEHICLEREMOVEDBY': TEXT,
+        'VEHICLEREMOVEDTO': TEXT,
+        'VEHICLETOWEDAWAY': TEXT,
+        'VEHICLEYEAR': TEXT,
+        'VIN': TEXT,
+    },
+    VehicleUse: {
+        'ID': TEXT,
+        'VEHICLEID': UUID,
+        'VEHICLEUSECODE': TEXT,
+    },
+    Witness: {
+        'PERSONID': UUID,
+        'REPORTNUMBER': TEXT,
+    },
+}
+
+
+# The value of a nil tag, <TAG i:nil="true"/>
+_NIL = OrderedDict([('@i:nil', 'true')])
+
+
+def compile_row_builder(fields: Mapping[str, Optional[Converter]]) -> RowBuilder:
+    """
+    Compiles a field mapping into a row builder. The mapping is turned into a tuple of (tag, converter) pairs once, so
+    the common cases (the tag is a non-empty string, or nil) are a dictionary lookup and a type check, plus the
+    converter. Anything else goes through single_value.
+    :param fields: Dictionary of tag/column name to converter, from FIELD_MAPS
+    :return: Function that takes the OrderedDict of a section and returns the dictionary of column values
+    """
+    field_pairs = tuple(fields.items())
+
+    def build_row(section: Mapping) -> Dict[str, Any]:
+        get = section.get
+        row = {}
+        for tag, converter in field_pairs:
+            value = get(tag)
+            if value.__class__ is str and value:
+                row[tag] = value if converter is None else converter(value)
+            elif value is None or (value.__class__ is OrderedDict and value == _NIL):
+                row[tag] = None
+            else:
+                value = single_value(tag, value)
+                row[tag] = value if value is None or converter is None else converter(value)
+        return row
+
+    return build_row
+
+
+ROW_BUILDERS: Dict[DeclarativeMeta, RowBuilder] = {model: compile_row_builder(fields)
+                                                   for model, fields in FIELD_MAPS.items()}
@@ -0,0 +1,164 @@
+"""
+Incremental parser for ACRS XML reports. The file is fed to expat in chunks and each child of the REPORT tag is yielded
+as soon as it is closed, so the whole file is never held in memory as a string. The sections have the same structure
+that xmltodict.parse gives (and that the crash_data_types TypedDicts describe), so they can be passed straight to the
+CrashDataReader._read_* methods.
+"""
+import os
+import re
+from collections import OrderedDict, deque
+from typing import Any, BinaryIO, Deque, FrozenSet, Iterator, List, Optional, Tuple
+from xml.parsers import expat
+
+from .crash_data_types import CrashDataType
+
+# Tags that are always returned as a list, even if there is only one of them in the report
+FORCE_LIST = frozenset({'ACRSPERSON', 'ACRSVEHICLE', 'CIRCUMSTANCE', 'CITATIONCODE', 'DAMAGEDAREA', 'DRIVER', 'EMS',
+                        'EVENT', 'NONMOTORIST', 'PASSENGER', 'PDFREPORT', 'REPORTDOCUMENT', 'REPORTPHOTO', 'TOWEDUNIT',
+                        'VEHICLEUSE', 'WITNESS'})
+
+CHUNK_SIZE = 64 * 1024
+
+# ACRS writes the REPORT tags in alphabetical order, so REPORTNUMBER and VERSIONNUMBER are near the end of the file.
+# Only the attachments (DIAGRAM, PDFREPORTs) are large, and they come before them.
+HEADER_TAIL_SIZE = 16 * 1024
+_REPORTNUMBER_RE = re.compile(rb'<REPORTNUMBER>([^<]+)</REPORTNUMBER>')
+_VERSIONNUMBER_RE = re.compile(rb'<VERSIONNUMBER>([^<]+)</VERSIONNUMBER>')
+
+
+class _ReportHandler:
+    """
+    Expat handler that builds xmltodict style OrderedDicts for everything below the REPORT tag. Character data is
+    buffered by expat and joined once per element, so large base64 blobs (CRASHDIAGRAM, PDFREPORT1) are only copied
+    once, into the string that ends up in the section.
+    """
+
+    def __init__(self, force_list: FrozenSet[str]):
+        self.force_list = force_list
+        self.depth = 0
+        self.stack: List[Tuple[Optional[OrderedDict], List[str]]] = []
+        self.item: Optional[OrderedDict] = None
+        self.data: List[str] = []
+        self.sections: Deque[Tuple[str, Any]] = deque()
+
+    def start_element(self, _name: str, attrs: List[str]) -> None:
+        """Expat StartElementHandler"""
+        self.depth += 1
+        attr_items = [('@' + key, value) for key, value in zip(attrs[0::2], attrs[1::2])]
+        if self.depth == 1:
+            # The REPORT tag. Its attributes are the namespace declarations, which xmltodict includes in the report
+            self.sections.extend(attr_items)
+            return
+
+        self.stack.append((self.item, self.data))
+        self.item = OrderedDict(attr_items) if attr_items else None
+        self.data = []
+
+    def end_element(self, name: str) -> None:
+        """Expat EndElementHandler"""
+        self.depth -= 1
+        if self.depth == 0:
+            return
+
+        data = ''.join(self.data).strip() or None
+        value: Any = self.item
+        if value is None:
+            value = data
+        elif data:
+            value['#text'] = data
+        self.item, self.data = self.stack.pop()
+
+        if self.depth == 1:
+            self.sections.append((name, [value] if name in self.force_list else value))
+            return
+
+        if self.item is None:
+            self.item = OrderedDict()
+        if name not in self.item:
+            self.item[name] = [value] if name in self.force_list else value
+        elif isinstance(self.item[name], list):
+            self.item[name].append(value)
+        else:
+            self.item[name] = [self.item[name], value]
+
+    def characters(self, data: str) -> None:
+        """Expat CharacterDataHandler"""
+        self.data.append(data)
+
+
+def iter_report(acrs_file: BinaryIO, chunk_size: int = CHUNK_SIZE,
+                force_list: FrozenSet[str] = FORCE_LIST) -> Iterator[Tuple[str, Any]]:
+    """
+    Reads an ACRS report one section at a time
+    :param acrs_file: ACRS XML file, opened in binary mode
+    :param chunk_size: Number of bytes to read from the file at a time
+    :param force_list: Tags that should always be lists
+    :return: Iterator of (tag, value) for each child of REPORT, in document order. Raises ExpatError if the file is not
+    well formed.
+    """
+    handler = _ReportHandler(force_list)
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.buffer_size = chunk_size
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.characters
+    # Do not expand entities
+    parser.DefaultHandler = lambda _: None
+    parser.ExternalEntityRefHandler = lambda *_: 1
+
+    chunk = acrs_file.read(chunk_size)
+    # These files have non ascii at the beginning that causes parse errors
+    offset = chunk.find(b'<?xml')
+    if offset > 0:
+        chunk = chunk[offset:]
+
+    while chunk:
+        parser.Parse(chunk, False)
+        while handler.sections:
+            yield handler.sections.popleft()
+        chunk = acrs_file.read(chunk_size)
+
+    parser.Parse(b'', True)
+    while handler.sections:
+        yield handler.sections.popleft()
+
+
+def parse_report(acrs_file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> CrashDataType:
+    """
+    Parses an ACRS report into the same structure as xmltodict.parse(...)['REPORT']
+    :param acrs_file: ACRS XML file, opened in binary mode
+    :param chunk_size: Number of bytes to read from the file at a time
+    """
+    return OrderedDict(iter_report(acrs_file, chunk_size))  # type: ignore
+
+
+def read_report_header(acrs_file: BinaryIO,
+                       tail_size: int = HEADER_TAIL_SIZE) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Gets the REPORTNUMBER and VERSIONNUMBER of a report without parsing the whole file. The end of the file is searched
+    first, and if they are not both there, the file is streamed until they have been found.
+    :param acrs_file: ACRS XML file, opened in binary mode
+    :param tail_size: Number of bytes at the end of the file to search
+    :return: Tuple of REPORTNUMBER and VERSIONNUMBER. Either can be None if it is not in the file.
+    """
+    acrs_file.seek(0, os.SEEK_END)
+    acrs_file.seek(max(acrs_file.tell() - tail_size, 0))
+    tail = acrs_file.read()
+
+    # The WITNESSes section, which can come after REPORTNUMBER, has its own REPORTNUMBER tags, but they always have
+    # the same value as the report
+    report_number = _REPORTNUMBER_RE.search(tail)
+    version_number = _VERSIONNUMBER_RE.search(tail)
+    if report_number and version_number:
+        return report_number.group(1).decode('utf-8'), version_number.group(1).decode('utf-8')
+
+    acrs_file.seek(0)
+    header = {}
+    for tag, value in iter_report(acrs_file):
+        if tag in ('REPORTNUMBER', 'VERSIONNUMBER'):
+            header[tag] = value if isinstance(value, str) else None
+            if len(header) == 2:
+                break
+    return header.get('REPORTNUMBER'), header.get('VERSIONNUMBER')
@@ -0,0 +1,234 @@
+"""
+Offline census tract lookups against the Baltimore City census tract topology that ships with this package. This is a
+drop in replacement for arcgis.geocoding.reverse_geocode when all we need is the census tract, and it does not need
+network access.
+"""
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np  # type: ignore
+from loguru import logger
+
+TOPOJSON_FILE = os.path.join(os.path.dirname(__file__), 'baltimore-topojson.json')
+
+Ring = Tuple[Tuple[float, ...], Tuple[float, ...]]  # (longitudes, latitudes)
+
+# Number of points tested against a tract's edges at a time by _Tract.contains_many, to bound the size of the
+# points x edges arrays
+POINT_CHUNK_SIZE = 4096
+
+
+class _Tract:  # pylint:disable=too-few-public-methods,too-many-instance-attributes
+    """A single census tract polygon, with its bounding box"""
+
+    __slots__ = ('census_tract', 'geoid', 'rings', 'min_x', 'min_y', 'max_x', 'max_y', 'edges')
+
+    def __init__(self, census_tract: str, geoid: str, rings: List[Ring]):
+        self.census_tract = census_tract
+        self.geoid = geoid
+        self.rings = rings
+        self.min_x = min(min(ring[0]) for ring in rings)
+        self.max_x = max(max(ring[0]) for ring in rings)
+        self.min_y = min(min(ring[1]) for ring in rings)
+        self.max_y = max(max(ring[1]) for ring in rings)
+
+        # Every edge of every ring, as arrays of (x_i, y_i, x_j, y_j), where j is the vertex before i
+        ring_arrays = [(np.array(xs), np.array(ys)) for xs, ys in rings]  # pylint:disable=invalid-name
+        self.edges = (np.concatenate([xs for xs, _ in ring_arrays]),
+                      np.concatenate([ys for _, ys in ring_arrays]),
+                      np.concatenate([np.roll(xs, 1) for xs, _ in ring_arrays]),
+                      np.concatenate([np.roll(ys, 1) for _, ys in ring_arrays]))
+
+    def contains(self, x_coord: float, y_coord: float) -> bool:
+        """Even-odd ray cast over all of the rings, so holes are handled"""
+        if not (self.min_x <= x_coord <= self.max_x and self.min_y <= y_coord <= self.max_y):
+            return False
+
+        inside = False
+        for xs, ys in self.rings:  # pylint:disable=invalid-name
+            j = len(xs) - 1
+            for i, (x_i, y_i) in enumerate(zip(xs, ys)):
+                y_j = ys[j]
+                if (y_i > y_coord) != (y_j > y_coord) and \
+                        x_coord < (xs[j] - x_i) * (y_coord - y_i) / (y_j - y_i) + x_i:
+                    inside = not inside
+                j = i
+        return inside
+
+    def contains_many(self, x_coords: np.ndarray, y_coords: np.ndarray) -> np.ndarray:
+        """
+        The same even-odd ray cast as contains, for arrays of points. The bounding box is not checked.
+        :return: Boolean array of whether each point is in the tract
+        """
+        x_i, y_i, x_j, y_j = self.edges
+        inside = np.zeros(len(x_coords), dtype=bool)
+        for start in range(0, len(x_coords), POINT_CHUNK_SIZE):
+            x_coord = x_coords[start:start + POINT_CHUNK_SIZE, np.newaxis]
+            y_coord = y_coords[start:start + POINT_CHUNK_SIZE, np.newaxis]
+            # Horizontal edges divide by zero, but they are never crossed
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crossings = ((y_i > y_coord) != (y_j > y_coord)) & \
+                            (x_coord < (x_j - x_i) * (y_coord - y_i) / (y_j - y_i) + x_i)
+            inside[start:start + POINT_CHUNK_SIZE] = crossings.sum(axis=1) % 2 == 1
+        return inside
+
+
+class CensusTractResolver:  # pylint:disable=too-many-instance-attributes
+    """
+    Resolves latitude/longitude pairs to census tracts using a local TopoJSON file. The topology is decoded once, and
+    a uniform grid over the tract bounding boxes is used so each lookup only tests a handful of polygons.
+    """
+
+    def __init__(self, topojson_file: str = TOPOJSON_FILE, grid_size: int = 32):
+        """
+        :param topojson_file: Path to a TopoJSON file with census tract polygons (with TRACTCE and GEOID properties)
+        :param grid_size: Number of rows and columns in the spatial index
+        """
+        with open(topojson_file, encoding='utf-8') as topo_file:
+            topology = json.load(topo_file)
+
+        self.tracts = self._decode_topology(topology)
+        self.grid_size = grid_size
+
+        self.min_x = min(tract.min_x for tract in self.tracts)
+        self.max_x = max(tract.max_x for tract in self.tracts)
+        self.min_y = min(tract.min_y for tract in self.tracts)
+        self.max_y = max(tract.max_y for tract in self.tracts)
+        self.cell_width = (self.max_x - self.min_x) / grid_size
+        self.cell_height = (self.max_y - self.min_y) / grid_size
+
+        self.grid: Dict[Tuple[int, int], List[_Tract]] = {}
+        for tract in self.tracts:
+            min_col, min_row = self._cell(tract.min_x, tract.min_y)
+            max_col, max_row = self._cell(tract.max_x, tract.max_y)
+            for col in range(min_col, max_col + 1):
+                for row in range(min_row, max_row + 1):
+                    self.grid.setdefault((col, row), []).append(tract)
+
+        logger.debug('Loaded {} census tracts from {}', len(self.tracts), topojson_file)
+
+    @staticmethod
+    def _decode_topology(topology: dict) -> List[_Tract]:  # pylint:disable=too-many-locals
+        """Converts the quantized, delta encoded arcs in the topology to polygons"""
+        scale_x, scale_y = topology['transform']['scale']
+        translate_x, translate_y = topology['transform']['translate']
+
+        arcs: List[List[Tuple[float, float]]] = []
+        for arc in topology['arcs']:
+            x_pos = y_pos = 0
+            points = []
+            for delta_x, delta_y in arc:
+                x_pos += delta_x
+                y_pos += delta_y
+                points.append((x_pos * scale_x + translate_x, y_pos * scale_y + translate_y))
+            arcs.append(points)
+
+        def build_ring(arc_indexes: Sequence[int]) -> Ring:
+            points: List[Tuple[float, float]] = []
+            for arc_index in arc_indexes:
+                # Negative indexes are the one's complement of a reversed arc
+                arc_points = arcs[arc_index] if arc_index >= 0 else arcs[~arc_index][::-1]
+                # Consecutive arcs share their end points
+                points.extend(arc_points[1:] if points else arc_points)
+            longitudes, latitudes = zip(*points)
+            return longitudes, latitudes
+
+        tracts = []
+        for geo_object in topology['objects'].values():
+            for geometry in geo_object['geometries']:
+                if geometry['type'] == 'Polygon':
+                    polygons = [geometry['arcs']]
+                elif geometry['type'] == 'MultiPolygon':
+                    polygons = geometry['arcs']
+                else:
+                    continue
+
+                rings = [build_ring(ring) for polygon in polygons for ring in polygon]
+                tracts.append(_Tract(geometry['properties']['TRACTCE'], geometry['properties']['GEOID'], rings))
+
+        return tracts
+
+    def _cell(self, x_coord: float, y_coord: float) -> Tuple[int, int]:
+        """Gets the grid cell for a coordinate, clamped to the grid"""
+        col = min(max(int((x_coord - self.min_x) / self.cell_width), 0), self.grid_size - 1)
+        row = min(max(int((y_coord - self.min_y) / self.cell_height), 0), self.grid_size - 1)
+        return col, row
+
+    def get_tract(self, latitude: float, longitude: float) -> Optional[_Tract]:
+        """
+        Gets the census tract that contains the point
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :return: The tract, or None if the point is not in any of the tracts
+        """
+        if not (self.min_x <= longitude <= self.max_x and self.min_y <= latitude <= self.max_y):
+            return None
+
+        for tract in self.grid.get(self._cell(longitude, latitude), []):
+            if tract.contains(longitude, latitude):
+                return tract
+        return None
+
+    def get_census_tract(self, latitude: float, longitude: float) -> Optional[str]:
+        """
+        Gets the six digit census tract code (TRACTCE) that contains the point
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :return: The census tract, or None if the point is outside of the city
+        """
+        tract = self.get_tract(latitude, longitude)
+        return tract.census_tract if tract else None
+
+    def get_census_tracts(self, latitudes: Sequence[float], longitudes: Sequence[float]) -> List[Optional[str]]:
+        """
+        Gets the census tracts for many points at once. Duplicate points are only resolved once, and each tract is
+        tested against all of the unresolved points in its bounding box at once.
+        :param latitudes: Latitudes of the points. NaN for points without coordinates
+        :param longitudes: Longitudes of the points, in the same order as latitudes
+        :return: The six digit census tract code (TRACTCE) of each point, or None if it is outside of the city
+        """
+        points, inverse = np.unique(np.column_stack((np.asarray(longitudes, dtype=float),
+                                                     np.asarray(latitudes, dtype=float))),
+                                    axis=0, return_inverse=True)
+        x_coords, y_coords = points[:, 0], points[:, 1]
+
+        tract_indexes = np.full(len(points), -1)
+        for tract_index, tract in enumerate(self.tracts):
+            # NaNs fail every comparison, so they are never candidates
+            candidates = np.flatnonzero((tract_indexes == -1) &
+                                        (x_coords >= tract.min_x) & (x_coords <= tract.max_x) &
+                                        (y_coords >= tract.min_y) & (y_coords <= tract.max_y))
+            if candidates.size:
+                inside = tract.contains_many(x_coords[candidates], y_coords[candidates])
+                tract_indexes[candidates[inside]] = tract_index
+
+        census_tracts = [self.tracts[tract_index].census_tract if tract_index >= 0 else None
+                         for tract_index in tract_indexes]
+        return [census_tracts[point_index] for point_index in inverse.reshape(-1)]
+
+    def reverse_geocode(self, location: Sequence[float]) -> Optional[Dict[str, str]]:
+        """
+        Same call signature that the ingester and enricher use for arcgis.geocoding.reverse_geocode
+        :param location: [latitude, longitude]
+        :return: Dictionary with the census_tract and geoid, or None if the point is outside of the city
+        """
+        tract = self.get_tract(float(location[0]), float(location[1]))
+        if tract is None:
+            return None
+        return {'census_tract': tract.census_tract, 'geoid': tract.geoid}
+
+
+@lru_cache(maxsize=None)
+def get_resolver(topojson_file: str = TOPOJSON_FILE) -> CensusTractResolver:
+    """Gets a shared resolver, so the topology is only decoded once per process"""
+    return CensusTractResolver(topojson_file)
+
+
+def reverse_geocode(location: Sequence[float]) -> Optional[Dict[str, str]]:
+    """
+    Offline replacement for arcgis.geocoding.reverse_geocode, using the shared resolver
+    :param location: [latitude, longitude]
+    """
+    return get_resolver().reverse_geocode(location)
@@ -1,30 +1,32 @@
 """Processes unprocessed data in the network share that holds crash data"""
+# pylint:disable=too-many-lines
 import argparse
-import collections.abc
+import functools
 import glob
 import inspect
+import multiprocessing
 import os
+import queue
 import shutil
-from collections import OrderedDict
-from datetime import datetime, time
+import threading
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
 from sqlite3 import Connection as SQLite3Connection
-from typing import List, Mapping, Optional, Union
+from time import perf_counter
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 from xml.parsers.expat import ExpatError
 
-import xmltodict  # type: ignore
-from arcgis.geocoding import reverse_geocode  # type: ignore
-from arcgis.gis import GIS  # type: ignore
 from loguru import logger
-from pandas import to_datetime  # type: ignore
-from pandas.errors import OutOfBoundsDatetime  # type: ignore
-from sqlalchemy import create_engine, event as sqlalchemyevent, inspect as sqlalchemyinspect  # type: ignore
-from sqlalchemy.engine import Engine  # type: ignore
+from sqlalchemy import create_engine, event as sqlalchemyevent  # type: ignore
+from sqlalchemy.engine import Engine, make_url  # type: ignore
 from sqlalchemy.exc import IntegrityError  # type: ignore
 from sqlalchemy.ext.declarative import DeclarativeMeta  # type: ignore
 from sqlalchemy.orm import Session  # type: ignore
-from sqlalchemy.sql import text  # type: ignore
-from pyvin import DecodedVIN, VIN  # type: ignore
 
+from .acrs_fields import ROW_BUILDERS, convert_to_bool, single_value, to_uniqueidentifier
+from .acrs_xml import parse_report, read_report_header
 from .crash_data_schema import Approval, Base, Crash, Circumstance, CitationCode, CommercialVehicle, \
     CrashDiagram, DamagedArea, Ems, Event, PdfReport, Person, PersonInfo, Roadway, TowedUnit, Vehicle, VehicleUse, \
     Witness
@@ -32,9 +34,11 @@ from .crash_data_types import ApprovalDataType, CrashDataType, CircumstanceType,
     CommercialVehicleType, CrashDiagramType, DamagedAreaType, DriverType, EmsType, EventType, NonMotoristType, \
     PassengerType, PdfReportDataType, PersonType, ReportDocumentType, ReportPhotoType, RoadwayType, TowedUnitType, \
     VehicleType, VehicleUseType, WitnessType
-from .xmlsanitizer import sanitize_xml_str
-
-GIS()
+from .datetime_parser import parse_datetime
+from .geocoder import GEOCODERS, ReverseGeocoder, arcgis_reverse_geocode
+from .upsert import group_rows, insert_rows, supports_upsert, upsert
+from .vin_decoder import VinDecoder
+from .xmlsanitizer import sanitize_report
 
 
 @sqlalchemyevent.listens_for(Engine, "connect")
@@ -45,24 +49,86 @@ def _set_sqlite_pragma(dbapi_connection, connection_record):  # pylint:disable=u
         cursor.close()
 
 
+# A row for _insert_or_update: the ORM class of the table, and the dictionary of column values
+TableRow = Tuple[DeclarativeMeta, dict]
+
+# Tables whose rows are shared by more than one report, so bulk_insert upserts them instead of inserting them
+SHARED_TABLES = frozenset({Roadway.__table__})
+
+_PARSE_WORKER_READER: Optional['CrashDataReader'] = None
+
+
+def _init_parse_worker(conn_str: str, reverse_geocoder: ReverseGeocoder, vin_decoder: VinDecoder) -> None:
+    """Process pool initializer for CrashDataReader._read_files_parallel"""
+    global _PARSE_WORKER_READER  # pylint:disable=global-statement
+    _PARSE_WORKER_READER = CrashDataReader(conn_str, reverse_geocoder=reverse_geocoder, vin_decoder=vin_decoder)
+
+
+def _parse_worker(file_args: Tuple[str, bool]) -> Tuple[str, Optional[str], Union[int, str, None], Optional[list]]:
+    """
+    Process pool worker for CrashDataReader._read_files_parallel. Parses a file and builds its rows
+    :param file_args: Tuple of the file name and whether to sanitize it
+    :return: Tuple of the file name, report number, version number and rows (None if it could not be parsed)
+    """
+    file_name, sanitize = file_args
+    reader = _PARSE_WORKER_READER
+    if reader is None:
+        raise RuntimeError('_init_parse_worker was not run')
+
+    crash_dict = reader._parse_file(file_name, sanitize)  # pylint:disable=protected-access
+    if crash_dict is None:
+        return file_name, None, None, None
+
+    report_number = crash_dict.get('REPORTNUMBER')
+    version_number = crash_dict.get('VERSIONNUMBER')
+    if not reader._is_new_version(report_number, version_number):  # pylint:disable=protected-access
+        # Already in the database, so skip the (expensive) row building. The writer checks again before writing
+        return file_name, report_number, version_number, None
+
+    return file_name, report_number, version_number, reader._build_report(crash_dict)  # pylint:disable=protected-access
+
+
+class SectionMetrics:
+    """Number of calls and total time for each of the CrashDataReader._read_* sections, from check_and_log"""
+
+    def __init__(self) -> None:
+        self.calls: Counter = Counter()
+        self.seconds: Dict[str, float] = defaultdict(float)
+
+    def record(self, section: str, seconds: float) -> None:
+        """Records a call to a section"""
+        self.calls[section] += 1
+        self.seconds[section] += seconds
+
+    def log(self) -> None:
+        """Logs the sections, slowest first"""
+        for section, seconds in sorted(self.seconds.items(), key=lambda item: item[1], reverse=True):
+            logger.info('{}: {} calls, {:.3f} seconds', section, self.calls[section], seconds)
+
+
 def check_and_log(check_dict: str):
-    """Logs the function entry, and checks the check_dict argument for nullness"""
+    """
+    Logs the function entry (at the TRACE level), checks the check_dict argument for nullness, and records the call in
+    the reader's section_metrics
+    """
 
     def _check_and_log(func):
-        def wrapper(*_args, **_kwargs):
-            logger.info('Entering {}', func.__name__)
-
-            # handle positional or keyword args
-            args_name = inspect.getfullargspec(func)[0]
-            args_dict = dict(zip(args_name, _args))
-            args_dict.update(**_kwargs)
-            self = args_dict['self']
+        # Find the argument once, instead of inspecting the function on every call. Index 0 is self
+        check_index = inspect.getfullargspec(func).args.index(check_dict) - 1
 
-            if self.is_element_nil(args_dict[check_dict]):
-                logger.warning('No data')
-                return False
+        @functools.wraps(func)
+        def wrapper(self, *_args, **_kwargs):
+            logger.trace('Entering {}', func.__name__)
+            start = perf_counter()
+            try:
+                check_arg = _args[check_index] if check_index < len(_args) else _kwargs[check_dict]
+                if self.is_element_nil(check_arg):
+                    logger.warning('No data')
+                    return False
 
-            return func(*_args, **_kwargs)
+                return func(self, *_args, **_kwargs)
+            finally:
+                self.section_metrics.record(func.__name__, perf_counter() - start)
 
         return wrapper
 
@@ -72,74 +138,109 @@ def check_and_log(check_dict: str):
 class CrashDataReader:
     """ Reads a directory of ACRS crash data files"""
 
-    def __init__(self, conn_str: str):
+    def __init__(self, conn_str: str,
+                 reverse_geocoder: ReverseGeocoder = arcgis_reverse_geocode,
+                 vin_decoder: Optional[VinDecoder] = None, bulk_insert: bool = False):
         """
         Reads a directory of XML ACRS crash files, and returns an iterator of the parsed data
         :param conn_str: sqlalchemy connection string (IE sqlite:///crash.db)
+        :param reverse_geocoder: Function that takes [latitude, longitude] and returns a dict with a census_tract key.
+        Defaults to the ArcGIS reverse geocoder. Use geocoder.offline_reverse_geocode to geocode without network access.
+        :param vin_decoder: Looks up the make, model and year of vehicles. Defaults to an online decoder that only
+        caches in memory
+        :param bulk_insert: Write the reports with plain INSERTs, and only upsert the reports that conflict with rows
+        that are already in the database. This is faster for backfills, where most of the reports are new.
         """
         logger.info('Creating db with connection string: {}', conn_str)
-        self.engine = create_engine(conn_str, echo=True, future=True)
+        url = make_url(conn_str)
+        engine_args = {'fast_executemany': True} if bulk_insert and url.get_driver_name() == 'pyodbc' else {}
+        self.engine = create_engine(url, echo=True, future=True, **engine_args)
+        self.bulk_insert = bulk_insert
+        self.reverse_geocoder = reverse_geocoder
+        self.vin_decoder = vin_decoder or VinDecoder()
+        # The sections read in this process. With workers > 1, the sections are read in the worker processes
+        self.section_metrics = SectionMetrics()
+
+        # When set, _insert_or_update queues rows here instead of writing them. See _report_transaction
+        self._pending_rows: Optional[List[TableRow]] = None
 
         with self.engine.begin() as connection:
             Base.metadata.create_all(connection)
 
-    def _insert_or_update(self, insert_obj: DeclarativeMeta, identity_insert=False):
+    @contextmanager
+    def _report_transaction(self) -> Iterator[None]:
         """
-        A safe way for the sqlalchemy
-        :param insert_obj:
-        :param identity_insert:
-        :return:
+        Collects every row passed to _insert_or_update while the context is open, and then writes them all in a single
+        transaction when it closes. If there is an exception, nothing from the report is written.
         """
-        with Session(bind=self.engine, future=True) as session:
-            if identity_insert:
-                session.execute(text(f'SET IDENTITY_INSERT {insert_obj.__tablename__} ON'))
+        self._pending_rows = []
+        try:
+            yield
+            pending_rows = self._pending_rows
+        finally:
+            self._pending_rows = None
+
+        self._write_rows(pending_rows)
 
-            session.add(insert_obj)
+    def _write_rows(self, table_rows: List[TableRow]) -> None:
+        """
+        Inserts or updates (if the primary key already exists) the rows in a single transaction
+        :param table_rows: (ORM class, row of column values) tuples to write, in the order that satisfies their foreign
+        keys
+        """
+        if not table_rows:
+            return
+
+        if self.bulk_insert:
             try:
-                session.commit()
-                logger.debug('Successfully inserted object: {}', insert_obj)
-            except IntegrityError as insert_err:
-                session.rollback()
-
-                if '(544)' in insert_err.args[0]:
-                    # This is a workaround for an issue with sqlalchemy not properly setting IDENTITY_INSERT on for SQL
-                    # Server before we insert values in the primary key. The error is:
-                    # (pyodbc.IntegrityError) ('23000', "[23000] [Microsoft][ODBC Driver 17 for SQL Server][SQL Server]
-                    # Cannot insert explicit value for identity column in table <table name> when IDENTITY_INSERT is set
-                    # to OFF. (544) (SQLExecDirectW)")
-                    self._insert_or_update(insert_obj, True)
-
-                elif '(2627)' in insert_err.args[0] or 'UNIQUE constraint failed' in insert_err.args[0]:
-                    # Error 2627 is the Sql Server error for inserting when the primary key already exists. 'UNIQUE
-                    # constraint failed' is the same for Sqlite
-                    cls_type = type(insert_obj)
-
-                    qry = session.query(cls_type)
-
-                    primary_keys = [i.key for i in sqlalchemyinspect(cls_type).primary_key]
-                    for primary_key in primary_keys:
-                        qry = qry.filter(cls_type.__dict__[primary_key] == insert_obj.__dict__[primary_key])
-
-                    update_vals = {k: v for k, v in insert_obj.__dict__.items()
-                                   if not k.startswith('_') and k not in primary_keys}
-                    if update_vals:
-                        qry.update(update_vals)
-                        try:
-                            session.commit()
-                            logger.debug('Successfully inserted object: {}', insert_obj)
-                        except IntegrityError as update_err:
-                            logger.error('Unable to insert object: {}\nError: {}', insert_obj, update_err)
+                self._insert_rows(table_rows)
+                logger.debug('Successfully inserted {} rows', len(table_rows))
+                return
+            except IntegrityError as err:
+                logger.debug('Rows are already in the database, so they will be upserted: {}', err.orig)
+
+        if supports_upsert(self.engine.dialect):
+            with self.engine.begin() as connection:
+                for table, rows in group_rows((model.__table__, row) for model, row in table_rows):
+                    upsert(connection, table, rows)
+        else:
+            with Session(bind=self.engine, future=True) as session, session.begin():
+                for model, row in table_rows:
+                    session.merge(model(**row))
 
+        logger.debug('Successfully wrote {} rows', len(table_rows))
+
+    def _insert_rows(self, table_rows: List[TableRow]) -> None:
+        """
+        Writes the rows with plain INSERTs in a single transaction, for bulk_insert. Roadways are shared by all of the
+        crashes on the road, so they are upserted (where the database supports it) instead of conflicting every time.
+        :param table_rows: (ORM class, row of column values) tuples to write, in the order that satisfies their foreign
+        keys
+        """
+        shared_upsert = supports_upsert(self.engine.dialect)
+        with self.engine.begin() as connection:
+            for table, rows in group_rows((model.__table__, row) for model, row in table_rows):
+                if shared_upsert and table in SHARED_TABLES:
+                    upsert(connection, table, rows)
                 else:
-                    raise AssertionError(f'Expected error 2627 or "UNIQUE constraint failed". '
-                                         f'Got {insert_err}') from insert_err
-            finally:
-                if identity_insert:
-                    session.execute(text(f'SET IDENTITY_INSERT {insert_obj.__tablename__} OFF'))
+                    insert_rows(connection, table, rows)
+
+    def _insert_or_update(self, model: DeclarativeMeta, row: dict) -> None:
+        """
+        Inserts the row, or updates it if the primary key already exists. Inside of _report_transaction, the row is
+        queued and written with the rest of the report.
+        :param model: ORM class from crash_data_schema, for the table to write to
+        :param row: Dictionary of column values
+        """
+        if self._pending_rows is not None:
+            self._pending_rows.append((model, row))
+            return
+
+        self._write_rows([(model, row)])
 
     def read_crash_data(self, dir_name: Optional[str] = None,  # pylint:disable=too-many-arguments
                         recursive: bool = False, file_name: Optional[str] = None, copy: bool = True,
-                        sanitize: bool = False) -> None:
+                        sanitize: bool = False, workers: int = 1, writers: int = 1) -> None:
         """
         Reads the ACRS crash data files
         :param dir_name: Directory to process. All XML files in the directory will be processed.
@@ -147,52 +248,203 @@ class CrashDataReader:
         :param file_name: Full path to the file to process
         :param copy: All processed ACRS xml files will be copied to .processed folder
         :param sanitize: All processed ACRS xml files will be sanitized of PII.
+        :param workers: Number of processes used to parse the files in dir_name. If more than one, the files are parsed
+        in parallel, and the parsed reports are written by the database writer threads
+        :param writers: Number of threads that write the parsed reports to the database. Only used if workers > 1
         """
         if dir_name:
-            for acrs_file in glob.glob(os.path.join(dir_name, '*.xml'), recursive=recursive):
-                self.read_crash_data(file_name=acrs_file, copy=copy, sanitize=sanitize)
+            acrs_files = self._skip_loaded_reports(glob.glob(os.path.join(dir_name, '*.xml'), recursive=recursive),
+                                                   copy=copy)
+            if workers > 1:
+                self._read_files_parallel(acrs_files, workers=workers, writers=writers, copy=copy, sanitize=sanitize)
+            else:
+                for acrs_file in acrs_files:
+                    self.read_crash_data(file_name=acrs_file, copy=copy, sanitize=sanitize)
 
         if file_name:
             if os.path.exists(file_name):
                 self._read_file(file_name, sanitize=sanitize)
                 if copy:
-                    try:
-                        self._file_move(file_name, os.path.join(os.path.dirname(file_name), '.processed'))
-                    except PermissionError as err:
-                        logger.error('Unable to copy file: {}', err)
+                    self._move_processed(file_name)
 
-    def _read_file(self, file_name: str, sanitize: bool = False) -> None:  # pylint:disable=too-many-branches
-        logger.info('Processing {}', file_name)
-        with open(file_name, encoding='utf-8') as acrs_file:
-            crash_file: Optional[str] = acrs_file.read()
-            if sanitize:
-                crash_file = sanitize_xml_str(crash_file)
+    def _skip_loaded_reports(self, file_names: List[str], copy: bool = True) -> List[str]:
+        """
+        Filters out the files whose report is already in the database with the same or a newer VERSIONNUMBER. Only the
+        REPORTNUMBER and VERSIONNUMBER are read from each file, and the database versions are looked up in bulk.
+        :param file_names: The ACRS XML files to check
+        :param copy: Move the skipped files to the .processed folder, like they would be if they were read
+        :return: The files that need to be read
+        """
+        headers = {}
+        for file_name in file_names:
+            try:
+                with open(file_name, 'rb') as acrs_file:
+                    headers[file_name] = read_report_header(acrs_file)
+            except (ExpatError, OSError) as err:
+                # Let the full read deal with it
+                logger.debug('Unable to read the header of {}: {}', file_name, err)
+                headers[file_name] = (None, None)
+
+        db_versions = self._get_db_versions([report_number for report_number, _ in headers.values() if report_number])
+
+        new_files = []
+        for file_name, (report_number, version_number) in headers.items():
+            db_version = db_versions.get(report_number) if report_number else None
+            try:
+                is_loaded = db_version is not None and int(version_number or 0) <= db_version
+            except ValueError:
+                is_loaded = False
+
+            if not is_loaded:
+                new_files.append(file_name)
+            elif copy:
+                self._move_processed(file_name)
+
+        logger.info('Skipping {} of {} files that are already in the database',
+                    len(file_names) - len(new_files), len(file_names))
+        return new_files
 
-        if crash_file is None:
+    def _get_db_versions(self, report_numbers: Sequence[str], chunk_size: int = 1000) -> Dict[str, int]:
+        """
+        Gets the VERSIONNUMBER of the reports that are already in the database
+        :param report_numbers: REPORTNUMBERs to look up
+        :param chunk_size: Number of report numbers per query. SQL Server allows at most 2100 parameters per query
+        :return: Dictionary of REPORTNUMBER to VERSIONNUMBER, for the reports that are in the database
+        """
+        report_numbers = sorted(set(report_numbers))
+        db_versions: Dict[str, int] = {}
+        with Session(bind=self.engine, future=True) as session:
+            for i in range(0, len(report_numbers), chunk_size):
+                qry = session.query(Crash.REPORTNUMBER, Crash.VERSIONNUMBER).filter(
+                    Crash.REPORTNUMBER.in_(report_numbers[i:i + chunk_size]), Crash.VERSIONNUMBER.isnot(None))
+                db_versions.update(qry.all())
+        return db_versions
+
+    def _move_processed(self, file_name: str) -> None:
+        """Moves a file that has been read into the .processed folder next to it"""
+        try:
+            self._file_move(file_name, os.path.join(os.path.dirname(file_name), '.processed'))
+        except PermissionError as err:
+            logger.error('Unable to copy file: {}', err)
+
+    def _read_files_parallel(self, file_names: List[str],  # pylint:disable=too-many-arguments
+                             workers: int, writers: int, copy: bool, sanitize: bool) -> None:
+        """
+        Parses the files in a process pool, and writes the results with a bounded number of writer threads. All of the
+        reports with the same report number go to the same writer, so the VERSIONNUMBER check is not racy.
+        :param file_names: The ACRS XML files to read
+        :param workers: Number of parser processes
+        :param writers: Number of database writer threads
+        :param copy: All processed ACRS xml files will be copied to .processed folder
+        :param sanitize: All processed ACRS xml files will be sanitized of PII.
+        """
+        # Bounding the queues keeps the parsers from getting too far ahead of the database
+        write_queues: List[queue.Queue] = [queue.Queue(maxsize=workers * 2) for _ in range(writers)]
+        errors: List[Exception] = []
+        threads = [threading.Thread(target=self._write_worker, args=(write_queue, copy, errors))
+                   for write_queue in write_queues]
+        for thread in threads:
+            thread.start()
+
+        try:
+            with multiprocessing.Pool(workers, initializer=_init_parse_worker,
+                                      initargs=(str(self.engine.url), self.reverse_geocoder,
+                                                self.vin_decoder)) as pool:
+                for report in pool.imap_unordered(_parse_worker, [(i, sanitize) for i in file_names]):
+                    report_number = report[1] or ''
+                    write_queues[zlib.crc32(report_number.encode('utf-8')) % writers].put(report)
+        finally:
+            for write_queue in write_queues:
+                write_queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def _write_worker(self, write_queue: queue.Queue, copy: bool, errors: List[Exception]) -> None:
+        """
+        Writer thread for _read_files_parallel. Takes (file name, report number, version number, rows) tuples off of
+        the queue until it gets None.
+        """
+        while True:
+            report = write_queue.get()
+            if report is None:
+                return
+
+            file_name, report_number, version_number, table_rows = report
+            try:
+                if table_rows is not None and self._is_new_version(report_number, version_number):
+                    self._write_rows(table_rows)
+                if copy:
+                    self._move_processed(file_name)
+            except Exception as err:  # pylint:disable=broad-except
+                # Keep draining the queue so the parsers are not blocked. The error is raised from the main thread
+                logger.error('Unable to write file {}: {}', file_name, err)
+                errors.append(err)
+
+    def _read_file(self, file_name: str, sanitize: bool = False) -> None:
+        crash_dict = self._parse_file(file_name, sanitize)
+        if crash_dict is None:
+            return
+
+        if not self._is_new_version(crash_dict.get('REPORTNUMBER'), crash_dict.get('VERSIONNUMBER')):
             return
 
-        # These files have non ascii at the beginning that causes parse errors
-        offset = crash_file.find('<?xml')
+        with self._report_transaction():
+            self._read_report(crash_dict)
+
+    @staticmethod
+    def _parse_file(file_name: str, sanitize: bool = False) -> Optional[CrashDataType]:
+        """
+        Parses an ACRS XML file
+        :param file_name: The file to parse
+        :param sanitize: Sanitize the report of PII
+        :return: The contents of the REPORT tag, or None if the file could not be parsed
+        """
+        logger.info('Processing {}', file_name)
         try:
-            root = xmltodict.parse(crash_file[offset:],
-                                   force_list={'ACRSPERSON', 'ACRSVEHICLE', 'CIRCUMSTANCE', 'CITATIONCODE',
-                                               'DAMAGEDAREA', 'DRIVER', 'EMS', 'EVENT', 'NONMOTORIST', 'PASSENGER',
-                                               'PDFREPORT', 'REPORTDOCUMENT', 'REPORTPHOTO', 'TOWEDUNIT', 'VEHICLEUSE',
-                                               'WITNESS'})
+            with open(file_name, 'rb') as acrs_binary_file:
+                crash_dict = parse_report(acrs_binary_file)
+            return sanitize_report(crash_dict) if sanitize else crash_dict
         except ExpatError as err:
             logger.error('Unable to parse file {}. Parse error: {}', file_name, err)
-            return
-
-        crash_dict = root['REPORT']
+            return None
 
+    def _is_new_version(self, report_number: Optional[str], version_number: Union[int, str, None]) -> bool:
+        """
+        Checks the report version against what is already in the database
+        :param report_number: The REPORTNUMBER of the report
+        :param version_number: The VERSIONNUMBER of the report
+        :return: False if the database already has this version of the report or a newer one
+        """
         with Session(bind=self.engine, future=True) as session:
-            qry = session.query(Crash.VERSIONNUMBER).filter(Crash.REPORTNUMBER == crash_dict.get('REPORTNUMBER'))
+            db_version = session.query(Crash.VERSIONNUMBER).filter(Crash.REPORTNUMBER == report_number).scalar()
 
-            if qry.count() > 0 and int(crash_dict.get('VERSIONNUMBER')) <= qry.all()[0][0]:
-                logger.warning("Not processing this file because of data version.\nFile data version: {}\n"
-                               "Database data version: {}", crash_dict.get('VERSIONNUMBER'), qry.all()[0][0])
-                return
+        if db_version is not None and int(version_number or 0) <= db_version:
+            logger.warning("Not processing this file because of data version.\nFile data version: {}\n"
+                           "Database data version: {}", version_number, db_version)
+            return False
+        return True
+
+    def _build_report(self, crash_dict: CrashDataType) -> List[TableRow]:
+        """
+        Builds the rows for a report without writing them
+        :param crash_dict: OrderedDict from the REPORT tag
+        :return: The (ORM class, row) tuples, in the order that they need to be written
+        """
+        self._pending_rows = []
+        try:
+            self._read_report(crash_dict)
+            return self._pending_rows
+        finally:
+            self._pending_rows = None
 
+    def _read_report(self, crash_dict: CrashDataType) -> None:  # pylint:disable=too-many-branches
+        """
+        Reads all of the sections of a report, in the order required by the foreign keys
+        :param crash_dict: OrderedDict from the REPORT tag
+        """
         if crash_dict.get('ROADWAY'):
             self._read_roadway_data(crash_dict['ROADWAY'])
 
@@ -266,96 +518,22 @@ class CrashDataReader:
     @check_and_log('crash_dict')
     def _read_main_crash_data(self, crash_dict: CrashDataType) -> bool:
         """ Populates the acrs_crashes table """
-        crash_time_str = self.get_single_attr('CRASHTIME', crash_dict)
-        if isinstance(crash_time_str, str) and len(crash_time_str.split('T')) > 1:
-            crash_time: Optional[time] = time.fromisoformat(crash_time_str.split('T')[1])
-        elif crash_time_str is None:
-            crash_time = None
-        else:
-            crash_time = time.fromisoformat(crash_time_str)
+        row = ROW_BUILDERS[Crash](crash_dict)
 
-        latitude = self.get_single_attr('LATITUDE', crash_dict)
-        longitude = self.get_single_attr('LONGITUDE', crash_dict)
-        census_tract = None
+        latitude = row['LATITUDE']
+        longitude = row['LONGITUDE']
+        row['CENSUS_TRACT'] = None
 
         if not (latitude and longitude):
             logger.error('Unable to get latitude and longitude')
         else:
-            geo = reverse_geocode([float(latitude), float(longitude)])
+            geo = self.reverse_geocoder([float(latitude), float(longitude)])
             if not geo:
                 logger.error(f'Unable to reverse geocode {latitude}/{longitude}')
             else:
-                census_tract = geo.get('census_tract')
-
-        self._insert_or_update(
-            Crash(
-                ACRSREPORTTIMESTAMP=self.to_datetime_sql(self.get_single_attr('ACRSREPORTTIMESTAMP', crash_dict)),
-                AGENCYIDENTIFIER=self.get_single_attr('AGENCYIDENTIFIER', crash_dict),
-                AGENCYNAME=self.get_single_attr('AGENCYNAME', crash_dict),
-                AREA=self.get_single_attr('AREA', crash_dict),
-                CENSUS_TRACT=census_tract,
-                COLLISIONTYPE=self.get_single_attr('COLLISIONTYPE', crash_dict),
-                CONMAINCLOSURE=self.get_single_attr('CONMAINCLOSURE', crash_dict),
-                CONMAINLOCATION=self.get_single_attr('CONMAINLOCATION', crash_dict),
-                CONMAINWORKERSPRESENT=self.convert_to_bool(self.get_single_attr('CONMAINWORKERSPRESENT', crash_dict)),
-                CONMAINZONE=self.convert_to_bool(self.get_single_attr('CONMAINZONE', crash_dict)),
-                CRASHDATE=self.to_datetime_sql(self.get_single_attr('CRASHDATE', crash_dict)),
-                CRASHTIME=crash_time,
-                CURRENTASSIGNMENT=self.get_single_attr('CURRENTASSIGNMENT', crash_dict),
-                CURRENTGROUP=self.get_single_attr('CURRENTGROUP', crash_dict),
-                DEFAULTASSIGNMENT=self.get_single_attr('DEFAULTASSIGNMENT', crash_dict),
-                DEFAULTGROUP=self.get_single_attr('DEFAULTGROUP', crash_dict),
-                DOCTYPE=self.get_single_attr('DOCTYPE', crash_dict),
-                FIXEDOBJECTSTRUCK=self.get_single_attr('FIXEDOBJECTSTRUCK', crash_dict),
-                HARMFULEVENTONE=self.get_single_attr('HARMFULEVENTONE', crash_dict),
-                HARMFULEVENTTWO=self.get_single_attr('HARMFULEVENTTWO', crash_dict),
-                HITANDRUN=self.convert_to_bool(self.get_single_attr('HITANDRUN', crash_dict)),
-                INSERTDATE=self.to_datetime_sql(self.get_single_attr('INSERTDATE', crash_dict)),
-                INTERCHANGEAREA=self.get_single_attr('INTERCHANGEAREA', crash_dict),
-                INTERCHANGEIDENTIFICATION=self.get_single_attr('INTERCHANGEIDENTIFICATION', crash_dict),
-                INTERSECTIONTYPE=self.get_single_attr('INTERSECTIONTYPE', crash_dict),
-                INVESTIGATINGOFFICERUSERNAME=self.get_single_attr('INVESTIGATINGOFFICERUSERNAME', crash_dict),
-                INVESTIGATOR=self.get_single_attr('INVESTIGATOR', crash_dict),
-                JUNCTION=self.get_single_attr('JUNCTION', crash_dict),
-                LANEDIRECTION=self.get_single_attr('LANEDIRECTION', crash_dict),
-                LANENUMBER=self.get_single_attr('LANENUMBER', crash_dict),
-                LANETYPE=self.get_single_attr('LANETYPE', crash_dict),
-                LATITUDE=latitude,
-                LIGHT=self.get_single_attr('LIGHT', crash_dict),
-                LOCALCASENUMBER=self.get_single_attr('LOCALCASENUMBER', crash_dict),
-                LOCALCODES=self.get_single_attr('LOCALCODES', crash_dict),
-                LONGITUDE=longitude,
-                MILEPOINTDIRECTION=self.get_single_attr('MILEPOINTDIRECTION', crash_dict),
-                MILEPOINTDISTANCE=self.get_single_attr('MILEPOINTDISTANCE', crash_dict),
-                MILEPOINTDISTANCEUNITS=self.get_single_attr('MILEPOINTDISTANCEUNITS', crash_dict),
-                NARRATIVE=self.get_single_attr('NARRATIVE', crash_dict),
-                NONTRAFFIC=self.convert_to_bool(self.get_single_attr('NONTRAFFIC', crash_dict)),
-                NUMBEROFLANES=self.get_single_attr('NUMBEROFLANES', crash_dict),
-                OFFROADDESCRIPTION=self.get_single_attr('OFFROADDESCRIPTION', crash_dict),
-                PHOTOSTAKEN=self.convert_to_bool(self.get_single_attr('PHOTOSTAKEN', crash_dict)),
-                RAMP=self.get_single_attr('RAMP', crash_dict),
-                REPORTCOUNTYLOCATION=self.get_single_attr('REPORTCOUNTYLOCATION', crash_dict),
-                REPORTNUMBER=self.get_single_attr('REPORTNUMBER', crash_dict),
-                REPORTTYPE=self.get_single_attr('REPORTTYPE', crash_dict),
-                ROADALIGNMENT=self.get_single_attr('ROADALIGNMENT', crash_dict),
-                ROADCONDITION=self.get_single_attr('ROADCONDITION', crash_dict),
-                ROADDIVISION=self.get_single_attr('ROADDIVISION', crash_dict),
-                ROADGRADE=self.get_single_attr('ROADGRADE', crash_dict),
-                ROADID=self.get_single_attr('ROADID', crash_dict),
-                SCHOOLBUSINVOLVEMENT=self.get_single_attr('SCHOOLBUSINVOLVEMENT', crash_dict),
-                STATEGOVERNMENTPROPERTYNAME=self.get_single_attr('STATEGOVERNMENTPROPERTYNAME', crash_dict),
-                SUPERVISOR=self.get_single_attr('SUPERVISOR', crash_dict),
-                SUPERVISORUSERNAME=self.get_single_attr('SUPERVISORUSERNAME', crash_dict),
-                SUPERVISORYDATE=self.to_datetime_sql(self.get_single_attr('SUPERVISORYDATE', crash_dict)),
-                SURFACECONDITION=self.get_single_attr('SURFACECONDITION', crash_dict),
-                TRAFFICCONTROL=self.get_single_attr('TRAFFICCONTROL', crash_dict),
-                TRAFFICCONTROLFUNCTIONING=self.convert_to_bool(
-                    self.get_single_attr('TRAFFICCONTROLFUNCTIONING', crash_dict)),
-                UPDATEDATE=self.to_datetime_sql(self.get_single_attr('UPDATEDATE', crash_dict)),
-                UPLOADVERSION=self.get_single_attr('UPLOADVERSION', crash_dict),
-                VERSIONNUMBER=self.get_single_attr('VERSIONNUMBER', crash_dict),
-                WEATHER=self.get_single_attr('WEATHER', crash_dict)
-            ))
+                row['CENSUS_TRACT'] = geo.get('census_tract')
+
+        self._insert_or_update(Crash, row)
 
         return True
 
@@ -365,26 +543,7 @@ class CrashDataReader:
         Populates the acrs_approval table
         :param approval_dict: The ordereddict contained in the APPROVALDATA tag
         """
-        self._insert_or_update(
-            Approval(
-                AGENCY=self.get_single_attr('AGENCY', approval_dict),
-                APPROVALDATE=self.to_datetime_sql(self.get_single_attr('APPROVALDATE', approval_dict)),
-                CADSENT=self.get_single_attr('CADSENT', approval_dict),
-                CADSENT_DATE=self.to_datetime_sql(self.get_single_attr('CADSENT_DATE', approval_dict)),
-                CC_NUMBER=self.get_single_attr('CC_NUMBER', approval_dict),
-                DATE_INITIATED2=self.to_datetime_sql(self.get_single_attr('DATE_INITIATED2', approval_dict)),
-                GROUP_NUMBER=self.get_single_attr('GROUP_NUMBER', approval_dict),
-                HISTORICALAPPROVALDATAs=self.get_single_attr('HISTORICALAPPROVALDATAs', approval_dict),
-                INCIDENT_DATE=self.to_datetime_sql(self.get_single_attr('INCIDENT_DATE', approval_dict)),
-                INVESTIGATOR=self.get_single_attr('INVESTIGATOR', approval_dict),
-                REPORT_TYPE=self.get_single_attr('REPORT_TYPE', approval_dict),
-                SEQ_GUID=self.get_single_attr('SEQ_GUID', approval_dict),
-                STATUS_CHANGE_DATE=self.to_datetime_sql(self.get_single_attr('STATUS_CHANGE_DATE', approval_dict)),
-                STATUS_ID=self.get_single_attr('STATUS_ID', approval_dict),
-                STEP_NUMBER=self.get_single_attr('STEP_NUMBER', approval_dict),
-                TR_USERNAME=self.get_single_attr('TR_USERNAME', approval_dict),
-                UNIT_CODE=self.get_single_attr('UNIT_CODE', approval_dict)
-            ))
+        self._insert_or_update(Approval, ROW_BUILDERS[Approval](approval_dict))
 
     @check_and_log('circumstance_dict')
     def _read_circumstance_data(self, circumstance_dict: List[CircumstanceType]) -> None:
@@ -392,31 +551,20 @@ class CrashDataReader:
         Populates the acrs_circumstances table
         :param circumstance_dict: List of CIRCUMSTANCE tags contained in the CIRCUMSTANCES tag
         """
+        build_row = ROW_BUILDERS[Circumstance]
         for circumstance in circumstance_dict:
-            self._insert_or_update(
-                Circumstance(
-                    CIRCUMSTANCECODE=self.get_single_attr('CIRCUMSTANCECODE', circumstance),
-                    CIRCUMSTANCEID=self.get_single_attr('CIRCUMSTANCEID', circumstance),
-                    CIRCUMSTANCETYPE=self.get_single_attr('CIRCUMSTANCETYPE', circumstance),
-                    PERSONID=self._validate_uniqueidentifier(self.get_single_attr('PERSONID', circumstance)),
-                    REPORTNUMBER=self.get_single_attr('REPORTNUMBER', circumstance),
-                    VEHICLEID=self._validate_uniqueidentifier(self.get_single_attr('VEHICLEID', circumstance))
-                ))
+            self._insert_or_update(Circumstance, build_row(circumstance))
 
     @check_and_log('citation_dict')
     def _read_citation_data(self, citation_dict: List[CitationCodeType]) -> None:
         """ Populates the acrs_citation_codes table """
+        build_row = ROW_BUILDERS[CitationCode]
         for citation in citation_dict:
-            citation_no = self.get_single_attr('CITATIONNUMBER', citation)
-            if isinstance(citation_no, str):
-                citation_no = citation_no.upper()
-            if not citation_no == 'PENDING':
-                self._insert_or_update(
-                    CitationCode(
-                        CITATIONNUMBER=citation_no,
-                        PERSONID=self._validate_uniqueidentifier(self.get_single_attr('PERSONID', citation)),
-                        REPORTNUMBER=self.get_single_attr('REPORTNUMBER', citation)
-                    ))
+            row = build_row(citation)
+            if isinstance(row['CITATIONNUMBER'], str):
+                row['CITATIONNUMBER'] = row['CITATIONNUMBER'].upper()
+            if not row['CITATIONNUMBER'] == 'PENDING':
+                self._insert_or_update(CitationCode, row)
 
     @check_and_log('crash_diagram_dict')
     def _read_crash_diagrams_data(self, crash_diagram_dict: CrashDiagramType) -> None:
@@ -424,12 +572,7 @@ class CrashDataReader:
         Populates the acrs_crash_diagrams table
         :param crash_diagram_dict: OrderedDict from the DIAGRAM tag
         """
-        self._insert_or_update(
-            CrashDiagram(
-                CRASHDIAGRAM=self.get_single_attr('CRASHDIAGRAM', crash_diagram_dict),
-                CRASHDIAGRAMNATIVE=self.get_single_attr('CRASHDIAGRAMNATIVE', crash_diagram_dict),
-                REPORTNUMBER=self.get_single_attr('REPORTNUMBER', crash_diagram_dict),
-            ))
+        self._insert_or_update(CrashDiagram, ROW_BUILDERS[CrashDiagram](crash_diagram_dict))
 
     @check_and_log('ems_dict')
     def _read_ems_data(self, ems_dict: List[EmsType]) -> None:
@@ -437,15 +580,9 @@ class CrashDataReader:
         Populates the acrs_ems table from the EMSes tag
         :param ems_dict: List of OrderedDicts contained in the EMSes tag
         """
+        build_row = ROW_BUILDERS[Ems]
         for ems in ems_dict:
-            self._insert_or_update(
-                Ems(
-                    EMSTRANSPORTATIONTYPE=self.get_single_attr('EMSTRANSPORTATIONTYPE', ems),
-                    EMSUNITNUMBER=self.get_single_attr('EMSUNITNUMBER', ems),
-                    INJUREDTAKENBY=self.get_single_attr('INJUREDTAKENBY', ems),
-                    INJUREDTAKENTO=self.get_single_attr('INJUREDTAKENTO', ems),
-                    REPORTNUMBER=self.get_single_attr('REPORTNUMBER', ems)
-                ))
+            self._insert_or_update(Ems, build_row(ems))
 
     @check_and_log('commvehicle_dict')
     def _read_commercial_vehicle_data(self, commvehicle_dict: CommercialVehicleType) -> None:
@@ -454,31 +591,7 @@ class CrashDataReader:
         :param commvehicle_dict: The dictionary of the ACRSVEHICLE
         :return:
         """
-        self._insert_or_update(
-            CommercialVehicle(
-                BODYTYPE=self.get_single_attr('BODYTYPE', commvehicle_dict),
-                BUSUSE=self.get_single_attr('BUSUSE', commvehicle_dict),
-                CARRIERCLASSIFICATION=self.get_single_attr('CARRIERCLASSIFICATION', commvehicle_dict),
-                CITY=self.get_single_attr('CITY', commvehicle_dict),
-                CONFIGURATION=self.get_single_attr('CONFIGURATION', commvehicle_dict),
-                COUNTRY=self.get_single_attr('COUNTRY', commvehicle_dict),
-                DOTNUMBER=self.get_single_attr('DOTNUMBER', commvehicle_dict),
-                GVW=self.get_single_attr('GVW', commvehicle_dict),
-                HAZMATCLASS=self.get_single_attr('HAZMATCLASS', commvehicle_dict),
-                HAZMATNAME=self.get_single_attr('HAZMATNAME', commvehicle_dict),
-                HAZMATNUMBER=self.get_single_attr('HAZMATNUMBER', commvehicle_dict),
-                HAZMATSPILL=self.get_single_attr('HAZMATSPILL', commvehicle_dict),
-                MCNUMBER=self.get_single_attr('MCNUMBER', commvehicle_dict),
-                NAME=self.get_single_attr('NAME', commvehicle_dict),
-                NUMBEROFAXLES=self.get_single_attr('NUMBEROFAXLES', commvehicle_dict),
-                PLACARDVISIBLE=self.get_single_attr('PLACARDVISIBLE', commvehicle_dict),
-                POSTALCODE=self.get_single_attr('POSTALCODE', commvehicle_dict),
-                STATE=self.get_single_attr('STATE', commvehicle_dict),
-                STREET=self.get_single_attr('STREET', commvehicle_dict),
-                VEHICLEID=self.get_single_attr('VEHICLEID', commvehicle_dict),
-                WEIGHT=self.get_single_attr('WEIGHT', commvehicle_dict),
-                WEIGHTUNIT=self.get_single_attr('WEIGHTUNIT', commvehicle_dict)
-            ))
+        self._insert_or_update(CommercialVehicle, ROW_BUILDERS[CommercialVehicle](commvehicle_dict))
 
     @check_and_log('event_dict')
     def _read_event_data(self, event_dict: List[EventType]) -> None:
@@ -486,14 +599,9 @@ class CrashDataReader:
         Populates the acrs_events table from the EVENTS tag
         :param event_dict: The dictionary of the ACRSVEHICLE
         """
+        build_row = ROW_BUILDERS[Event]
         for event in event_dict:
-            self._insert_or_update(
-                Event(
-                    EVENTID=self.get_single_attr('EVENTID', event),
-                    EVENTSEQUENCE=self.get_single_attr('EVENTSEQUENCE', event),
-                    EVENTTYPE=self.get_single_attr('EVENTTYPE', event),
-                    VEHICLEID=self._validate_uniqueidentifier(self.get_single_attr('VEHICLEID', event))
-                ))
+            self._insert_or_update(Event, build_row(event))
 
     @check_and_log('pdfreport_dict')
     def _read_pdf_data(self, pdfreport_dict: List[PdfReportDataType]) -> None:
@@ -501,16 +609,9 @@ class CrashDataReader:
         Populates the acrs_pdf_report table from the PDFREPORTs tag
         :param pdfreport_dict: List of OrderedDicts from the PDFREPORTs tag
         """
+        build_row = ROW_BUILDERS[PdfReport]
         for report in pdfreport_dict:
-            self._insert_or_update(
-                PdfReport(
-                    CHANGEDBY=self.get_single_attr('CHANGEDBY', report),
-                    DATESTATUSCHANGED=self.to_datetime_sql(self.get_single_attr('DATESTATUSCHANGED', report)),
-                    PDFREPORT1=self.get_single_attr('PDFREPORT1', report),
-                    PDF_ID=self.get_single_attr('PDF_ID', report),
-                    REPORTNUMBER=self.get_single_attr('REPORTNUMBER', report),
-                    STATUS=self.get_single_attr('STATUS', report)
-                ))
+            self._insert_or_update(PdfReport, build_row(report))
 
     @check_and_log('person_dict')
     def _read_acrs_person_data(self, person_dict: List[PersonType]) -> None:
@@ -518,30 +619,9 @@ class CrashDataReader:
         Processes the ACRSPERSON tag contents
         :param person_dict: OrderedDict from the PERSON, OWNER, PASSENGER, or NONMOTORIST tags
         """
+        build_row = ROW_BUILDERS[Person]
         for person in person_dict:
-            self._insert_or_update(
-                Person(
-                    ADDRESS=self.get_single_attr('ADDRESS', person),
-                    CITY=self.get_single_attr('CITY', person),
-                    COMPANY=self.get_single_attr('COMPANY', person),
-                    COUNTRY=self.get_single_attr('COUNTRY', person),
-                    COUNTY=self.get_single_attr('COUNTY', person),
-                    DLCLASS=self.get_single_attr('DLCLASS', person),
-                    DLNUMBER=self.get_single_attr('DLNUMBER', person),
-                    DLSTATE=self.get_single_attr('DLSTATE', person),
-                    DOB=self.to_datetime_sql(self.get_single_attr('DOB', person)),
-                    FIRSTNAME=self.get_single_attr('FIRSTNAME', person),
-                    HOMEPHONE=self.get_single_attr('HOMEPHONE', person),
-                    LASTNAME=self.get_single_attr('LASTNAME', person),
-                    MIDDLENAME=self.get_single_attr('MIDDLENAME', person),
-                    OTHERPHONE=self.get_single_attr('OTHERPHONE', person),
-                    PERSONID=self._validate_uniqueidentifier(self.get_single_attr('PERSONID', person)),
-                    RACE=self.get_single_attr('RACE', person),
-                    REPORTNUMBER=self.get_single_attr('REPORTNUMBER', person),
-                    SEX=self.get_single_attr('SEX', person),
-                    STATE=self.get_single_attr('STATE', person),
-                    ZIP=self.get_single_attr('ZIP', person)
-                ))
+            self._insert_or_update(Person, build_row(person))
 
             if person.get('CITATIONCODES') and person.get('CITATIONCODES', {}).get('CITATIONCODE'):
                 self._read_citation_data(person['CITATIONCODES']['CITATIONCODE'])
@@ -555,6 +635,7 @@ class CrashDataReader:
         Populates the acrs_person_info table.
         :param person_dict: Contains the list of OrderedDicts contained in the drivers, passengers and nonmotorists tags
         """
+        build_row = ROW_BUILDERS[PersonInfo]
         for person in person_dict:
             report_no = ''
             if person.get('PERSON'):
@@ -564,53 +645,21 @@ class CrashDataReader:
             if report_no == '':
                 raise AssertionError('No report number')
 
+            row = build_row(person)
             person_type = None
-            if self.get_single_attr('PEDESTRIANTYPE', person):
+            if row['PEDESTRIANTYPE']:
                 person_type = 'P'
-            elif self.get_single_attr('SEAT', person):
+            elif row['SEAT']:
                 person_type = 'O'
-            elif not self.get_single_attr('PEDESTRIANTYPE', person) and not self.get_single_attr('SEAT', person):
+            elif not row['PEDESTRIANTYPE'] and not row['SEAT']:
                 person_type = 'D'
 
             if person_type is None:
                 logger.warning('Unable to determine person_type')
 
-            self._insert_or_update(
-                PersonInfo(
-                    AIRBAGDEPLOYED=self.get_single_attr('AIRBAGDEPLOYED', person),
-                    ALCOHOLTESTINDICATOR=self.get_single_attr('ALCOHOLTESTINDICATOR', person),
-                    ALCOHOLTESTTYPE=self.get_single_attr('ALCOHOLTESTTYPE', person),
-                    ATFAULT=self.convert_to_bool(self.get_single_attr('ATFAULT', person)),
-                    BAC=self.get_single_attr('BAC', person),
-                    CONDITION=self.get_single_attr('CONDITION', person),
-                    CONTINUEDIRECTION=self.get_single_attr('CONTINUEDIRECTION', person),
-                    DRIVERDISTRACTEDBY=self.get_single_attr('DRIVERDISTRACTEDBY', person),
-                    DRUGTESTINDICATOR=self.get_single_attr('DRUGTESTINDICATOR', person),
-                    DRUGTESTRESULT=self.get_single_attr('DRUGTESTRESULT', person),
-                    EJECTION=self.get_single_attr('EJECTION', person),
-                    EMSRUNREPORTNUMBER=self.get_single_attr('EMSRUNREPORTNUMBER', person),
-                    EMSUNITNUMBER=self.get_single_attr('EMSUNITNUMBER', person),
-                    EQUIPMENTPROBLEM=self.get_single_attr('EQUIPMENTPROBLEM', person),
-                    GOINGDIRECTION=self.get_single_attr('GOINGDIRECTION', person),
-                    HASCDL=self.convert_to_bool(self.get_single_attr('HASCDL', person)),
-                    INJURYSEVERITY=self.get_single_attr('INJURYSEVERITY', person),
-                    PEDESTRIANACTIONS=self.get_single_attr('PEDESTRIANACTIONS', person),
-                    PEDESTRIANLOCATION=self.get_single_attr('PEDESTRIANLOCATION', person),
-                    PEDESTRIANMOVEMENT=self.get_single_attr('PEDESTRIANMOVEMENT', person),
-                    PEDESTRIANOBEYTRAFFICSIGNAL=self.get_single_attr('PEDESTRIANOBEYTRAFFICSIGNAL', person),
-                    PEDESTRIANTYPE=self.get_single_attr('PEDESTRIANTYPE', person),
-                    PEDESTRIANVISIBILITY=self.get_single_attr('PEDESTRIANVISIBILITY', person),
-                    PERSONID=self._validate_uniqueidentifier(self.get_single_attr('PERSONID', person)),
-                    PERSONTYPE=person_type,
-                    REPORTNUMBER=report_no,
-                    SAFETYEQUIPMENT=self.get_single_attr('SAFETYEQUIPMENT', person),
-                    SEAT=self.get_single_attr('SEAT', person),
-                    SEATINGLOCATION=self.get_single_attr('SEATINGLOCATION', person),
-                    SEATINGROW=self.get_single_attr('SEATINGROW', person),
-                    SUBSTANCEUSE=self.get_single_attr('SUBSTANCEUSE', person),
-                    UNITNUMBERFIRSTSTRIKE=self.get_single_attr('UNITNUMBERFIRSTSTRIKE', person),
-                    VEHICLEID=self._validate_uniqueidentifier(self.get_single_attr('VEHICLEID', person))
-                ))
+            row['PERSONTYPE'] = person_type
+            row['REPORTNUMBER'] = report_no
+            self._insert_or_update(PersonInfo, row)
 
     @check_and_log('reportdoc_dict')
     def _read_report_documents_data(self, reportdoc_dict: List[ReportDocumentType]):
@@ -626,24 +675,7 @@ class CrashDataReader:
         Populates the acrs_roadway table. Expects the ROADWAY tag contents
         :param roadway_dict: OrderedDict from the ROADWAY tag
         """
-        self._insert_or_update(
-            Roadway(
-                COUNTY=self.get_single_attr('COUNTY', roadway_dict),
-                LOGMILE_DIR=self.get_single_attr('LOGMILE_DIR', roadway_dict),
-                MILEPOINT=self.get_single_attr('MILEPOINT', roadway_dict),
-                MUNICIPAL=self.get_single_attr('MUNICIPAL', roadway_dict),
-                MUNICIPAL_AREA_CODE=self.get_single_attr('MUNICIPAL_AREA_CODE', roadway_dict),
-                REFERENCE_MUNI=self.get_single_attr('REFERENCE_MUNI', roadway_dict),
-                REFERENCE_ROADNAME=self.get_single_attr('REFERENCE_ROADNAME', roadway_dict),
-                REFERENCE_ROUTE_NUMBER=self.get_single_attr('REFERENCE_ROUTE_NUMBER', roadway_dict),
-                REFERENCE_ROUTE_SUFFIX=self.get_single_attr('REFERENCE_ROUTE_SUFFIX', roadway_dict),
-                REFERENCE_ROUTE_TYPE=self.get_single_attr('REFERENCE_ROUTE_TYPE', roadway_dict),
-                ROADID=self.get_single_attr('ROADID', roadway_dict),
-                ROAD_NAME=self.get_single_attr('ROAD_NAME', roadway_dict),
-                ROUTE_NUMBER=self.get_single_attr('ROUTE_NUMBER', roadway_dict),
-                ROUTE_SUFFIX=self.get_single_attr('ROUTE_SUFFIX', roadway_dict),
-                ROUTE_TYPE=self.get_single_attr('ROUTE_TYPE', roadway_dict)
-            ))
+        self._insert_or_update(Roadway, ROW_BUILDERS[Roadway](roadway_dict))
 
     @check_and_log('towed_dict')
     def _read_towed_vehicle_data(self, towed_dict: List[TowedUnitType]) -> None:
@@ -651,25 +683,12 @@ class CrashDataReader:
         Populates the acrs_towed_unit table
         :param towed_dict: The list of OrderedDicts that comes from the TOWEDUNITs tag
         """
+        build_row = ROW_BUILDERS[TowedUnit]
         for towed_unit in towed_dict:
             if towed_unit.get('OWNER'):
                 self._read_acrs_person_data([towed_unit['OWNER']])
 
-            self._insert_or_update(
-                TowedUnit(
-                    INSURANCEPOLICYNUMBER=self.get_single_attr('INSURANCEPOLICYNUMBER', towed_unit),
-                    INSURER=self.get_single_attr('INSURER', towed_unit),
-                    LICENSEPLATENUMBER=self.get_single_attr('LICENSEPLATENUMBER', towed_unit),
-                    LICENSEPLATESTATE=self.get_single_attr('LICENSEPLATESTATE', towed_unit),
-                    OWNERID=self._validate_uniqueidentifier(self.get_single_attr('OWNERID', towed_unit)),
-                    TOWEDID=self._validate_uniqueidentifier(self.get_single_attr('TOWEDID', towed_unit)),
-                    UNITNUMBER=self.get_single_attr('UNITNUMBER', towed_unit),
-                    VEHICLEID=self._validate_uniqueidentifier(self.get_single_attr('VEHICLEID', towed_unit)),
-                    VEHICLEMAKE=self.get_single_attr('VEHICLEMAKE', towed_unit),
-                    VEHICLEMODEL=self.get_single_attr('VEHICLEMODEL', towed_unit),
-                    VEHICLEYEAR=self.get_single_attr('VEHICLEYEAR', towed_unit),
-                    VIN=self.get_single_attr('VIN', towed_unit)
-                ))
+            self._insert_or_update(TowedUnit, build_row(towed_unit))
 
     @check_and_log('vehicle_dict')
     def _read_acrs_vehicle_data(self, vehicle_dict: List[VehicleType]) -> None:
@@ -677,53 +696,19 @@ class CrashDataReader:
         Populates the acrs_vehicles table
         :param vehicle_dict: List of OrderedDicts from the ACRSVEHICLE tag
         """
-        for vehicle in vehicle_dict:
-            vin = self.get_single_attr('VIN', vehicle)
-
-            vehicle_lookup = None
-            if vin is not None and len(vin) == 17:
-                vehicle_lookup = VIN(vin)
-
-            if not vehicle_lookup:
-                # just to make the rest of the logic work when there is no return
-                vehicle_lookup = DecodedVIN({'Make': None, 'Model': None, 'ModelYear': None})
-
-            self._insert_or_update(
-                Vehicle(
-                    CONTINUEDIRECTION=self.get_single_attr('CONTINUEDIRECTION', vehicle),
-                    DAMAGEEXTENT=self.get_single_attr('DAMAGEEXTENT', vehicle),
-                    DRIVERLESSVEHICLE=self.convert_to_bool(self.get_single_attr('DRIVERLESSVEHICLE', vehicle)),
-                    EMERGENCYMOTORVEHICLEUSE=self.convert_to_bool(
-                        self.get_single_attr('EMERGENCYMOTORVEHICLEUSE', vehicle)),
-                    FIRE=self.convert_to_bool(self.get_single_attr('FIRE', vehicle)),
-                    FIRSTIMPACT=self.get_single_attr('FIRSTIMPACT', vehicle),
-                    GOINGDIRECTION=self.get_single_attr('GOINGDIRECTION', vehicle),
-                    HITANDRUN=self.convert_to_bool(self.get_single_attr('HITANDRUN', vehicle)),
-                    INSURANCEPOLICYNUMBER=self.get_single_attr('INSURANCEPOLICYNUMBER', vehicle),
-                    INSURER=self.get_single_attr('INSURER', vehicle),
-                    LICENSEPLATENUMBER=self.get_single_attr('LICENSEPLATENUMBER', vehicle),
-                    LICENSEPLATESTATE=self.get_single_attr('LICENSEPLATESTATE', vehicle),
-                    MAINIMPACT=self.get_single_attr('MAINIMPACT', vehicle),
-                    MOSTHARMFULEVENT=self.get_single_attr('MOSTHARMFULEVENT', vehicle),
-                    OWNERID=self._validate_uniqueidentifier(self.get_single_attr('OWNERID', vehicle)),
-                    PARKEDVEHICLE=self.convert_to_bool(self.get_single_attr('PARKEDVEHICLE', vehicle)),
-                    REGISTRATIONEXPIRATIONYEAR=self.get_single_attr('REGISTRATIONEXPIRATIONYEAR', vehicle),
-                    REPORTNUMBER=self.get_single_attr('REPORTNUMBER', vehicle),
-                    SFVEHICLEINTRANSPORT=self.get_single_attr('SFVEHICLEINTRANSPORT', vehicle),
-                    SPEEDLIMIT=self.get_single_attr('SPEEDLIMIT', vehicle),
-                    TOWEDUNITTYPE=self.get_single_attr('TOWEDUNITTYPE', vehicle),
-                    UNITNUMBER=self.get_single_attr('UNITNUMBER', vehicle),
-                    VEHICLEBODYTYPE=self.get_single_attr('VEHICLEBODYTYPE', vehicle),
-                    VEHICLEID=self._validate_uniqueidentifier(self.get_single_attr('VEHICLEID', vehicle)),
-                    VEHICLEMAKE=getattr(vehicle_lookup, 'Make') or self.get_single_attr('VEHICLEMAKE', vehicle),
-                    VEHICLEMODEL=getattr(vehicle_lookup, 'Model') or self.get_single_attr('VEHICLEMODEL', vehicle),
-                    VEHICLEMOVEMENT=self.get_single_attr('VEHICLEMOVEMENT', vehicle),
-                    VEHICLEREMOVEDBY=self.get_single_attr('VEHICLEREMOVEDBY', vehicle),
-                    VEHICLEREMOVEDTO=self.get_single_attr('VEHICLEREMOVEDTO', vehicle),
-                    VEHICLETOWEDAWAY=self.get_single_attr('VEHICLETOWEDAWAY', vehicle),
-                    VEHICLEYEAR=getattr(vehicle_lookup, 'ModelYear') or self.get_single_attr('VEHICLEYEAR', vehicle),
-                    VIN=vin
-                ))
+        build_row = ROW_BUILDERS[Vehicle]
+        rows = [build_row(vehicle) for vehicle in vehicle_dict]
+        decoded_vins = self.vin_decoder.decode_batch(row['VIN'] for row in rows)
+
+        for vehicle, row in zip(vehicle_dict, rows):
+            # VINs that could not be decoded fall back to the make, model and year in the report
+            vehicle_lookup = decoded_vins.get(row['VIN'] or '')
+            make, model, model_year = (getattr(vehicle_lookup, attr, None) for attr in ('Make', 'Model', 'ModelYear'))
+            row['VEHICLEMAKE'] = make or row['VEHICLEMAKE']
+            row['VEHICLEMODEL'] = model or row['VEHICLEMODEL']
+            row['VEHICLEYEAR'] = model_year or row['VEHICLEYEAR']
+
+            self._insert_or_update(Vehicle, row)
 
             if vehicle.get('DAMAGEDAREAs') and vehicle.get('DAMAGEDAREAs', {}).get('DAMAGEDAREA'):
                 self._read_damaged_areas_data(vehicle['DAMAGEDAREAs']['DAMAGEDAREA'])
@@ -755,13 +740,9 @@ class CrashDataReader:
         Populates acrs_vehicle_use table
         :param vehicleuse_dict: The dictionary of the ACRSVEHICLE from the VEHICLEUSEs tag
         """
+        build_row = ROW_BUILDERS[VehicleUse]
         for vehicleuse in vehicleuse_dict:
-            self._insert_or_update(
-                VehicleUse(
-                    ID=self.get_single_attr('ID', vehicleuse),
-                    VEHICLEID=self._validate_uniqueidentifier(self.get_single_attr('VEHICLEID', vehicleuse)),
-                    VEHICLEUSECODE=self.get_single_attr('VEHICLEUSECODE', vehicleuse)
-                ))
+            self._insert_or_update(VehicleUse, build_row(vehicleuse))
 
     @check_and_log('damaged_dict')
     def _read_damaged_areas_data(self, damaged_dict: List[DamagedAreaType]) -> None:
@@ -769,13 +750,9 @@ class CrashDataReader:
         Populates the acrs_damaged_areas table. Expects to be passed the OrderedDict of DAMAGEDAREAs
         :param damaged_dict: The dictionary of the ACRSVEHICLE
         """
+        build_row = ROW_BUILDERS[DamagedArea]
         for damagedarea in damaged_dict:
-            self._insert_or_update(
-                DamagedArea(
-                    DAMAGEID=self.get_single_attr('DAMAGEID', damagedarea),
-                    IMPACTTYPE=self.get_single_attr('IMPACTTYPE', damagedarea),
-                    VEHICLEID=self._validate_uniqueidentifier(self.get_single_attr('VEHICLEID', damagedarea))
-                ))
+            self._insert_or_update(DamagedArea, build_row(damagedarea))
 
     @check_and_log('witness_dict')
     def _read_witness_data(self, witness_dict: List[WitnessType]) -> None:
@@ -783,15 +760,12 @@ class CrashDataReader:
         Populates the acrs_witnesses table
         :param witness_dict: The list of OrderedDicts from the WITNESSes tag
         """
+        build_row = ROW_BUILDERS[Witness]
         for witness in witness_dict:
             if witness.get('PERSON'):
                 self._read_acrs_person_data([witness['PERSON']])
 
-            self._insert_or_update(
-                Witness(
-                    PERSONID=self._validate_uniqueidentifier(self.get_single_attr('PERSONID', witness)),
-                    REPORTNUMBER=self.get_single_attr('REPORTNUMBER', witness)
-                ))
+            self._insert_or_update(Witness, build_row(witness))
 
     @staticmethod
     def is_element_nil(element: Optional[OrderedDict]) -> bool:
@@ -817,25 +791,12 @@ class CrashDataReader:
         :param val: Value to convert to a bool
         :return: Either True, False, or None (if the input was empty or 'u' for unknown)
         """
-        if val is None:
-            return None
-
-        if isinstance(val, bool):
-            return int(val)
-
-        val = val.lower()
-        if val not in ['y', 'n', 'u']:
-            raise AssertionError(f'Expected y or n and got {val}')
-        if val == 'u':
-            return None
-        return int(bool(val == 'y'))
+        return convert_to_bool(val)
 
     @staticmethod
     def _validate_uniqueidentifier(uid: Optional[str]) -> Optional[str]:
         """Checks for null uniqueidentifiers"""
-        if not uid:
-            return None
-        return uid
+        return to_uniqueidentifier(uid)
 
     def get_single_attr(self, tag: str, crash_data: Mapping) -> Optional[str]:
         """
@@ -846,21 +807,12 @@ class CrashDataReader:
         """
         if crash_data is None:
             return None
-
-        if crash_data.get(tag) is None or self.is_element_nil(crash_data.get(tag)):
-            return None
-
-        if not isinstance(crash_data.get(tag), str) and isinstance(crash_data.get(tag), collections.abc.Iterable):
-            raise AssertionError(f'Expected {tag} to have only a single element.')
-        return crash_data.get(tag)
+        return single_value(tag, crash_data.get(tag))
 
     @staticmethod
     def to_datetime_sql(dt_str: Optional[str]) -> Optional[datetime]:
-        """Converts a date string to the pandas starndard format, and returns None (instead of NaT) if invalid"""
-        try:
-            return to_datetime(dt_str)
-        except OutOfBoundsDatetime:
-            return None
+        """Converts a date string to a datetime, and returns None if it is outside of the range that pandas supports"""
+        return parse_datetime(dt_str)
 
 
 if __name__ == '__main__':
@@ -875,15 +827,33 @@ if __name__ == '__main__':
                                    '(if there are spaces), use double quotes.')
     parser.add_argument('-s', '--sanitize', action='store_true',
                               help='Sanitize the data from PII while being imported')
+    parser.add_argument('-g', '--offline_geocode', action='store_true',
+                              help='Look up census tracts with the bundled census tract file instead of ArcGIS')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                              help='Number of processes to parse the files in --directory with (default: 1)')
+    parser.add_argument('--writers', type=int, default=1,
+                        help='Number of database writers to use with --workers (default: 1)')
+    parser.add_argument('--vin_cache', default=':memory:',
+                        help='SQLite file to cache decoded VINs in, so they are only looked up once')
+    parser.add_argument('--offline_vin', action='store_true',
+                        help='Only decode VINs from --vin_cache, without looking them up online')
+    parser.add_argument('--bulk_insert', action='store_true',
+                        help='Write reports with plain INSERTs, and only update the reports that are already in the '
+                             'database. Faster for backfills')
 
     args = parser.parse_args()
 
-    cls = CrashDataReader(args.conn_str)
+    cls = CrashDataReader(args.conn_str,
+                          reverse_geocoder=GEOCODERS['offline' if args.offline_geocode else 'arcgis'],
+                          vin_decoder=VinDecoder(args.vin_cache, offline=args.offline_vin),
+                          bulk_insert=args.bulk_insert)
     if not (args.directory or args.file):
         logger.error('Must specify either a directory or file to process')
     if args.directory:
-        cls.read_crash_data(dir_name=args.directory, sanitize=args.sanitize)
+        cls.read_crash_data(dir_name=args.directory, sanitize=args.sanitize, workers=args.workers,
+                            writers=args.writers)
     if args.file:
         if not os.path.exists(args.file):
             logger.error(f'File does not exist: {args.file}')
         cls.read_crash_data(file_name=args.file, sanitize=args.sanitize)
+    cls.section_metrics.log()
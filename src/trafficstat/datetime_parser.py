@@ -0,0 +1,72 @@
+"""
+Parses the dates and times in ACRS reports. ACRS only uses a few ISO 8601 formats (2020-07-14T13:48:20, with up to six
+digits of fractional seconds), so those are parsed with datetime.fromisoformat instead of pandas.to_datetime, which is
+much slower per value. The format is worked out once for each shape of string (where the digits are), and anything that
+does not look like one of the ACRS formats is passed to pandas. The results are the same as pandas.to_datetime, except
+that dates pandas can not represent give None.
+"""
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Optional
+
+# The range of pandas.Timestamp, in microseconds. Dates outside of it (like a DOB of 0001-01-01) are not valid
+MIN_DATETIME = datetime(1677, 9, 21, 0, 12, 43, 145225)
+MAX_DATETIME = datetime(2262, 4, 11, 23, 47, 16, 854775)
+
+# Turns a date string into its shape, like 9999-99-99T99:99:99
+_SHAPE_TABLE = str.maketrans('0123456789', '9' * 10)
+_ISO_SHAPE_RE = re.compile(r'9999-99-99(?P<sep>[T ])99:99:99(?P<fraction>\.9{1,6})?|9999-99-99')
+
+
+@lru_cache(maxsize=64)
+def _get_parser(shape: str) -> Optional[Callable[[str], datetime]]:
+    """
+    Gets the parser for date strings with a shape
+    :param shape: The date string with its digits replaced by 9
+    :return: Function that parses date strings with this shape, or None if it is not one of the ACRS formats
+    """
+    match = _ISO_SHAPE_RE.fullmatch(shape)
+    if match is None:
+        return None
+
+    fraction = match.group('fraction')
+    if fraction is None or len(fraction) in (4, 7):
+        return datetime.fromisoformat
+
+    # fromisoformat only takes 3 or 6 digits of fractional seconds before Python 3.11, so the rest are padded to 6
+    padding = '0' * (7 - len(fraction))
+    return lambda dt_str: datetime.fromisoformat(dt_str + padding)
+
+
+def _pandas_to_datetime(dt_str: str) -> Optional[datetime]:
+    """The slow path, for strings that are not in one of the ACRS formats"""
+    # pylint:disable=import-outside-toplevel
+    from pandas import to_datetime  # type: ignore
+    from pandas.errors import OutOfBoundsDatetime  # type: ignore
+    try:
+        return to_datetime(dt_str)
+    except OutOfBoundsDatetime:
+        return None
+
+
+def parse_datetime(dt_str: Optional[str]) -> Optional[datetime]:
+    """
+    Parses an ACRS date string, like pandas.to_datetime
+    :param dt_str: The date string
+    :return: The datetime, or None if dt_str is None or is outside of the range that pandas supports. Invalid dates
+    raise the same errors as pandas.to_datetime.
+    """
+    if dt_str is None:
+        return None
+
+    parser = _get_parser(dt_str.translate(_SHAPE_TABLE))
+    if parser is None:
+        return _pandas_to_datetime(dt_str)
+
+    try:
+        parsed = parser(dt_str)
+    except ValueError:
+        # Dates like 2020-02-30 and 0000-01-01. pandas decides whether that is an error or None
+        return _pandas_to_datetime(dt_str)
+    return parsed if MIN_DATETIME <= parsed <= MAX_DATETIME else None
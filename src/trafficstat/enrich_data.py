@@ -8,113 +8,208 @@ CENSUS_TRACT (nvarchar(25)),
 ROAD_NAME_CLEAN (nvarchar(50)),
 REFERENCE_ROAD_NAME_CLEAN (nvarchar(50))
 """
+import argparse
 import re
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
 
-import pyodbc  # type: ignore
-from arcgis.geocoding import reverse_geocode  # type: ignore
-from arcgis.gis import GIS  # type: ignore
 from loguru import logger
+from sqlalchemy import bindparam, create_engine, select, update  # type: ignore
+from sqlalchemy.engine import Row, make_url  # type: ignore
+from sqlalchemy.orm import Session  # type: ignore
 from tqdm import tqdm  # type: ignore
 
-GIS()
+from .census_tract import CensusTractResolver, get_resolver
+from .geocoder import GEOCODERS, ReverseGeocoder, arcgis_reverse_geocode
+from .ms2generator_schema import RoadwaySanitized
+
+DEFAULT_CONN_STR = 'mssql+pyodbc://balt-sql311-prd/DOT_DATA?driver=ODBC Driver 17 for SQL Server'
+
+# Splits off the block number and the direction prefix. The road name is the fourth group, up to any parenthesis
+ROAD_NAME_RE = re.compile(r'(\d+\s+)?([NnEeSsWw](\.\s|\s|\.))?([^(]*)?')
+
+ROAD_SUFFIXES = {
+    'CONNECOR': 'CONNECTOR',
+    'STREET': 'ST',
+    'PARKWAY': 'PKWY',
+    'WAY': 'WY',
+    'LANE': 'LN',
+    'AVENUE': 'AVE',
+    'ROAD': 'RD',
+}
+
+# Every substitution that _word_replacer makes, in one pass: "BLOCK OF" and its variations are removed, road suffixes
+# are abbreviated and periods are removed. Words only match whole words, so WAYNE and BLOCKER are left alone.
+WORD_REPLACER_RE = re.compile(r'(?P<block>\b(?:UNIT )?BL(?:OC)?K\b\.?(?: OF\b)?)'
+                              r'| (?P<suffix>' + '|'.join(ROAD_SUFFIXES) + r')\b'
+                              r'|\.')
+
+
+def _replace_word(match: re.Match) -> str:
+    """WORD_REPLACER_RE.sub callback"""
+    suffix = match.group('suffix')
+    return ' ' + ROAD_SUFFIXES[suffix] if suffix else ''
+
+
+def replace_road_words(address: str) -> str:
+    """Does some standard address cleanup"""
+    return WORD_REPLACER_RE.sub(_replace_word, address.upper()).strip()
+
+
+@lru_cache(maxsize=16384)
+def clean_road_name(road_name: str) -> str:
+    """
+    Cleans and standardizes a road name, without the block number and direction. There are only a few thousand distinct
+    road names, so the results are cached.
+    :param road_name: ROAD_NAME or REFERENCE_ROAD_NAME from acrs_roadway_sanitized
+    """
+    road = ROAD_NAME_RE.search(road_name)
+    return replace_road_words(road.group(4) or '') if road is not None else ''
 
 
 class Enrich:
     """Handles data enrichment of the sanitized crash data from the Maryland State Highway Administration"""
-    def __init__(self):
-        conn = pyodbc.connect(r'Driver={SQL Server};Server=balt-sql311-prd;Database=DOT_DATA;Trusted_Connection=yes;')
-        self.cursor = conn.cursor()
+    def __init__(self, conn_str: str = DEFAULT_CONN_STR,
+                 reverse_geocoder: ReverseGeocoder = arcgis_reverse_geocode,
+                 workers: int = 1, chunk_size: int = 1000):
+        """
+        :param conn_str: sqlalchemy connection string
+        :param reverse_geocoder: Function that takes [X_COORDINATES, Y_COORDINATES] and returns a dict with a
+        census_tract key. Defaults to the ArcGIS reverse geocoder. Use geocoder.offline_reverse_geocode to geocode
+        without network access.
+        :param workers: Number of connections to write the updates with
+        :param chunk_size: Number of rows to update per transaction
+        """
+        logger.info("Creating db with connection string: {}", conn_str)
+        engine_args: Dict[str, Any] = {}
+        if make_url(conn_str).get_backend_name() == 'mssql':
+            # Sends each chunk of updates as one batch, instead of one round trip per row
+            engine_args.update(fast_executemany=True, pool_size=workers)
+        self.engine = create_engine(conn_str, future=True, **engine_args)
+        self.reverse_geocoder = reverse_geocoder
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def _update_roadways(self, values: Dict[str, Any], rows: List[Dict[str, Any]]) -> None:
+        """
+        Updates rows of acrs_roadway_sanitized by REPORT_NO. The rows are split into chunks of chunk_size rows, which
+        are each committed on their own, so if this is interrupted, the chunks that were written are kept. With more
+        than one worker, the chunks are written on that many connections at once.
+        :param values: Column name to bind parameter name for the columns to set
+        :param rows: Dictionaries with a report_no key, and a key for each of the bind parameters in values
+        """
+        stmt = update(RoadwaySanitized).\
+            where(RoadwaySanitized.REPORT_NO == bindparam('report_no')).\
+            values({column: bindparam(param) for column, param in values.items()})
+
+        def write_chunk(chunk: List[Dict[str, Any]]) -> None:
+            with self.engine.begin() as connection:
+                connection.execute(stmt, chunk)
+
+        chunks = [rows[i:i + self.chunk_size] for i in range(0, len(rows), self.chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in tqdm(executor.map(write_chunk, chunks), total=len(chunks)):
+                pass
+
+    def _roadways(self, *columns) -> List[Row]:
+        """Gets REPORT_NO and the given columns of the roadways that are missing a census tract"""
+        with Session(self.engine) as session:
+            return session.execute(select(RoadwaySanitized.REPORT_NO, *columns).
+                                   where(RoadwaySanitized.CENSUS_TRACT.is_(None))).fetchall()
 
     def geocode_acrs_sanitized(self) -> None:
         """
         Fills in the CENSUS_TRACT column in acrs_roadway_sanitized
         :return: None
         """
-        self.cursor.execute("""
-        SELECT [REPORT_NO], [X_COORDINATES], [Y_COORDINATES]
-        FROM [acrs_roadway_sanitized]
-        WHERE [CENSUS_TRACT] IS NULL
-        """)
-
-        data: List[Tuple[str, str]] = []
-        for row in tqdm(self.cursor.fetchall()):
+        data: List[Dict[str, Any]] = []
+        for row in tqdm(self._roadways(RoadwaySanitized.X_COORDINATES, RoadwaySanitized.Y_COORDINATES)):
             try:
-                geocode_result = reverse_geocode([row[1], row[2]])
+                geocode_result = self.reverse_geocoder([row[1], row[2]])
             except RuntimeError as err:
                 logger.error("Runtime error: {err}", err=err)
                 continue
 
             if geocode_result is not None and geocode_result.get('census_tract'):
-                data.append((geocode_result['census_tract'], row[0]))
+                data.append({'census_tract': geocode_result['census_tract'], 'report_no': row[0]})
                 continue
 
             logger.warning('No census tract for sanitized roadway: {row}', row=row)
 
-        if data:
-            self.cursor.executemany("""
-                    UPDATE [acrs_roadway_sanitized]
-                    SET CENSUS_TRACT = ?
-                    WHERE REPORT_NO = ?
-                    """, data)
-            self.cursor.commit()
+        self._update_roadways({'CENSUS_TRACT': 'census_tract'}, data)
+
+    def geocode_acrs_sanitized_batch(self, resolver: Optional[CensusTractResolver] = None) -> None:
+        """
+        Fills in the CENSUS_TRACT column in acrs_roadway_sanitized with the local census tract file, resolving every
+        row at once instead of geocoding them one at a time. The updates are committed every chunk_size rows, so if this
+        is interrupted, running it again picks up where it left off.
+        :param resolver: Census tract resolver to use. Defaults to the shared resolver for the bundled census tract file
+        :return: None
+        """
+        import pandas as pd  # type: ignore  # pylint:disable=import-outside-toplevel
+
+        resolver = resolver or get_resolver()
+        rows = self._roadways(RoadwaySanitized.X_COORDINATES, RoadwaySanitized.Y_COORDINATES)
+
+        # X_COORDINATES is the latitude. Missing or malformed coordinates become NaN, which never resolve
+        latitudes = pd.to_numeric(pd.Series([row[1] for row in rows], dtype=object), errors='coerce')
+        longitudes = pd.to_numeric(pd.Series([row[2] for row in rows], dtype=object), errors='coerce')
+        census_tracts = resolver.get_census_tracts(latitudes.to_numpy(dtype=float), longitudes.to_numpy(dtype=float))
+
+        data = [{'census_tract': census_tract, 'report_no': row[0]}
+                for census_tract, row in zip(census_tracts, rows) if census_tract]
+        if len(data) < len(rows):
+            logger.warning('No census tract for {} of {} sanitized roadways', len(rows) - len(data), len(rows))
+
+        self._update_roadways({'CENSUS_TRACT': 'census_tract'}, data)
 
     def clean_road_names(self) -> None:
         """
         Cleans and standarizes the road names
         :return:
         """
-        self.cursor.execute("""
-        SELECT [REPORT_NO], [ROAD_NAME], [REFERENCE_ROAD_NAME]
-        FROM [acrs_roadway_sanitized]
-        WHERE [ROAD_NAME_CLEAN] IS NULL
-        """)
-
-        data: List[Tuple[str, str, str]] = []
-        for row in tqdm(self.cursor.fetchall()):
-            road_name_clean = ''
-            ref_road_name_clean = ''
-            if isinstance(row[1], str):
-                road = re.search(r'(\d+\s+)?([NnEeSsWw](\.\s|\s|\.))?([^(]*)?', row[1])
-                road_name_clean = self._word_replacer(road.group(4)) if road is not None else ''
-            if isinstance(row[2], str):
-                road = re.search(r'(\d+\s+)?([NnEeSsWw](\.\s|\s|\.))?([^(]*)?', row[2])
-                ref_road_name_clean = self._word_replacer(road.group(4)) if road is not None else ''
+        with Session(self.engine) as session:
+            rows = session.execute(select(RoadwaySanitized.REPORT_NO, RoadwaySanitized.ROAD_NAME,
+                                          RoadwaySanitized.REFERENCE_ROAD_NAME).
+                                   where(RoadwaySanitized.ROAD_NAME_CLEAN.is_(None))).fetchall()
+
+        data: List[Dict[str, Any]] = []
+        for row in tqdm(rows):
+            road_name_clean = clean_road_name(row[1]) if isinstance(row[1], str) else ''
+            ref_road_name_clean = clean_road_name(row[2]) if isinstance(row[2], str) else ''
 
             if road_name_clean or ref_road_name_clean:
-                data.append((road_name_clean, ref_road_name_clean, row[0]))
+                data.append({'road_name_clean': road_name_clean, 'ref_road_name_clean': ref_road_name_clean,
+                             'report_no': row[0]})
 
-        if data:
-            self.cursor.executemany("""
-                UPDATE [acrs_roadway_sanitized]
-                SET ROAD_NAME_CLEAN = ?, REFERENCE_ROAD_NAME_CLEAN = ?
-                WHERE REPORT_NO = ?
-                """, data)
-            self.cursor.commit()
+        self._update_roadways({'ROAD_NAME_CLEAN': 'road_name_clean',
+                               'REFERENCE_ROAD_NAME_CLEAN': 'ref_road_name_clean'}, data)
 
     @staticmethod
     def _word_replacer(address: str) -> str:
         """Does some standard address cleanup"""
-        address = address.upper()
-        for orig, repl in [(" CONNECOR", " CONNECTOR"),
-                           (" STREET", " ST"),
-                           (" PARKWAY", " PKWY"),
-                           (" WAY", " WY"),
-                           (" LANE", " LN"),
-                           (" AVENUE", " AVE"),
-                           (" ROAD", " RD"),
-                           (".", ""),
-                           ("UNIT BLK OF", ""), ("UNIT BLOCK OF", ""),
-                           ("UNIT BLK", ""), ("UNIT BLOCK", ""),
-                           ("BLK OF", ""), ("BLOCK OF", ""),
-                           ("BLK", ""), ("BLOCK", "")
-                           ]:
-            address = address.replace(orig, repl)
-
-        return address.strip()
+        return replace_road_words(address)
 
 
 if __name__ == '__main__':
-    enricher = Enrich()
-    enricher.geocode_acrs_sanitized()
+    parser = argparse.ArgumentParser(description='Adds census tracts and cleaned road names to the sanitized ACRS data')
+    parser.add_argument('-c', '--conn_str', help='Custom database connection string', default=DEFAULT_CONN_STR)
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of database connections to write the updates with (default: 1)')
+    parser.add_argument('--chunk_size', type=int, default=1000,
+                        help='Number of rows to update per transaction (default: 1000)')
+    parser.add_argument('-g', '--offline_geocode', action='store_true',
+                        help='Look up census tracts with the bundled census tract file instead of ArcGIS. The rows are '
+                             'looked up all at once, and committed in batches')
+
+    args = parser.parse_args()
+
+    enricher = Enrich(args.conn_str,
+                      reverse_geocoder=GEOCODERS['offline' if args.offline_geocode else 'arcgis'],
+                      workers=args.workers, chunk_size=args.chunk_size)
+    if args.offline_geocode:
+        enricher.geocode_acrs_sanitized_batch()
+    else:
+        enricher.geocode_acrs_sanitized()
     enricher.clean_road_names()
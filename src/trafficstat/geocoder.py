@@ -0,0 +1,43 @@
+"""
+Reverse geocoders that look up the census tract of a crash. A reverse geocoder is any function that takes
+[latitude, longitude] and returns a dict with a census_tract key (or None if there is no match), like
+arcgis.geocoding.reverse_geocode does. The ArcGIS connection is only made the first time that it is used, so importing
+the ingester or enricher does not need network access.
+"""
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Sequence
+
+ReverseGeocoder = Callable[[Sequence[float]], Optional[dict]]
+
+
+@lru_cache(maxsize=None)
+def _arcgis_connection():
+    """Connects to ArcGIS Online, once per process"""
+    from arcgis.gis import GIS  # type: ignore  # pylint:disable=import-outside-toplevel
+    return GIS()
+
+
+def arcgis_reverse_geocode(location: Sequence[float]) -> Optional[dict]:
+    """
+    Looks up a location with the ArcGIS Online reverse geocoder
+    :param location: [latitude, longitude]
+    """
+    _arcgis_connection()
+    from arcgis.geocoding import reverse_geocode  # type: ignore  # pylint:disable=import-outside-toplevel
+    return reverse_geocode(location)
+
+
+def offline_reverse_geocode(location: Sequence[float]) -> Optional[dict]:
+    """
+    Looks up a location in the bundled census tract file (see census_tract.reverse_geocode)
+    :param location: [latitude, longitude]
+    """
+    from .census_tract import reverse_geocode  # pylint:disable=import-outside-toplevel
+    return reverse_geocode(location)
+
+
+# Geocoder name: reverse geocoder, for the command line scripts
+GEOCODERS: Dict[str, ReverseGeocoder] = {
+    'arcgis': arcgis_reverse_geocode,
+    'offline': offline_reverse_geocode,
+}
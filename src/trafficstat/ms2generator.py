@@ -2,14 +2,19 @@
 import argparse
 import datetime
 import uuid
-from typing import Dict, Optional
+from collections import Counter
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
 
 import xlsxwriter  # type: ignore
 from loguru import logger
-from sqlalchemy import and_, create_engine, select  # type: ignore
+from sqlalchemy import and_, create_engine, func, select  # type: ignore
+from sqlalchemy.engine import Row  # type: ignore
 from sqlalchemy.orm import Session  # type: ignore
+from sqlalchemy.sql import Select  # type: ignore
 
-from .ms2generator_schema import Base, CircumstanceSanitized, CrashSanitized, EmsSanitized, \
+from .ms2generator_schema import Base, CircumstanceSanitized, CrashSanitized, EmsSanitized, Ms2ExportState, \
     PersonSanitized, RoadwaySanitized, VehicleSanitized
 
 SEX = {
@@ -230,10 +235,108 @@ TANG_ROAD = {
 }
 
 
+def _code_table(*tables: Dict[str, str]) -> Mapping[str, str]:
+    """Merges code tables into a read only mapping. Later tables take precedence"""
+    merged: Dict[str, str] = {}
+    for table in tables:
+        merged.update(table)
+    return MappingProxyType(merged)
+
+
+# The valid codes for each type of circumstance, and the lookups for coded columns. These are built once, instead of
+# each time a value is validated.
+CODE_TABLES: Mapping[str, Mapping[str, str]] = MappingProxyType({
+    'vehicle': _code_table(TANG_VEHICLE, TANG_MASTER, ACRS_VEHICLE),
+    'person': _code_table(TANG_PERSON, TANG_MASTER, ACRS_PERSON),
+    'weather': _code_table(TANG_WEATHER, TANG_MASTER, ACRS_WEATHER),
+    'road': _code_table(TANG_ROAD, TANG_MASTER, ACRS_ROAD),
+    'sex': _code_table(TANG_MASTER, SEX),
+    'direction': _code_table(TANG_MASTER, DIRECTION),
+})
+
+
+def validate_codes(vals: Iterable, code_type: str) -> Tuple[List[Optional[str]], Counter]:
+    """
+    Validates a column of circumstance codes
+    :param vals: The codes to validate
+    :param code_type: The CODE_TABLES key of the codes: vehicle, person, weather or road
+    :return: Tuple of the validated codes, in the same order as vals, and a Counter of the invalid codes. Codes that are
+    blank (None or A9.99) or invalid are returned as None.
+    """
+    code_table = CODE_TABLES[code_type]
+    validated: List[Optional[str]] = []
+    invalid: Counter = Counter()
+    for val in vals:
+        if val is None or val == 'A9.99':
+            validated.append(None)
+            continue
+
+        val = str(val)
+        if val in code_table:
+            validated.append(val)
+        else:
+            validated.append(None)
+            invalid[val] += 1
+    return validated, invalid
+
+
+def lookup_codes(vals: Iterable, code_type: str) -> List[Optional[str]]:
+    """
+    Looks up the descriptions of a column of codes
+    :param vals: The codes to look up
+    :param code_type: The CODE_TABLES key of the codes, such as sex or direction
+    :return: The descriptions, in the same order as vals. Unknown codes are None
+    """
+    code_table = CODE_TABLES[code_type]
+    return [code_table.get(val) for val in vals]
+
+
+def log_invalid_codes(invalid: Counter, code_type: str) -> None:
+    """Logs a summary of the invalid codes that were skipped, instead of one error per code"""
+    if invalid:
+        logger.error('Skipped {} invalid {} codes: {}. Expected values {}', sum(invalid.values()), code_type,
+                     dict(invalid.most_common()), list(CODE_TABLES[code_type]))
+
+
+# The ms2_export_state row that incremental exports keep their watermark in
+EXPORT_NAME = 'ms2'
+
+# Namespace for the PERSON_ID and VEHICLE_ID UUIDs. Changing it changes every id in MS2
+MS2_UUID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'https://github.com/city-of-baltimore/trafficstat/ms2')
+
+
+@lru_cache(maxsize=2 ** 16)
+def ms2_uuid(id_type: str, id_val) -> str:
+    """
+    Gets the UUID that MS2 uses for a person or vehicle. The UUID only depends on the id, so it is the same on every
+    export.
+    :param id_type: person or vehicle
+    :param id_val: PERSON_ID or VEHICLE_ID from the sanitized tables. These are floats in some tables and strings in
+    others, so whole numbers are normalized to the same string (1.0 and '1' are both '1')
+    """
+    if isinstance(id_val, float) and id_val.is_integer():
+        id_val = int(id_val)
+    return str(uuid.uuid5(MS2_UUID_NAMESPACE, f'{id_type}:{id_val}'))
+
+
 class WorksheetMaker:  # pylint:disable=too-many-instance-attributes
     """Creates XLSX files with crash data from the DOT_DATA table for MS2"""
 
-    def __init__(self, conn_str: str, workbook_name: str = 'BaltimoreCrash.xlsx'):
+    def __init__(self, conn_str: str, workbook_name: str = 'BaltimoreCrash.xlsx',  # pylint:disable=too-many-arguments
+                 streaming: bool = False, chunk_size: int = 1000, incremental: bool = False, lookback_days: int = 30):
+        """
+        :param conn_str: sqlalchemy connection string
+        :param workbook_name: Path of the XLSX file to create
+        :param streaming: Keep memory use bounded, regardless of the size of the export. The queries are read chunk_size
+        rows at a time with server side cursors, and the workbook is written with xlsxwriter's constant_memory mode,
+        which flushes each row to disk when the next one is started.
+        :param chunk_size: Number of rows to fetch at a time in streaming mode
+        :param incremental: Only export the reports with an ACC_DATE after the watermark in the ms2_export_state table,
+        less lookback_days. The watermark is moved to the latest ACC_DATE when the workbook is closed. If there is no
+        watermark yet, every report is exported.
+        :param lookback_days: Number of days before the watermark to export again in incremental mode, to pick up
+        reports that were approved, or amended, after the last export
+        """
         logger.info("Creating db with connection string: {}", conn_str)
         self.engine = create_engine(conn_str, echo=True, future=True)
 
@@ -241,12 +344,24 @@ class WorksheetMaker:  # pylint:disable=too-many-instance-attributes
             Base.metadata.create_all(connection)
 
         self.workbook_name = workbook_name
-
-        self.vehicle_id_dict: dict = {}
-        self.person_id_dict: dict = {}
-
-        self.workbook = xlsxwriter.Workbook(self.workbook_name)
-        self.date_fmt = self.workbook.add_format({'num_format': 'mm/dd/yy'})
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+
+        self.incremental = incremental
+        self.since: Optional[datetime.datetime] = None
+        self.watermark: Optional[datetime.datetime] = None
+        if incremental:
+            with Session(self.engine) as session:
+                state = session.get(Ms2ExportState, EXPORT_NAME)
+                self.watermark = session.execute(select(func.max(CrashSanitized.ACC_DATE))).scalar()
+            if state is not None and state.ACC_DATE is not None:
+                self.since = state.ACC_DATE - datetime.timedelta(days=lookback_days)
+                logger.info('Exporting reports with an ACC_DATE after {}', self.since)
+
+        # Datetimes get the default date format, so that whole rows can be written with write_row
+        self.workbook = xlsxwriter.Workbook(self.workbook_name, {'constant_memory': streaming,
+                                                                 'default_date_format': 'mm/dd/yy'})
+        self.date_fmt = self.workbook.default_date_format
 
         # These have to exist, but do not need to be populated
         self.person_circum_ws = self.workbook.add_worksheet("PERSON_CIRCUM")
@@ -265,48 +380,104 @@ class WorksheetMaker:  # pylint:disable=too-many-instance-attributes
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.workbook.close()
+        if self.incremental and exc_type is None:
+            self._save_watermark()
 
-    def add_crash_worksheet(self) -> None:  # pylint:disable=too-many-branches
+    def _save_watermark(self) -> None:
+        """Records the latest ACC_DATE that was exported, so that the next incremental export starts from there"""
+        if self.watermark is None:
+            return
+
+        with Session(self.engine) as session:
+            session.merge(Ms2ExportState(EXPORT_NAME=EXPORT_NAME, ACC_DATE=self.watermark,
+                                         EXPORT_DATE=datetime.datetime.now()))
+            session.commit()
+
+    def _changed_reports(self, stmt: Select, report_no_column) -> Select:
+        """
+        Limits a worksheet query to the reports in this export. That is every report, unless this is incremental.
+        :param stmt: The worksheet query
+        :param report_no_column: The REPORT_NO column of the table that the query selects from
+        """
+        if self.since is None:
+            return stmt
+        return stmt.where(report_no_column.in_(
+            select(CrashSanitized.REPORT_NO).where(CrashSanitized.ACC_DATE > self.since)))
+
+    def _partitions(self, session: Session, stmt: Select) -> Iterator[Sequence[Row]]:
+        """
+        Runs a worksheet query, and returns its rows in chunks. In streaming mode, the rows are fetched chunk_size at a
+        time with a server side cursor. Otherwise, every row is fetched up front and returned as one chunk.
+        """
+        if not self.streaming:
+            yield session.execute(stmt).fetchall()
+            return
+
+        result = session.execute(stmt.execution_options(stream_results=True, max_row_buffer=self.chunk_size))
+        yield from result.partitions(self.chunk_size)
+
+    def _rows(self, session: Session, stmt: Select) -> Iterator[Row]:
+        """Runs a worksheet query, and returns its rows. See _partitions"""
+        for rows in self._partitions(session, stmt):
+            yield from rows
+
+    def _column_plan(self, header_list: List[str], formatters: Dict[str, Callable]) -> List[Callable]:
+        """
+        Builds the formatter for each column of a worksheet, once per worksheet instead of once per cell
+        :param header_list: The (renamed) column names of the worksheet
+        :param formatters: The formatters for the columns that need special handling. The other columns are
+        standardized, and datetimes get the workbook's date format when they are written.
+        :return: One formatter per column, in the same order as header_list
+        """
+        return [formatters.get(header, self._standardize_value) for header in header_list]
+
+    @staticmethod
+    def _write_planned_row(worksheet, row_no: int, column_plan: List[Callable], row: Sequence) -> None:
+        """Formats a row with the formatters from _column_plan, and writes it to the worksheet"""
+        worksheet.write_row(row_no, 0, [formatter(val) for formatter, val in zip(column_plan, row)])
+
+    def add_crash_worksheet(self) -> None:
         """Generates the worksheet for the acrs_crash_sanitized table"""
         with Session(self.engine) as session:
-            qry_sanitized = session.query(CrashSanitized.LIGHT_CODE,
-                                          CrashSanitized.COUNTY_NO,
-                                          CrashSanitized.MUNI_CODE,
-                                          CrashSanitized.JUNCTION_CODE,
-                                          CrashSanitized.COLLISION_TYPE_CODE,
-                                          CrashSanitized.SURF_COND_CODE,
-                                          CrashSanitized.LANE_CODE,
-                                          CrashSanitized.RD_COND_CODE,
-                                          RoadwaySanitized.RD_DIV_CODE,
-                                          CrashSanitized.FIX_OBJ_CODE,
-                                          CrashSanitized.REPORT_NO,
-                                          CrashSanitized.REPORT_TYPE_CODE,  # REPORT_TYPE_CODE as REPORT_TYPE,
-                                          CrashSanitized.WEATHER_CODE,
-                                          CrashSanitized.ACC_DATE,
-                                          CrashSanitized.ACC_TIME,
-                                          CrashSanitized.LOC_CODE,
-                                          CrashSanitized.SIGNAL_FLAG,
-                                          CrashSanitized.C_M_ZONE_FLAG,
-                                          CrashSanitized.AGENCY_CODE,
-                                          CrashSanitized.AREA_CODE,
-                                          CrashSanitized.HARM_EVENT_CODE1,
-                                          CrashSanitized.HARM_EVENT_CODE2,
-                                          RoadwaySanitized.ROUTE_NUMBER,  # ROUTE_NUMBER as RTE_NO,
-                                          RoadwaySanitized.ROUTE_TYPE_CODE,
-                                          RoadwaySanitized.ROUTE_SUFFIX,  # ROUTE_SUFFIX as RTE_SUFFIX,
-                                          RoadwaySanitized.LOG_MILE,
-                                          RoadwaySanitized.LOGMILE_DIR_FLAG,
-                                          RoadwaySanitized.ROAD_NAME,  # ROAD_NAME as MAINROAD_NAME,
-                                          RoadwaySanitized.DISTANCE,
-                                          RoadwaySanitized.FEET_MILES_FLAG,
-                                          RoadwaySanitized.DISTANCE_DIR_FLAG,
-                                          RoadwaySanitized.REFERENCE_NUMBER,  # REFERENCE_NUMBER as REFERENCE_NO,
-                                          RoadwaySanitized.REFERENCE_TYPE_CODE,
-                                          RoadwaySanitized.REFERENCE_SUFFIX,
-                                          RoadwaySanitized.REFERENCE_ROAD_NAME,
-                                          RoadwaySanitized.X_COORDINATES,  # X_COORDINATES as LATITUDE,
-                                          RoadwaySanitized.Y_COORDINATES  # Y_COORDINATES as LONGITUDE
-                                          ).join(CrashSanitized.ROADWAY)
+            qry_sanitized = select(CrashSanitized.LIGHT_CODE,
+                                   CrashSanitized.COUNTY_NO,
+                                   CrashSanitized.MUNI_CODE,
+                                   CrashSanitized.JUNCTION_CODE,
+                                   CrashSanitized.COLLISION_TYPE_CODE,
+                                   CrashSanitized.SURF_COND_CODE,
+                                   CrashSanitized.LANE_CODE,
+                                   CrashSanitized.RD_COND_CODE,
+                                   RoadwaySanitized.RD_DIV_CODE,
+                                   CrashSanitized.FIX_OBJ_CODE,
+                                   CrashSanitized.REPORT_NO,
+                                   CrashSanitized.REPORT_TYPE_CODE,  # REPORT_TYPE_CODE as REPORT_TYPE,
+                                   CrashSanitized.WEATHER_CODE,
+                                   CrashSanitized.ACC_DATE,
+                                   CrashSanitized.ACC_TIME,
+                                   CrashSanitized.LOC_CODE,
+                                   CrashSanitized.SIGNAL_FLAG,
+                                   CrashSanitized.C_M_ZONE_FLAG,
+                                   CrashSanitized.AGENCY_CODE,
+                                   CrashSanitized.AREA_CODE,
+                                   CrashSanitized.HARM_EVENT_CODE1,
+                                   CrashSanitized.HARM_EVENT_CODE2,
+                                   RoadwaySanitized.ROUTE_NUMBER,  # ROUTE_NUMBER as RTE_NO,
+                                   RoadwaySanitized.ROUTE_TYPE_CODE,
+                                   RoadwaySanitized.ROUTE_SUFFIX,  # ROUTE_SUFFIX as RTE_SUFFIX,
+                                   RoadwaySanitized.LOG_MILE,
+                                   RoadwaySanitized.LOGMILE_DIR_FLAG,
+                                   RoadwaySanitized.ROAD_NAME,  # ROAD_NAME as MAINROAD_NAME,
+                                   RoadwaySanitized.DISTANCE,
+                                   RoadwaySanitized.FEET_MILES_FLAG,
+                                   RoadwaySanitized.DISTANCE_DIR_FLAG,
+                                   RoadwaySanitized.REFERENCE_NUMBER,  # REFERENCE_NUMBER as REFERENCE_NO,
+                                   RoadwaySanitized.REFERENCE_TYPE_CODE,
+                                   RoadwaySanitized.REFERENCE_SUFFIX,
+                                   RoadwaySanitized.REFERENCE_ROAD_NAME,
+                                   RoadwaySanitized.X_COORDINATES,  # X_COORDINATES as LATITUDE,
+                                   RoadwaySanitized.Y_COORDINATES  # Y_COORDINATES as LONGITUDE
+                                   ).join(CrashSanitized.ROADWAY)
+            qry_sanitized = self._changed_reports(qry_sanitized, CrashSanitized.REPORT_NO)
 
             worksheet = self.workbook.add_worksheet("CRASH")
             key_subs = {
@@ -320,7 +491,7 @@ class WorksheetMaker:  # pylint:disable=too-many-instance-attributes
             }
 
             row_no = 0
-            for row in qry_sanitized.all():
+            for row in self._rows(session, qry_sanitized):
                 if row_no == 0:
                     # Build header row
                     header_list = list(row.keys())
@@ -328,77 +499,61 @@ class WorksheetMaker:  # pylint:disable=too-many-instance-attributes
                         header_list[header_list.index(orig)] = repl
                     worksheet.write_row(0, 0, header_list)
 
-                    # These columns need to be zero padded, to make them a two digit number
-                    padded_ints = [header_list.index('LIGHT_CODE'), header_list.index('COLLISION_TYPE_CODE'),
-                                   header_list.index('FIX_OBJ_CODE'), header_list.index('WEATHER_CODE'),
-                                   header_list.index('HARM_EVENT_CODE1'), header_list.index('HARM_EVENT_CODE2')]
+                    column_plan = self._column_plan(header_list, {
+                        'ACC_DATE': lambda val: val.strftime('%m/%d/%Y'),
+                        'REPORT_TYPE': REPORT_TYPE.get,
+                        'ACC_TIME': self._format_time,
+                        # needs to be a three digit number, left zero padded
+                        'MUNI_CODE': lambda val: str(val).zfill(3),
+                        # These columns need to be zero padded, to make them a two digit number
+                        'LIGHT_CODE': self._zero_pad_code,
+                        'COLLISION_TYPE_CODE': self._zero_pad_code,
+                        'FIX_OBJ_CODE': self._zero_pad_code,
+                        'WEATHER_CODE': self._zero_pad_code,
+                        'HARM_EVENT_CODE1': self._zero_pad_code,
+                        'HARM_EVENT_CODE2': self._zero_pad_code,
+                        'C_M_ZONE_FLAG': self._format_flag,
+                    })
 
                     row_no += 1
 
-                for element_no, _ in enumerate(row):
-
-                    # Deal with the special cases
-                    if element_no == header_list.index('ACC_DATE'):
-                        worksheet.write(row_no, element_no, row[element_no].strftime('%m/%d/%Y'))
-                    elif element_no == header_list.index('REPORT_TYPE'):
-                        worksheet.write(row_no, element_no, REPORT_TYPE.get(row[element_no]))
-                    elif element_no == header_list.index('ACC_TIME'):
-                        if isinstance(row[element_no], datetime.time):
-                            worksheet.write(row_no, element_no, row[element_no].strftime('%H%M'))
-                        else:
-                            # needs to be a four digit number, left zero padded
-                            worksheet.write(row_no, element_no, str(row[element_no]).zfill(4))
-                    elif element_no == header_list.index('MUNI_CODE'):
-                        # needs to be a three digit number, left zero padded
-                        worksheet.write(row_no, element_no, str(row[element_no]).zfill(3))
-                    elif element_no in padded_ints:
-                        val = int(row[element_no]) if isinstance(row[element_no], float) else row[element_no]
-
-                        # needs to be a two digit number, left zero padded
-                        worksheet.write(row_no, element_no, str(val).zfill(2))
-                    elif element_no == header_list.index('C_M_ZONE_FLAG') and isinstance(row[element_no], bool):
-                        worksheet.write(row_no, element_no, 'Y' if row[element_no] else 'N')
-
-                    # Other cases
-                    elif isinstance(row[element_no], datetime.datetime):
-                        worksheet.write(row_no, element_no, row[element_no], self.date_fmt)
-                    else:
-                        worksheet.write(row_no, element_no, self._standardize_value(row[element_no]))
+                self._write_planned_row(worksheet, row_no, column_plan, row)
                 row_no += 1
 
     def add_person_worksheet(self) -> None:
         """Generates the worksheet for the acrs_person_sanitized table"""
         with Session(self.engine) as session:
-            qry = session.execute(select(PersonSanitized.SEX,
-                                         PersonSanitized.CONDITION_CODE,
-                                         PersonSanitized.INJ_SEVER_CODE,
-                                         PersonSanitized.REPORT_NO,
-                                         PersonSanitized.OCC_SEAT_POS_CODE,
-                                         PersonSanitized.PED_VISIBLE_CODE,
-                                         PersonSanitized.PED_LOCATION_CODE,
-                                         PersonSanitized.PED_OBEY_CODE,
-                                         PersonSanitized.PED_TYPE_CODE,
-                                         PersonSanitized.MOVEMENT_CODE,
-                                         PersonSanitized.PERSON_TYPE,
-                                         PersonSanitized.ALCO_TEST_CODE,  # ALCO_TEST_CODE as ALCOHOL_TEST_CODE,
-                                         PersonSanitized.ALCO_TEST_TYPE_CODE,
-                                         # ALCO_TEST_TYPE_CODE as ALCOHOL_TESTTYPE_CODE,
-                                         PersonSanitized.DRUG_TEST_CODE,
-                                         PersonSanitized.DRUG_TEST_RESULT_FLAG,
-                                         # DRUG_TEST_RESULT_FLAG as DRUG_TESTRESULT_CODE,
-                                         PersonSanitized.BAC,  # BAC as BAC_CODE,
-                                         PersonSanitized.FAULT_FLAG,
-                                         PersonSanitized.EQUIP_PROB_CODE,
-                                         PersonSanitized.SAF_EQUIP_CODE,
-                                         PersonSanitized.EJECT_CODE,
-                                         PersonSanitized.AIR_BAG_CODE,  # AIR_BAG_CODE as AIRBAG_DEPLOYED,
-                                         PersonSanitized.DRIVER_DOB,  # DRIVER_DOB as DATE_OF_BIRTH,
-                                         PersonSanitized.PERSON_ID,
-                                         PersonSanitized.STATE_CODE,  # STATE_CODE as LICENSE_STATE_CODE,
-                                         PersonSanitized.CLASS,
-                                         PersonSanitized.CDL_FLAG,
-                                         PersonSanitized.VEHICLE_ID,
-                                         PersonSanitized.EMS_UNIT_LABEL))
+            qry = select(PersonSanitized.SEX,
+                         PersonSanitized.CONDITION_CODE,
+                         PersonSanitized.INJ_SEVER_CODE,
+                         PersonSanitized.REPORT_NO,
+                         PersonSanitized.OCC_SEAT_POS_CODE,
+                         PersonSanitized.PED_VISIBLE_CODE,
+                         PersonSanitized.PED_LOCATION_CODE,
+                         PersonSanitized.PED_OBEY_CODE,
+                         PersonSanitized.PED_TYPE_CODE,
+                         PersonSanitized.MOVEMENT_CODE,
+                         PersonSanitized.PERSON_TYPE,
+                         PersonSanitized.ALCO_TEST_CODE,  # ALCO_TEST_CODE as ALCOHOL_TEST_CODE,
+                         PersonSanitized.ALCO_TEST_TYPE_CODE,
+                         # ALCO_TEST_TYPE_CODE as ALCOHOL_TESTTYPE_CODE,
+                         PersonSanitized.DRUG_TEST_CODE,
+                         PersonSanitized.DRUG_TEST_RESULT_FLAG,
+                         # DRUG_TEST_RESULT_FLAG as DRUG_TESTRESULT_CODE,
+                         PersonSanitized.BAC,  # BAC as BAC_CODE,
+                         PersonSanitized.FAULT_FLAG,
+                         PersonSanitized.EQUIP_PROB_CODE,
+                         PersonSanitized.SAF_EQUIP_CODE,
+                         PersonSanitized.EJECT_CODE,
+                         PersonSanitized.AIR_BAG_CODE,  # AIR_BAG_CODE as AIRBAG_DEPLOYED,
+                         PersonSanitized.DRIVER_DOB,  # DRIVER_DOB as DATE_OF_BIRTH,
+                         PersonSanitized.PERSON_ID,
+                         PersonSanitized.STATE_CODE,  # STATE_CODE as LICENSE_STATE_CODE,
+                         PersonSanitized.CLASS,
+                         PersonSanitized.CDL_FLAG,
+                         PersonSanitized.VEHICLE_ID,
+                         PersonSanitized.EMS_UNIT_LABEL)
+            qry = self._changed_reports(qry, PersonSanitized.REPORT_NO)
 
             # headers that need to be renamed
             key_subs = {
@@ -415,7 +570,7 @@ class WorksheetMaker:  # pylint:disable=too-many-instance-attributes
             worksheet = self.workbook.add_worksheet("PERSON")
 
             row_no = 0
-            for row in qry.fetchall():
+            for row in self._rows(session, qry):
                 if row_no == 0:
                     # Build header row
                     header_list = list(row.keys())
@@ -424,129 +579,117 @@ class WorksheetMaker:  # pylint:disable=too-many-instance-attributes
 
                     worksheet.write_row(0, 0, header_list)
 
-                    row_no += 1
+                    column_plan = self._column_plan(header_list, {
+                        'PERSON_ID': self._get_person_uuid,
+                        'VEHICLE_ID': self._get_vehicle_uuid,
+                        'SEX_CODE': self._lookup_sex,
+                    })
 
-                for element_no, _ in enumerate(row):
-                    # Deal with the special cases
-                    if element_no == header_list.index('PERSON_ID'):
-                        worksheet.write(row_no, element_no, self._get_person_uuid(row[element_no]))
-                    elif element_no == header_list.index('VEHICLE_ID'):
-                        worksheet.write(row_no, element_no, self._get_vehicle_uuid(row[element_no]))
-                    elif element_no == header_list.index('SEX_CODE'):
-                        worksheet.write(row_no, element_no, self._lookup_sex(row[element_no]))
-
-                    # Other cases
-                    elif isinstance(row[element_no], datetime.datetime):
-                        worksheet.write(row_no, element_no, row[element_no], self.date_fmt)
-                    else:
-                        worksheet.write(row_no, element_no, self._standardize_value(row[element_no]))
+                    row_no += 1
 
+                self._write_planned_row(worksheet, row_no, column_plan, row)
                 row_no += 1
 
     def add_ems_worksheet(self) -> None:
         """Generates the worksheet for the acrs_ems_sanitized table"""
         with Session(self.engine) as session:
-            qry = session.execute(select(EmsSanitized.REPORT_NO,
-                                         EmsSanitized.EMS_UNIT_TAKEN_BY,
-                                         EmsSanitized.EMS_UNIT_TAKEN_TO,
-                                         EmsSanitized.EMS_UNIT_LABEL,
-                                         EmsSanitized.EMS_TRANSPORT_TYPE_FLAG))
+            qry = select(EmsSanitized.REPORT_NO,
+                         EmsSanitized.EMS_UNIT_TAKEN_BY,
+                         EmsSanitized.EMS_UNIT_TAKEN_TO,
+                         EmsSanitized.EMS_UNIT_LABEL,
+                         EmsSanitized.EMS_TRANSPORT_TYPE_FLAG)
+            qry = self._changed_reports(qry, EmsSanitized.REPORT_NO)
 
             worksheet = self.workbook.add_worksheet("EMS")
             key_subs = {'EMS_TRANSPORT_TYPE_FLAG': 'EMS_TRANSPORT_TYPE'}
 
             row_no = 0
-            for row in qry.fetchall():
+            for row in self._rows(session, qry):
                 if row_no == 0:
                     header_list = list(row.keys())
                     for orig, repl in key_subs.items():
                         header_list[header_list.index(orig)] = repl
 
-                    for col_num, _ in enumerate(header_list):
-                        worksheet.write(0, col_num, header_list[col_num])
+                    worksheet.write_row(0, 0, header_list)
+                    column_plan = self._column_plan(header_list, {})
                     row_no += 1
 
-                for element_no, _ in enumerate(row):
-                    if isinstance(row[element_no], datetime.datetime):
-                        worksheet.write(row_no, element_no, row[element_no], self.date_fmt)
-                    else:
-                        worksheet.write(row_no, element_no, self._standardize_value(row[element_no]))
+                self._write_planned_row(worksheet, row_no, column_plan, row)
                 row_no += 1
 
     def add_vehicle_worksheet(self) -> None:
         """Generates the worksheet for the acrs_vehicle_sanitized table"""
-        with Session(self.engine) as session:
-            qry = session.execute(select(VehicleSanitized.HARM_EVENT_CODE,
-                                         VehicleSanitized.CONTI_DIRECTION_CODE,
-                                         VehicleSanitized.DAMAGE_CODE,
-                                         VehicleSanitized.MOVEMENT_CODE,
-                                         VehicleSanitized.VIN_NO,  # VEHICLE_ID as VIN_NO,
-                                         VehicleSanitized.REPORT_NO,
-                                         VehicleSanitized.CV_BODY_TYPE_CODE,
-                                         VehicleSanitized.VEH_YEAR,
-                                         VehicleSanitized.VEH_MAKE,
-                                         VehicleSanitized.COMMERCIAL_FLAG,
-                                         VehicleSanitized.VEH_MODEL,
-                                         VehicleSanitized.HZM_NUM,  # HZM_NAME as HZM_NUM,
-                                         VehicleSanitized.TOWED_AWAY_FLAG,
-                                         VehicleSanitized.NUM_AXLES,
-                                         VehicleSanitized.GVW_CODE,  # GVW as GVW_CODE,
-                                         VehicleSanitized.GOING_DIRECTION_CODE,
-                                         VehicleSanitized.BODY_TYPE_CODE,
-                                         VehicleSanitized.DRIVERLESS_FLAG,
-                                         VehicleSanitized.FIRE_FLAG,
-                                         VehicleSanitized.PARKED_FLAG,
-                                         VehicleSanitized.SPEED_LIMIT,
-                                         VehicleSanitized.HIT_AND_RUN_FLAG,
-                                         VehicleSanitized.HAZMAT_SPILL_FLAG,
-                                         VehicleSanitized.VIN_NO,  # duplicate to be renamed VEHICLE_ID
-                                         VehicleSanitized.TOWED_VEHICLE_CONFIG_CODE,
-                                         # TOWED_VEHICLE_CODE1 as TOWED_VEHICLE_CONFIG_CODE,
-                                         VehicleSanitized.AREA_DAMAGED_CODE_IMP1,
-                                         VehicleSanitized.AREA_DAMAGED_CODE1,
-                                         VehicleSanitized.AREA_DAMAGED_CODE2,
-                                         VehicleSanitized.AREA_DAMAGED_CODE3,
-                                         VehicleSanitized.AREA_DAMAGED_CODE_MAIN))
+        # A second session for the circumstance queries, so they do not interrupt the vehicle query's cursor
+        with Session(self.engine) as session, Session(self.engine) as circum_session:
+            qry = select(VehicleSanitized.HARM_EVENT_CODE,
+                         VehicleSanitized.CONTI_DIRECTION_CODE,
+                         VehicleSanitized.DAMAGE_CODE,
+                         VehicleSanitized.MOVEMENT_CODE,
+                         VehicleSanitized.VIN_NO,  # VEHICLE_ID as VIN_NO,
+                         VehicleSanitized.REPORT_NO,
+                         VehicleSanitized.CV_BODY_TYPE_CODE,
+                         VehicleSanitized.VEH_YEAR,
+                         VehicleSanitized.VEH_MAKE,
+                         VehicleSanitized.COMMERCIAL_FLAG,
+                         VehicleSanitized.VEH_MODEL,
+                         VehicleSanitized.HZM_NUM,  # HZM_NAME as HZM_NUM,
+                         VehicleSanitized.TOWED_AWAY_FLAG,
+                         VehicleSanitized.NUM_AXLES,
+                         VehicleSanitized.GVW_CODE,  # GVW as GVW_CODE,
+                         VehicleSanitized.GOING_DIRECTION_CODE,
+                         VehicleSanitized.BODY_TYPE_CODE,
+                         VehicleSanitized.DRIVERLESS_FLAG,
+                         VehicleSanitized.FIRE_FLAG,
+                         VehicleSanitized.PARKED_FLAG,
+                         VehicleSanitized.SPEED_LIMIT,
+                         VehicleSanitized.HIT_AND_RUN_FLAG,
+                         VehicleSanitized.HAZMAT_SPILL_FLAG,
+                         VehicleSanitized.VIN_NO,  # duplicate to be renamed VEHICLE_ID
+                         VehicleSanitized.TOWED_VEHICLE_CONFIG_CODE,
+                         # TOWED_VEHICLE_CODE1 as TOWED_VEHICLE_CONFIG_CODE,
+                         VehicleSanitized.AREA_DAMAGED_CODE_IMP1,
+                         VehicleSanitized.AREA_DAMAGED_CODE1,
+                         VehicleSanitized.AREA_DAMAGED_CODE2,
+                         VehicleSanitized.AREA_DAMAGED_CODE3,
+                         VehicleSanitized.AREA_DAMAGED_CODE_MAIN)
+            qry = self._changed_reports(qry, VehicleSanitized.REPORT_NO)
 
             worksheet = self.workbook.add_worksheet("VEHICLE")
 
             row_no = 0
-            for row in qry.fetchall():
-
-                if row_no == 0:
-                    # Replace the last instane of VIN_NO with VEHICLE_ID, per the spec
-                    header_list = list(row.keys())
-                    header_list[header_list.index('VIN_NO_1')] = 'VEHICLE_ID'
-                    worksheet.write_row(0, 0, header_list)
-
-                    # Find the indexes of the special cases we need to deal with
-                    report_no_index = header_list.index('REPORT_NO')
-                    vehicle_id_index = header_list.index('VEHICLE_ID')
-                    cont_dir_index = header_list.index('CONTI_DIRECTION_CODE')
-                    going_dir_index = header_list.index('GOING_DIRECTION_CODE')
-
+            invalid_codes: Counter = Counter()
+            for rows in self._partitions(session, qry):
+                # The vehicle circumstances for the whole chunk in one query, instead of one query per vehicle. Unless
+                # this is streaming, the chunk is every vehicle
+                vehicle_circums = self._get_vehicle_circums(
+                    circum_session, {row.REPORT_NO for row in rows} if self.streaming else None)
+
+                for row in rows:
+
+                    if row_no == 0:
+                        # Replace the last instane of VIN_NO with VEHICLE_ID, per the spec
+                        header_list = list(row.keys())
+                        header_list[header_list.index('VIN_NO_1')] = 'VEHICLE_ID'
+                        worksheet.write_row(0, 0, header_list)
+
+                        report_no_index = header_list.index('REPORT_NO')
+                        vehicle_id_index = header_list.index('VEHICLE_ID')
+                        column_plan = self._column_plan(header_list, {
+                            'VEHICLE_ID': self._get_vehicle_uuid,
+                            'CONTI_DIRECTION_CODE': self._lookup_direction,
+                            'GOING_DIRECTION_CODE': self._lookup_direction,
+                        })
+
+                        row_no += 1
+
+                    invalid_codes += self._write_vehicle_circum(
+                        str(int(row[vehicle_id_index])),
+                        vehicle_circums.get((row[report_no_index], row[vehicle_id_index]), []))
+
+                    self._write_planned_row(worksheet, row_no, column_plan, row)
                     row_no += 1
 
-                self.add_vehicle_circum(row[report_no_index],
-                                        str(int(row[vehicle_id_index])))
-
-                for element_no, _ in enumerate(row):
-
-                    # Deal with the special cases
-                    if element_no == vehicle_id_index:
-                        worksheet.write(row_no, element_no, self._get_vehicle_uuid(row[element_no]))
-                    elif element_no == cont_dir_index:
-                        worksheet.write(row_no, element_no, self._lookup_direction(row[element_no]))
-                    elif element_no == going_dir_index:
-                        worksheet.write(row_no, element_no, self._lookup_direction(row[element_no]))
-
-                    # Other cases
-                    elif isinstance(row[element_no], datetime.datetime):
-                        worksheet.write(row_no, element_no, row[element_no], self.date_fmt)
-                    else:
-                        worksheet.write(row_no, element_no, self._standardize_value(row[element_no]))
-
-                row_no += 1
+            log_invalid_codes(invalid_codes, 'vehicle')
 
     def add_vehicle_circum(self, report_no: str, vehicle_id: str) -> None:
         """ Creates the vehicle_circum sheet"""
@@ -558,40 +701,72 @@ class WorksheetMaker:  # pylint:disable=too-many-instance-attributes
                                              CircumstanceSanitized.REPORT_NO == report_no,
                                              CircumstanceSanitized.VEHICLE_ID == vehicle_id)))
 
-            for row in qry.fetchall():
-                report_no = row[0]
-                for contrib_code in row[1:]:
-                    try:
-                        val = self._validate_vehicle_value(contrib_code)
-                    except ValueError as err:
-                        logger.error(err)
-                        continue
-
-                    if val is not None:
-                        self.vehicle_circum_ws.write_row(self.vehicle_circum_ws_row, 0,
-                                                         (report_no,
-                                                          'Vehicle',
-                                                          contrib_code,
-                                                          None,
-                                                          self._get_vehicle_uuid(vehicle_id) if vehicle_id else None))
-                        self.vehicle_circum_ws_row += 1
+            log_invalid_codes(self._write_vehicle_circum(vehicle_id, qry.fetchall()), 'vehicle')
+
+    def _get_vehicle_circums(self, session: Session,
+                             report_nos: Optional[Set[str]] = None) -> Dict[Tuple[str, float], List[Sequence]]:
+        """
+        Gets the vehicle circumstances, grouped by REPORT_NO and VEHICLE_ID. The rows in each group are in the same
+        order that add_vehicle_circum would get them in.
+        :param session: Session to query with
+        :param report_nos: Only get the circumstances for these reports. If None, gets all of them (or all of the ones
+        in this export, if it is incremental).
+        """
+        stmt = select(CircumstanceSanitized.REPORT_NO, CircumstanceSanitized.CONTRIB_CODE1,
+                      CircumstanceSanitized.CONTRIB_CODE2, CircumstanceSanitized.CONTRIB_CODE3,
+                      CircumstanceSanitized.CONTRIB_CODE4, CircumstanceSanitized.VEHICLE_ID).\
+            where(CircumstanceSanitized.CONTRIB_FLAG == 'V')
+
+        if report_nos is None:
+            stmts = [self._changed_reports(stmt, CircumstanceSanitized.REPORT_NO)]
+        else:
+            # SQL Server allows at most 2100 parameters per query
+            sorted_report_nos = sorted(report_nos)
+            stmts = [stmt.where(CircumstanceSanitized.REPORT_NO.in_(sorted_report_nos[i:i + 1000]))
+                     for i in range(0, len(sorted_report_nos), 1000)]
+
+        vehicle_circums: Dict[Tuple[str, float], List[Sequence]] = {}
+        for chunk_stmt in stmts:
+            for row in session.execute(chunk_stmt):
+                vehicle_circums.setdefault((row[0], row[5]), []).append(row[:5])
+        return vehicle_circums
+
+    def _write_vehicle_circum(self, vehicle_id: str, rows: Iterable[Sequence]) -> Counter:
+        """
+        Writes circumstances to the vehicle_circum sheet
+        :param vehicle_id: VEHICLE_ID of the vehicle the circumstances are for
+        :param rows: Rows of REPORT_NO, CONTRIB_CODE1, CONTRIB_CODE2, CONTRIB_CODE3 and CONTRIB_CODE4
+        :return: Counter of the invalid codes that were skipped
+        """
+        invalid_codes: Counter = Counter()
+        for row in rows:
+            report_no = row[0]
+            validated, invalid = validate_codes(row[1:], 'vehicle')
+            invalid_codes += invalid
+            for contrib_code, val in zip(row[1:], validated):
+                if val is not None:
+                    self.vehicle_circum_ws.write_row(self.vehicle_circum_ws_row, 0,
+                                                     (report_no,
+                                                      'Vehicle',
+                                                      contrib_code,
+                                                      None,
+                                                      self._get_vehicle_uuid(vehicle_id) if vehicle_id else None))
+                    self.vehicle_circum_ws_row += 1
+        return invalid_codes
 
     def add_road_circum(self) -> None:
         """ Populates the road sheet"""
         with Session(self.engine) as session:
-            qry = session.execute(select(CircumstanceSanitized.REPORT_NO, CircumstanceSanitized.CONTRIB_CODE1,
-                                         CircumstanceSanitized.CONTRIB_CODE2, CircumstanceSanitized.CONTRIB_CODE3,
-                                         CircumstanceSanitized.CONTRIB_CODE4).
-                                  where(CircumstanceSanitized.CONTRIB_FLAG == 'R'))
-            for row in qry.fetchall():
+            qry = select(CircumstanceSanitized.REPORT_NO, CircumstanceSanitized.CONTRIB_CODE1,
+                         CircumstanceSanitized.CONTRIB_CODE2, CircumstanceSanitized.CONTRIB_CODE3,
+                         CircumstanceSanitized.CONTRIB_CODE4).where(CircumstanceSanitized.CONTRIB_FLAG == 'R')
+            qry = self._changed_reports(qry, CircumstanceSanitized.REPORT_NO)
+            invalid_codes: Counter = Counter()
+            for row in self._rows(session, qry):
                 report_no = row[0]
-                for contrib_code in row[1:]:
-                    try:
-                        val = self._validate_road_value(contrib_code)
-                    except ValueError as err:
-                        logger.error(err)
-                        continue
-
+                validated, invalid = validate_codes(row[1:], 'road')
+                invalid_codes += invalid
+                for contrib_code, val in zip(row[1:], validated):
                     if val is not None:
                         self.road_circum_ws.write_row(self.road_circum_ws_row, 0,
                                                       (report_no,
@@ -601,6 +776,29 @@ class WorksheetMaker:  # pylint:disable=too-many-instance-attributes
                                                        None))
                         self.road_circum_ws_row += 1
 
+            log_invalid_codes(invalid_codes, 'road')
+
+    @staticmethod
+    def _format_time(val) -> str:
+        """Formats ACC_TIME as HHMM"""
+        if isinstance(val, datetime.time):
+            return val.strftime('%H%M')
+        # needs to be a four digit number, left zero padded
+        return str(val).zfill(4)
+
+    @staticmethod
+    def _zero_pad_code(val) -> str:
+        """Formats a code as a two digit number, left zero padded"""
+        if isinstance(val, float):
+            val = int(val)
+        return str(val).zfill(2)
+
+    def _format_flag(self, val):
+        """Formats booleans as Y/N"""
+        if isinstance(val, bool):
+            return 'Y' if val else 'N'
+        return self._standardize_value(val)
+
     @staticmethod
     def _standardize_value(val: str):
         """Working with a few data cleanup things that happens for each insertion"""
@@ -612,85 +810,47 @@ class WorksheetMaker:  # pylint:disable=too-many-instance-attributes
 
     def _validate_vehicle_value(self, val: str) -> Optional[str]:
         """ Validates circumstance values for vehicles """
-        master_dict = {}
-        master_dict.update(TANG_VEHICLE)
-        master_dict.update(TANG_MASTER)
-        master_dict.update(ACRS_VEHICLE)
-
-        ret = self._validate_value(val, master_dict)
-
-        return ret
+        return self._validate_value(val, CODE_TABLES['vehicle'])
 
     def _validate_person_value(self, val: str) -> Optional[str]:
         """ Validates circumstance values for persons. Will raise ValueError if val is not a valid person code. """
-        master_dict = {}
-        master_dict.update(TANG_PERSON)
-        master_dict.update(TANG_MASTER)
-        master_dict.update(ACRS_PERSON)
-
-        ret = self._validate_value(val, master_dict)
-
-        return ret
+        return self._validate_value(val, CODE_TABLES['person'])
 
     def _validate_weather_value(self, val: str) -> Optional[str]:
         """ Validates circumstance values for weather. Will raise ValueError if val is not a valid weather code. """
-        master_dict = {}
-        master_dict.update(TANG_WEATHER)
-        master_dict.update(TANG_MASTER)
-        master_dict.update(ACRS_WEATHER)
-
-        ret = self._validate_value(val, master_dict)
-
-        return ret
+        return self._validate_value(val, CODE_TABLES['weather'])
 
     def _validate_road_value(self, val: str) -> Optional[str]:
         """ Validates circumstance values for road. Will raise ValueError if val is not a valid road code. """
-        master_dict = {}
-        master_dict.update(TANG_ROAD)
-        master_dict.update(TANG_MASTER)
-        master_dict.update(ACRS_ROAD)
-
-        ret = self._validate_value(val, master_dict)
-
-        return ret
+        return self._validate_value(val, CODE_TABLES['road'])
 
     @staticmethod
-    def _validate_value(val: str, master_dict: Dict) -> Optional[str]:
+    def _validate_value(val: str, master_dict: Mapping[str, str]) -> Optional[str]:
         if val is None or val == 'A9.99':
             return None
 
         val = str(val)
-        if val not in master_dict.keys():
+        if val not in master_dict:
             raise ValueError(f'Unable to validate {val}. Expected values {master_dict.keys()}')
         return val
 
     @staticmethod
     def _lookup_sex(val: str) -> Optional[str]:
-        master_dict = {}
-        master_dict.update(TANG_MASTER)
-        master_dict.update(SEX)
-
-        return master_dict.get(val)
+        return CODE_TABLES['sex'].get(val)
 
     @staticmethod
     def _lookup_direction(val: str) -> Optional[str]:
-        master_dict = {}
-        master_dict.update(TANG_MASTER)
-        master_dict.update(DIRECTION)
+        return CODE_TABLES['direction'].get(val)
 
-        return master_dict.get(val)
-
-    def _get_person_uuid(self, person_id: str) -> str:
-        """ Safe lookup of the person uuid """
-        if self.vehicle_id_dict.get(person_id) is None:
-            self.vehicle_id_dict[person_id] = str(uuid.uuid4())
-        return self.vehicle_id_dict[person_id]
+    @staticmethod
+    def _get_person_uuid(person_id: str) -> str:
+        """ Lookup of the person uuid. See ms2_uuid """
+        return ms2_uuid('person', person_id)
 
-    def _get_vehicle_uuid(self, vehicle_id: str) -> str:
-        """ Safe lookup of the vehicle uuid """
-        if self.vehicle_id_dict.get(vehicle_id) is None:
-            self.vehicle_id_dict[vehicle_id] = str(uuid.uuid4())
-        return self.vehicle_id_dict[vehicle_id]
+    @staticmethod
+    def _get_vehicle_uuid(vehicle_id: str) -> str:
+        """ Lookup of the vehicle uuid. See ms2_uuid """
+        return ms2_uuid('vehicle', vehicle_id)
 
 
 if __name__ == '__main__':
@@ -698,9 +858,19 @@ if __name__ == '__main__':
                                                  'the DOT_DATA database')
     parser.add_argument('-c', '--conn_str', help='Custom database connection string',
                         default='mssql+pyodbc://balt-sql311-prd/DOT_DATA?driver=ODBC Driver 17 for SQL Server')
+    parser.add_argument('-s', '--streaming', action='store_true',
+                        help='Keep memory use bounded for large exports, by fetching and writing rows in chunks')
+    parser.add_argument('--chunk_size', type=int, default=1000,
+                        help='Number of rows to fetch at a time with --streaming (default: 1000)')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Only export the reports that are new since the last incremental export')
+    parser.add_argument('--lookback_days', type=int, default=30,
+                        help='Number of days before the last incremental export to export again, to pick up late or '
+                             'amended reports (default: 30)')
     args = parser.parse_args()
 
-    ws_maker = WorksheetMaker(conn_str=args.conn_str)
+    ws_maker = WorksheetMaker(conn_str=args.conn_str, streaming=args.streaming, chunk_size=args.chunk_size,
+                              incremental=args.incremental, lookback_days=args.lookback_days)
     with ws_maker:
         ws_maker.add_crash_worksheet()
         ws_maker.add_person_worksheet()
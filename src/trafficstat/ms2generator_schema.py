@@ -325,3 +325,15 @@ class VehicleSanitized(Base):
     VEHICLE_WEIGHT_CODE = Column(String(length=5), nullable=True)
     OWNER_STATE_CODE = Column(String(length=2), nullable=True)
     DS_KEY = Column(String(length=20), nullable=True)
+
+
+##############################
+#     ms2_export_state       #
+##############################
+class Ms2ExportState(Base):
+    """Sqlalchemy: Watermarks for incremental MS2 exports"""
+    __tablename__ = 'ms2_export_state'
+
+    EXPORT_NAME = Column(String(length=50), primary_key=True)
+    ACC_DATE = Column(DateTime, nullable=True)  # The latest ACC_DATE in the acrs_crash_sanitized table when exported
+    EXPORT_DATE = Column(DateTime, nullable=True)
@@ -0,0 +1,135 @@
+"""
+Exports the sanitized crash data as Parquet datasets, for the PowerBI dashboards and other analytics. Each table is a
+dataset partitioned by the year and month of ACC_DATE (<output_dir>/crash/year=2021/month=7/...), so readers can scan
+only the months and columns that they need. Rows are streamed from the database and written as Arrow record batches,
+so the export never holds a whole table in memory.
+"""
+import argparse
+import datetime
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa  # type: ignore
+import pyarrow.dataset as ds  # type: ignore
+from loguru import logger
+from sqlalchemy import create_engine, select  # type: ignore
+from sqlalchemy.orm import Session  # type: ignore
+from sqlalchemy.sql.schema import Table  # type: ignore
+from sqlalchemy.types import Date, DateTime, Float, Numeric  # type: ignore
+
+from .ms2generator_schema import CircumstanceSanitized, CrashSanitized, EmsSanitized, PersonSanitized, \
+    RoadwaySanitized, VehicleSanitized
+
+# Dataset name: sanitized table. These are the tables that the MS2 workbook is built from
+DATASETS = {
+    'crash': CrashSanitized.__table__,
+    'roadway': RoadwaySanitized.__table__,
+    'person': PersonSanitized.__table__,
+    'ems': EmsSanitized.__table__,
+    'vehicle': VehicleSanitized.__table__,
+    'circumstance': CircumstanceSanitized.__table__,
+}
+
+PARTITIONING = ds.partitioning(pa.schema([('year', pa.int16()), ('month', pa.int8())]), flavor='hive')
+
+
+def arrow_type(column) -> pa.DataType:
+    """Gets the Arrow type for a sqlalchemy column"""
+    if isinstance(column.type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column.type, Date):
+        return pa.date32()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Numeric):
+        return pa.decimal128(column.type.precision or 38, column.type.scale or 0)
+    return pa.string()
+
+
+def arrow_schema(table: Table) -> pa.Schema:
+    """Gets the Arrow schema of a table, with the year and month partition columns"""
+    return pa.schema([(column.name, arrow_type(column)) for column in table.columns] +
+                     [('year', pa.int16()), ('month', pa.int8())])
+
+
+class ParquetExporter:
+    """Exports the sanitized crash data tables to Parquet datasets"""
+
+    def __init__(self, conn_str: str, output_dir: str, chunk_size: int = 10000):
+        """
+        :param conn_str: sqlalchemy connection string
+        :param output_dir: Directory to write the datasets to. Each table is written to a subdirectory
+        :param chunk_size: Number of rows to fetch from the database, and write to a record batch, at a time
+        """
+        logger.info("Creating db with connection string: {}", conn_str)
+        self.engine = create_engine(conn_str, future=True)
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+
+    def export_all(self) -> Dict[str, int]:
+        """
+        Exports every table in DATASETS
+        :return: Dictionary of dataset name to the number of rows exported
+        """
+        return {name: self.export_table(name) for name in DATASETS}
+
+    def export_table(self, name: str) -> int:
+        """
+        Exports a table to <output_dir>/<name>. Partitions that are already there are replaced, and the other partitions
+        are left alone.
+        :param name: Dataset name from DATASETS
+        :return: Number of rows exported
+        """
+        table = DATASETS[name]
+        schema = arrow_schema(table)
+        row_count = 0
+
+        def record_batches() -> Iterator[pa.RecordBatch]:
+            nonlocal row_count
+            for rows in self._partitions(table):
+                row_count += len(rows)
+                yield self._record_batch(rows, schema)
+
+        ds.write_dataset(record_batches(), os.path.join(self.output_dir, name), schema=schema, format='parquet',
+                         partitioning=PARTITIONING, existing_data_behavior='delete_matching',
+                         basename_template='part-{i}.parquet')
+        logger.info('Exported {} rows to the {} dataset', row_count, name)
+        return row_count
+
+    def _partitions(self, table: Table) -> Iterator[List[Tuple]]:
+        """Streams the rows of a table from the database, chunk_size rows at a time"""
+        with Session(self.engine) as session:
+            result = session.execute(select(table).execution_options(stream_results=True,
+                                                                     max_row_buffer=self.chunk_size))
+            for rows in result.partitions(self.chunk_size):
+                yield [tuple(row) for row in rows]
+
+    @staticmethod
+    def _record_batch(rows: List[Tuple], schema: pa.Schema) -> pa.RecordBatch:
+        """Builds a record batch from database rows, adding the year and month of ACC_DATE"""
+        acc_date_index = schema.get_field_index('ACC_DATE')
+        acc_dates: List[Optional[datetime.datetime]] = [row[acc_date_index] for row in rows]
+
+        columns = [list(column) for column in zip(*rows)]
+        columns.append([acc_date.year if acc_date else None for acc_date in acc_dates])
+        columns.append([acc_date.month if acc_date else None for acc_date in acc_dates])
+        return pa.RecordBatch.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                          schema=schema)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the sanitized crash data as Parquet datasets, partitioned by '
+                                                 'the year and month of the crash')
+    parser.add_argument('-c', '--conn_str', help='Custom database connection string',
+                        default='mssql+pyodbc://balt-sql311-prd/DOT_DATA?driver=ODBC Driver 17 for SQL Server')
+    parser.add_argument('-o', '--output_dir', default='parquet',
+                        help='Directory to write the datasets to (default: parquet)')
+    parser.add_argument('-t', '--table', action='append', choices=list(DATASETS),
+                        help='Only export this table. Can be given more than once (default: every table)')
+    parser.add_argument('--chunk_size', type=int, default=10000,
+                        help='Number of rows to fetch and write at a time (default: 10000)')
+    args = parser.parse_args()
+
+    exporter = ParquetExporter(args.conn_str, args.output_dir, chunk_size=args.chunk_size)
+    for table_name in args.table or DATASETS:
+        exporter.export_table(table_name)
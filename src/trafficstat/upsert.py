@@ -0,0 +1,152 @@
+"""
+Database side upserts for the tables in crash_data_schema. Rows are written with one statement per table, and the
+database decides whether each row is an insert or an update:
+ * SQLite and PostgreSQL: INSERT ... ON CONFLICT (<primary key>) DO UPDATE
+ * SQL Server: MERGE ... WHEN MATCHED THEN UPDATE ... WHEN NOT MATCHED THEN INSERT
+Rows that are known to be new can be written with insert_rows instead, which is a plain INSERT.
+"""
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from sqlalchemy import bindparam, insert  # type: ignore
+from sqlalchemy.dialects import postgresql, sqlite  # type: ignore
+from sqlalchemy.engine import Connection, Dialect  # type: ignore
+from sqlalchemy.sql import text  # type: ignore
+from sqlalchemy.sql.elements import TextClause  # type: ignore
+from sqlalchemy.sql.schema import Table  # type: ignore
+
+from .crash_data_schema import Base
+
+UPSERT_DIALECTS = ('mssql', 'postgresql', 'sqlite')
+
+_INSERT_FUNCS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def supports_upsert(dialect: Dialect) -> bool:
+    """Whether upsert() can write to this database"""
+    return dialect.name in UPSERT_DIALECTS
+
+
+def group_rows(table_rows: Iterable[Tuple[Table, dict]]) -> Iterator[Tuple[Table, List[dict]]]:
+    """
+    Groups rows of column values by table. The groups are in foreign key order, so they can be written one after the
+    other. Within a table, rows are grouped by the columns they set, so that columns that were not set are not
+    overwritten with NULL on update.
+    :param table_rows: Iterable of (table, row)
+    :return: Iterator of (table, rows)
+    """
+    groups: Dict[Tuple[Table, Tuple[str, ...]], List[dict]] = {}
+    for table, row in table_rows:
+        groups.setdefault((table, tuple(row)), []).append(row)
+
+    table_order = {table: i for i, table in enumerate(Base.metadata.sorted_tables)}
+    for group in sorted(groups, key=lambda group: table_order[group[0]]):
+        yield group[0], groups[group]
+
+
+def _dedupe_rows(table: Table, rows: List[dict]) -> List[dict]:
+    """
+    Removes all but the last row for each primary key. PostgreSQL and SQL Server refuse to touch the same row twice in
+    one statement, and the last row is what would have been left after writing them one at a time.
+    """
+    primary_keys = [column.key for column in table.primary_key]
+    return list({tuple(row[key] for key in primary_keys): row for row in rows}.values())
+
+
+@contextmanager
+def _identity_insert(connection: Connection, table: Table, columns: Sequence[str]) -> Iterator[None]:
+    """SQL Server will not take explicit values for an identity column unless IDENTITY_INSERT is on"""
+    dialect = connection.dialect
+    # Table.autoincrement_column is only public from SQLAlchemy 2.0
+    autoincrement_column = table._autoincrement_column  # pylint:disable=protected-access
+    identity_insert = dialect.name == 'mssql' and autoincrement_column is not None and \
+        autoincrement_column.key in columns
+    if not identity_insert:
+        yield
+        return
+
+    connection.execute(text(f'SET IDENTITY_INSERT {dialect.identifier_preparer.format_table(table)} ON'))
+    try:
+        yield
+    finally:
+        # IDENTITY_INSERT belongs to the session, not the transaction, so it has to be turned off even if the statement
+        # failed. Otherwise the pooled connection keeps it on, and SQL Server refuses to turn it on for another table
+        connection.execute(text(f'SET IDENTITY_INSERT {dialect.identifier_preparer.format_table(table)} OFF'))
+
+
+def merge_statement(table: Table, columns: Sequence[str], dialect: Dialect) -> TextClause:
+    """
+    Builds the SQL Server MERGE statement that upserts a single row, with a bind parameter for each column
+    :param table: Table to write to
+    :param columns: Column keys that are set in the rows
+    :param dialect: Dialect used to quote the identifiers
+    """
+    preparer = dialect.identifier_preparer
+    primary_keys = [column.key for column in table.primary_key]
+    quoted = {column: preparer.quote(table.c[column].name) for column in columns}
+
+    sql = (f'MERGE INTO {preparer.format_table(table)} WITH (HOLDLOCK) AS target '
+           f'USING (VALUES ({", ".join(f":{column}" for column in columns)})) '
+           f'AS source ({", ".join(quoted.values())}) '
+           f'ON {" AND ".join(f"target.{quoted[key]} = source.{quoted[key]}" for key in primary_keys)} ')
+
+    update_columns = [column for column in columns if column not in primary_keys]
+    if update_columns:
+        # Only identifiers quoted by identifier_preparer go into the SQL, so this is not an injection vector
+        sql += (f'WHEN MATCHED THEN UPDATE SET '  # nosec B608
+                f'{", ".join(f"target.{quoted[column]} = source.{quoted[column]}" for column in update_columns)} ')
+
+    sql += (f'WHEN NOT MATCHED THEN INSERT ({", ".join(quoted.values())}) '
+            f'VALUES ({", ".join(f"source.{quoted[column]}" for column in columns)});')
+
+    return text(sql).bindparams(*[bindparam(column, type_=table.c[column].type) for column in columns])
+
+
+def upsert(connection: Connection, table: Table, rows: List[dict]) -> None:
+    """
+    Inserts the rows, or updates them if the primary key already exists, with a single executemany statement
+    :param connection: Connection with an open transaction
+    :param table: Table to write to
+    :param rows: Rows of column values. All of the rows must have the same keys, including the primary key columns.
+    """
+    if not rows:
+        return
+
+    rows = _dedupe_rows(table, rows)
+    columns = list(rows[0])
+    dialect = connection.dialect
+
+    if dialect.name == 'mssql':
+        with _identity_insert(connection, table, columns):
+            connection.execute(merge_statement(table, columns, dialect), rows)
+        return
+
+    if dialect.name not in _INSERT_FUNCS:
+        raise NotImplementedError(f'Upsert is not supported on {dialect.name}')
+
+    stmt = _INSERT_FUNCS[dialect.name](table)
+    primary_keys = [column.key for column in table.primary_key]
+    update_columns = {column: stmt.excluded[column] for column in columns if column not in primary_keys}
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(index_elements=primary_keys, set_=update_columns)
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=primary_keys)
+
+    connection.execute(stmt, rows)
+
+
+def insert_rows(connection: Connection, table: Table, rows: List[dict]) -> None:
+    """
+    Inserts the rows with a single executemany statement, without checking whether they already exist. This is faster
+    than upsert (especially on SQL Server, where each row is a MERGE), but raises an IntegrityError if any of the
+    primary keys are already in the table.
+    :param connection: Connection with an open transaction
+    :param table: Table to write to
+    :param rows: Rows of column values. All of the rows must have the same keys, including the primary key columns.
+    """
+    if not rows:
+        return
+
+    rows = _dedupe_rows(table, rows)
+    with _identity_insert(connection, table, list(rows[0])):
+        connection.execute(insert(table), rows)
@@ -0,0 +1,161 @@
+"""
+VIN decoding through the NHTSA vPIC web service (using pyvin), with a SQLite cache. The same fleet vehicles show up in
+many reports, so every decoded VIN is cached on disk and is never looked up again. The make, model and model year are
+also cached by the VIN pattern (WMI + VDS + model year), which lets the offline mode decode VINs that have not been
+seen before, as long as another vehicle of the same type has been.
+"""
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    # pyvin (and requests) are only imported once there are VINs to decode
+    from pyvin import DecodedVIN  # type: ignore
+
+VIN_LENGTH = 17
+MAX_BATCH_SIZE = 100  # The most VINs that vPIC takes in one request
+
+DecodedFields = Tuple[Optional[str], Optional[str], Optional[str]]  # (Make, Model, ModelYear)
+
+
+def vin_pattern(vin: str) -> str:
+    """
+    The part of the VIN that identifies the type of vehicle: the WMI and VDS (positions 1-8, without the check digit)
+    and the model year (position 10)
+    """
+    return vin[:8] + vin[9]
+
+
+class VinDecoder:
+    """Decodes VINs to their make, model and model year"""
+
+    def __init__(self, cache_file: str = ':memory:', offline: bool = False):
+        """
+        :param cache_file: Path to the SQLite cache. The default only caches for the life of the object.
+        :param offline: Only use the cache. VINs that are not cached are decoded from their VIN pattern, if possible
+        """
+        self.cache_file = cache_file
+        self.offline = offline
+        self._memo: Dict[str, DecodedFields] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # The connection and lock can not be pickled, so process pool workers open their own
+        state = self.__dict__.copy()
+        state.update(_memo={}, _conn=None, _lock=None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Opens the cache, creating the tables if needed"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.cache_file, timeout=30, check_same_thread=False)
+            with self._conn:
+                self._conn.execute('CREATE TABLE IF NOT EXISTS vin '
+                                   '(vin TEXT PRIMARY KEY, make TEXT, model TEXT, model_year TEXT)')
+                self._conn.execute('CREATE TABLE IF NOT EXISTS vin_pattern '
+                                   '(pattern TEXT PRIMARY KEY, make TEXT, model TEXT, model_year TEXT)')
+        return self._conn
+
+    def decode(self, vin: Optional[str]) -> Optional['DecodedVIN']:
+        """
+        Decodes a single VIN
+        :param vin: The VIN to decode
+        :return: DecodedVIN with Make, Model and ModelYear attributes, or None if it could not be decoded
+        """
+        return self.decode_batch([vin] if vin else []).get(vin or '')
+
+    def decode_batch(self, vins: Iterable[Optional[str]]) -> Dict[str, 'DecodedVIN']:
+        """
+        Decodes VINs, with one request per 100 VINs that are not already cached
+        :param vins: The VINs to decode. Anything that is not 17 characters is ignored
+        :return: Dictionary of VIN to DecodedVIN with Make, Model and ModelYear attributes, for the VINs that could be
+        decoded
+        """
+        valid_vins: Set[str] = {vin for vin in vins if vin and len(vin) == VIN_LENGTH}
+        with self._lock:
+            missing = self._load_cached([vin for vin in valid_vins if vin not in self._memo])
+            if missing:
+                if self.offline:
+                    self._decode_patterns(missing)
+                else:
+                    self._decode_online(missing)
+
+        from pyvin import DecodedVIN  # pylint:disable=import-outside-toplevel,redefined-outer-name
+
+        decoded = {}
+        for vin in valid_vins:
+            fields = self._memo.get(vin)
+            if fields and any(fields):
+                decoded[vin] = DecodedVIN({'Make': fields[0], 'Model': fields[1], 'ModelYear': fields[2]})
+        return decoded
+
+    def _load_cached(self, vins: List[str]) -> List[str]:
+        """
+        Loads VINs from the on disk cache into memory
+        :return: The VINs that were not in the cache
+        """
+        conn = self._connection()
+        for i in range(0, len(vins), 500):
+            chunk = vins[i:i + 500]
+            # Only the ? placeholders are put into the SQL, and the VINs are bound to them
+            placeholders = ','.join('?' * len(chunk))
+            for vin, make, model, model_year in conn.execute(
+                    f'SELECT vin, make, model, model_year FROM vin WHERE vin IN ({placeholders})',  # nosec B608
+                    chunk):
+                self._memo[vin] = (make, model, model_year)
+        return [vin for vin in vins if vin not in self._memo]
+
+    def _decode_patterns(self, vins: List[str]) -> None:
+        """Offline decoding from the VIN patterns of VINs that have already been decoded. Nothing is written to disk"""
+        conn = self._connection()
+        for vin in vins:
+            row = conn.execute('SELECT make, model, model_year FROM vin_pattern WHERE pattern = ?',
+                               (vin_pattern(vin),)).fetchone()
+            if row:
+                self._memo[vin] = row
+            else:
+                logger.debug('Unable to decode VIN {} offline', vin)
+
+    def _decode_online(self, vins: List[str]) -> None:
+        """Looks up the VINs with vPIC, and caches the results, including VINs that vPIC could not decode"""
+        # pylint:disable=import-outside-toplevel,redefined-outer-name
+        import pyvin  # type: ignore
+        from pyvin import DecodedVIN
+        from pyvin.errors import VINError  # type: ignore
+        from requests import RequestException  # type: ignore
+
+        conn = self._connection()
+        for i in range(0, len(vins), MAX_BATCH_SIZE):
+            chunk = vins[i:i + MAX_BATCH_SIZE]
+            try:
+                results = pyvin.VIN(*chunk)
+            except (RequestException, VINError, ValueError) as err:
+                # Not cached, so that they are retried next time
+                logger.error('Unable to decode VINs: {}', err)
+                continue
+
+            if isinstance(results, DecodedVIN):
+                results = [results]
+
+            decoded: Dict[str, DecodedFields] = {vin: (None, None, None) for vin in chunk}
+            for result in results or []:
+                vin = getattr(result, 'VIN', None) or (chunk[0] if len(chunk) == 1 else None)
+                if vin in decoded:
+                    decoded[vin] = (getattr(result, 'Make', None) or None,
+                                    getattr(result, 'Model', None) or None,
+                                    getattr(result, 'ModelYear', None) or None)
+
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO vin (vin, make, model, model_year) VALUES (?, ?, ?, ?)',
+                                 [(vin, *fields) for vin, fields in decoded.items()])
+                conn.executemany('INSERT OR REPLACE INTO vin_pattern (pattern, make, model, model_year) '
+                                 'VALUES (?, ?, ?, ?)',
+                                 [(vin_pattern(vin), *fields) for vin, fields in decoded.items() if fields[0]])
+            self._memo.update(decoded)
@@ -1,83 +1,342 @@
-"""Cleans up personally identifiable information in ACRS files"""
+"""
+Cleans up personally identifiable information in ACRS files. Files are streamed through the sanitizer in chunks, so
+large base64 attachments (CRASHDIAGRAM, PDFREPORT1) are passed through without being held in memory, and directories
+can be sanitized with a process pool.
+"""
 import argparse
+import functools
 import glob
+import multiprocessing
 import os
 import re
-from typing import Optional
+import tempfile
+from typing import IO, Any, Callable, Dict, Iterator, List, Match, MutableMapping, Optional, Set, Tuple
 
 from loguru import logger
 
+from .crash_data_types import CrashDataType
 
-def sanitize_xml_path(path: str, output_dir: str = 'sanitized') -> None:
+# The person types whose last names are replaced in the narrative, in order of precedence
+PERSON_TYPES = ('OWNER', 'DRIVER', 'PASSENGER', 'NONMOTORIST')
+
+# The elements that are blanked
+NAME_TAGS = ('FIRSTNAME', 'LASTNAME', 'MIDDLENAME')
+
+# Number of characters to read from a file at a time
+CHUNK_SIZE = 64 * 1024
+
+# Everything that the sanitizer needs from the document: the person type tags (to know whose name a LASTNAME is), the
+# name tags and the narrative. Nothing else starts with one of these, so the rest of the document is skipped over.
+_TOKEN_RE = re.compile(r'<(?P<end_tag>/?)(?P<person_type>OWNER|DRIVER|PASSENGER|NONMOTORIST)(?:\s[^>]*?)?(?P<empty>/?)>'
+                       r'|<(?P<name_tag>FIRSTNAME|LASTNAME|MIDDLENAME)>(?P<name>[^<]*)</(?P=name_tag)>'
+                       r'|<NARRATIVE>(?P<narrative>.*?)</NARRATIVE>', re.DOTALL)
+# The elements that _TOKEN_RE matches with their contents, which can not be split between chunks
+_ELEMENT_START_RE = re.compile('<(?:FIRSTNAME|LASTNAME|MIDDLENAME|NARRATIVE)>')
+
+
+class _NameScanner:  # pylint:disable=too-few-public-methods
+    """
+    Finds the name elements and narratives in an ACRS document, and collects the last names under each person type.
+    The document can be scanned in pieces, as long as no tag or element is split between them (see _read_chunks).
+    """
+
+    def __init__(self) -> None:
+        self.person_types: List[str] = []
+        self.last_names: Dict[str, Set[str]] = {person_type: set() for person_type in PERSON_TYPES}
+
+    def scan(self, text: str) -> Iterator[Match]:
+        """
+        Scans the next piece of the document
+        :param text: The next piece of the document
+        :return: Iterator of the name element and NARRATIVE matches, in document order
+        """
+        for match in _TOKEN_RE.finditer(text):
+            person_type = match.group('person_type')
+            if person_type:
+                if match.group('end_tag'):
+                    if self.person_types and self.person_types[-1] == person_type:
+                        self.person_types.pop()
+                elif not match.group('empty'):
+                    self.person_types.append(person_type)
+                continue
+
+            if match.group('name_tag') == 'LASTNAME' and self.person_types and match.group('name'):
+                self.last_names[self.person_types[-1]].add(match.group('name'))
+            yield match
+
+
+def _safe_end(buffer: str) -> int:
+    """
+    Finds how much of the buffer can be scanned without splitting a tag, or a name element or narrative, that the next
+    read could finish
+    :param buffer: Text read from the file that has not been scanned yet
+    :return: The index to split the buffer at
+    """
+    tag_start = buffer.rfind('<')
+    if tag_start == -1:
+        return len(buffer)
+
+    if '>' in buffer[tag_start:]:
+        # A complete tag. If it starts an element, the rest of the element has not been read yet
+        return tag_start if _ELEMENT_START_RE.match(buffer, tag_start) else len(buffer)
+
+    # An incomplete tag, which could be the end tag of an element that has not been read yet
+    element_start = buffer.rfind('<', 0, tag_start)
+    if element_start != -1 and _ELEMENT_START_RE.match(buffer, element_start):
+        return element_start
+    return tag_start
+
+
+def _read_chunks(xml_file: IO[str], chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Reads a file in chunks that do not split tags, name elements or narratives
+    :param xml_file: File to read
+    :param chunk_size: Number of characters to read at a time
+    :return: Iterator of the pieces of the file
+    """
+    buffer = ''
+    while True:
+        chunk = xml_file.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        end = _safe_end(buffer)
+        if end:
+            yield buffer[:end]
+        buffer = buffer[end:]
+    if buffer:
+        yield buffer
+
+
+def sanitize_xml_path(path: str, output_dir: str = 'sanitized', workers: int = 1, chunk_size: int = CHUNK_SIZE) -> None:
     """
-    Sanitizes the personally identifiable information in an ACRS file
+    Sanitizes the personally identifiable information in an ACRS file. Files whose sanitized copy is already newer than
+    them are skipped.
     :param path: path to sanitize, either a file or a path (where all .xml files will be sanitized)
     :param output_dir: directory to write the sanitized file
+    :param workers: Number of processes to sanitize the files with
+    :param chunk_size: Number of characters to read from each file at a time
     :return: none
     """
-    if os.path.isdir(path):
-        for file in glob.glob(os.path.join(path, '*.xml')):
-            _sanitize_xml_file(file, output_dir)
+    if os.path.isfile(output_dir):
+        raise RuntimeError("The output dir is already a file")
+    os.makedirs(output_dir, exist_ok=True)
+
+    file_names = glob.glob(os.path.join(path, '*.xml')) if os.path.isdir(path) else [path]
+    new_files = [file_name for file_name in file_names if not _is_sanitized(file_name, output_dir)]
+    logger.info('Skipping {} of {} files that are already sanitized', len(file_names) - len(new_files), len(file_names))
+
+    sanitize_file = functools.partial(_sanitize_xml_file, output_dir=output_dir, chunk_size=chunk_size)
+    if workers > 1 and len(new_files) > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for _ in pool.imap_unordered(sanitize_file, new_files):
+                pass
     else:
-        _sanitize_xml_file(path, output_dir)
+        for file_name in new_files:
+            sanitize_file(file_name)
+
+
+def _is_sanitized(filename: str, output_dir: str) -> bool:
+    """Checks if the sanitized copy of a file is newer than the file"""
+    output_file = os.path.join(output_dir, os.path.basename(filename))
+    return os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(filename)
 
 
-def _sanitize_xml_file(filename: str, output_dir: str = '.sanitized') -> None:
+def _sanitize_xml_file(filename: str, output_dir: str = '.sanitized', chunk_size: int = CHUNK_SIZE) -> None:
     """
-    Sanitizes the personally identifiable information in an ACRS file
+    Sanitizes the personally identifiable information in an ACRS file. The sanitized copy is written to a temporary
+    file that is renamed once it is complete, so a partial copy is never left in output_dir.
     :param filename: file to sanitize
     :param output_dir: directory to write the sanitized file
+    :param chunk_size: Number of characters to read at a time
     :return: None
     """
-    with open(filename, 'r', encoding='utf8') as xml_file:
-        xml_contents = sanitize_xml_str(xml_file.read())
+    logger.debug('Sanitizing {}', filename)
+    with open(filename, 'r', encoding='utf8') as xml_file, \
+            tempfile.NamedTemporaryFile('w', encoding='utf8', dir=output_dir, suffix='.tmp', delete=False) as tmp_file:
+        try:
+            is_sanitized = sanitize_xml_stream(xml_file, tmp_file, chunk_size)
+        except BaseException:
+            tmp_file.close()
+            os.remove(tmp_file.name)
+            raise
 
-    if xml_contents is None:
-        return
+    if is_sanitized:
+        # NamedTemporaryFile is only readable by its owner. Give the copy the permissions that open() would have
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_file.name, 0o666 & ~umask)
+        os.replace(tmp_file.name, os.path.join(output_dir, os.path.basename(filename)))
+    else:
+        os.remove(tmp_file.name)
 
-    if os.path.isfile(output_dir):
-        raise RuntimeError("The output dir is already a file")
 
-    if not os.path.isdir(output_dir):
-        os.mkdir(output_dir)
+def sanitize_xml_stream(xml_file: IO[str], output_file: IO[str], chunk_size: int = CHUNK_SIZE) -> bool:
+    """
+    Sanitizes the personally identifiable information in an ACRS file, reading and writing it in chunks. The narrative
+    comes before the vehicles in the file, so the file is read twice: once for the last names, and once to write it.
+    :param xml_file: file to sanitize. It must be seekable
+    :param output_file: file to write the sanitized XML to
+    :param chunk_size: Number of characters to read at a time
+    :return: True if the file was sanitized, or False if there is no NARRATIVE (and nothing was written)
+    """
+    scanner = _NameScanner()
+    has_narrative = False
+    for text in _read_chunks(xml_file, chunk_size):
+        for match in scanner.scan(text):
+            has_narrative = has_narrative or match.group('narrative') is not None
+
+    if not has_narrative:
+        logger.error("Unable to find NARRATIVE")
+        return False
 
-    with open(os.path.join(output_dir, os.path.basename(filename)), 'w', encoding='utf8') as output_file:
-        output_file.write(xml_contents)
+    replace_last_names = _last_name_replacer(scanner.last_names)
+    xml_file.seek(0)
+    scanner = _NameScanner()
+    for text in _read_chunks(xml_file, chunk_size):
+        pos = 0
+        for match in scanner.scan(text):
+            output_file.write(text[pos:match.start()])
+            output_file.write(_sanitized_element(match, replace_last_names))
+            pos = match.end()
+        output_file.write(text[pos:])
+    return True
 
 
-def sanitize_xml_str(xml_str) -> Optional[str]:
+def sanitize_xml_str(xml_str: str) -> Optional[str]:
     """
-    Sanitizes the personally identifiable information in an ACRS file from a string
+    Sanitizes the personally identifiable information in an ACRS file from a string. The document is scanned once:
+    FIRSTNAME, LASTNAME and MIDDLENAME are blanked as they are found, the last names are collected by the person type
+    that they are under, and then those last names are replaced in the narrative with one regex. This is linear in the
+    size of the file, so large files with embedded PDFs do not stall.
     :param xml_str: string (containing XML) to sanitize
-    :return: none
+    :return: The sanitized XML, or None if there is no NARRATIVE
     """
-    narratives = re.findall('<NARRATIVE>(.*?)</NARRATIVE>', xml_str, re.DOTALL)
+    scanner = _NameScanner()
+    pieces: List[str] = []
+    narratives: Dict[int, Match] = {}
+    pos = 0
+
+    for match in scanner.scan(xml_str):
+        pieces.append(xml_str[pos:match.start()])
+        pos = match.end()
+        if match.group('name_tag'):
+            pieces.append(_sanitized_element(match))
+        else:
+            # Filled in once all of the last names have been collected
+            narratives[len(pieces)] = match
+            pieces.append('')
+    pieces.append(xml_str[pos:])
+
     if not narratives:
         logger.error("Unable to find NARRATIVE")
         return None
 
-    narrative = narratives[0]
+    replace_last_names = _last_name_replacer(scanner.last_names)
+    for i, match in narratives.items():
+        pieces[i] = _sanitized_element(match, replace_last_names)
+    return ''.join(pieces)
+
 
-    for person_type in ['OWNER', 'DRIVER', 'PASSENGER', 'NONMOTORIST']:
-        last_names = re.findall('<{pt}>.*<LASTNAME>(.*?)</LASTNAME>.*</{pt}>'.format(pt=person_type), xml_str)
-        for last_name in last_names:
-            if last_name:
-                narrative = narrative.replace(f' {last_name} ', f' **{person_type}** ')
+def _sanitized_element(match: Match, replace_last_names: Optional[Callable[[str], str]] = None) -> str:
+    """
+    Gets the sanitized version of a name element or narrative found by _NameScanner
+    :param match: The match from _NameScanner.scan
+    :param replace_last_names: Function from _last_name_replacer, for narratives
+    :return: The blanked name element, or the narrative with the last names replaced
+    """
+    name_tag = match.group('name_tag')
+    if name_tag:
+        return f'<{name_tag}></{name_tag}>'
+    narrative = match.group('narrative')
+    return f'<NARRATIVE>{replace_last_names(narrative) if replace_last_names else narrative}</NARRATIVE>'
+
+
+def sanitize_report(report: CrashDataType) -> Optional[CrashDataType]:
+    """
+    Sanitizes the personally identifiable information in a report that has already been parsed (with
+    acrs_xml.parse_report), so that sanitized files only have to be parsed once. This gives the same result as parsing
+    the output of sanitize_xml_str.
+    :param report: The contents of the REPORT tag. It is sanitized in place
+    :return: The sanitized report, or None if there is no NARRATIVE
+    """
+    last_names: Dict[str, Set[str]] = {person_type: set() for person_type in PERSON_TYPES}
+    narratives: List[Tuple[MutableMapping[str, Any], str]] = []
+    _blank_names(report, None, last_names, narratives)
+
+    if not narratives:
+        logger.error("Unable to find NARRATIVE")
+        return None
+
+    replace_last_names = _last_name_replacer(last_names)
+    for section, tag in narratives:
+        if isinstance(section[tag], str):
+            section[tag] = replace_last_names(section[tag])
+    return report
+
+
+def _blank_names(value: Any, person_type: Optional[str], last_names: Dict[str, Set[str]],
+                 narratives: List[Tuple[MutableMapping[str, Any], str]]) -> None:
+    """
+    Blanks the name elements in part of a parsed report, and collects the last names and the narratives
+    :param value: The part of the report to sanitize
+    :param person_type: The person type from PERSON_TYPES that value is under, if any
+    :param last_names: Dictionary of person type to last names, that the last names are added to
+    :param narratives: List of (section, tag) for each NARRATIVE, that the narratives are added to
+    """
+    if isinstance(value, list):
+        for item in value:
+            _blank_names(item, person_type, last_names, narratives)
+        return
+
+    if not isinstance(value, MutableMapping):
+        return
+
+    for tag, item in value.items():
+        if tag in NAME_TAGS:
+            # Tags with attributes (like i:nil) are parsed to dictionaries, and sanitize_xml_str leaves them alone
+            names = item if isinstance(item, list) else [item]
+            if tag == 'LASTNAME' and person_type:
+                last_names[person_type].update(name for name in names if isinstance(name, str))
+            blanked = [None if isinstance(name, str) else name for name in names]
+            value[tag] = blanked if isinstance(item, list) else blanked[0]
+        elif tag == 'NARRATIVE':
+            narratives.append((value, tag))
+        else:
+            _blank_names(item, tag if tag in PERSON_TYPES else person_type, last_names, narratives)
+
+
+def _last_name_replacer(last_names: Dict[str, Set[str]]) -> Callable[[str], str]:
+    """
+    Builds a function that replaces the last names in a narrative with **<person type>**, as whole words
+    :param last_names: Dictionary of person type to the last names under it
+    :return: Function that takes a narrative and returns it with the last names replaced
+    """
+    # When a last name is under more than one person type, the first in PERSON_TYPES is used
+    replacements: Dict[str, str] = {}
+    for person_type in PERSON_TYPES:
+        for last_name in last_names[person_type]:
+            replacements.setdefault(last_name, f'**{person_type}**')
 
-    xml_str = re.sub('<FIRSTNAME>.*?</FIRSTNAME>', '<FIRSTNAME></FIRSTNAME>', xml_str)
-    xml_str = re.sub('<LASTNAME>.*?</LASTNAME>', '<LASTNAME></LASTNAME>', xml_str)
-    xml_str = re.sub('<MIDDLENAME>.*?</MIDDLENAME>', '<MIDDLENAME></MIDDLENAME>', xml_str)
+    if not replacements:
+        return lambda narrative: narrative
 
-    narrative = re.sub(r"(\\)", r"\\\\", narrative)
-    return re.sub('<NARRATIVE>.*?</NARRATIVE>', f'<NARRATIVE>{narrative}</NARRATIVE>', xml_str,
-                  flags=re.DOTALL)
+    # Longest first, so that a last name with spaces in it is replaced before any shorter name inside of it
+    alternation = '|'.join(re.escape(last_name) for last_name in sorted(replacements, key=len, reverse=True))
+    last_name_re = re.compile(f'(?<= )(?:{alternation})(?= )')
+    return lambda narrative: last_name_re.sub(lambda match: replacements[match.group()], narrative)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Sanitizes PII out of ACRS XML files.')
     parser.add_argument('-i', '--input_dir', required=True, help='Directory with XML files to sanitize')
     parser.add_argument('-o', '--output_dir', required=True, help='Directory to write sanitized XML files to')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of processes to sanitize the files with (default: the number of CPUs)')
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE,
+                        help=f'Number of characters to read from each file at a time (default: {CHUNK_SIZE})')
 
     args = parser.parse_args()
 
-    sanitize_xml_path(path=args.input_dir, output_dir=args.output_dir)
+    sanitize_xml_path(path=args.input_dir, output_dir=args.output_dir, workers=args.workers,
+                      chunk_size=args.chunk_size)
@@ -0,0 +1,46 @@
+"""Test suite for trafficstat.acrs_fields"""
+from collections import OrderedDict
+from datetime import datetime, time
+
+import pytest
+from sqlalchemy import inspect as sqlalchemyinspect  # type: ignore
+
+from trafficstat.acrs_fields import BOOL, DATETIME, FIELD_MAPS, ROW_BUILDERS, TEXT, TIME, UUID, compile_row_builder
+from trafficstat.crash_data_schema import Roadway
+
+NIL = OrderedDict([('@i:nil', 'true')])
+
+
+@pytest.mark.parametrize('model', FIELD_MAPS)
+def test_field_maps(model):
+    """Every tag is mapped to a column of the table"""
+    columns = {attr.key for attr in sqlalchemyinspect(model).column_attrs}
+    assert set(FIELD_MAPS[model]) <= columns
+
+
+def test_compile_row_builder():
+    """Values are read like get_single_attr, and then converted"""
+    build_row = compile_row_builder({'TEXT': TEXT, 'EMPTY': TEXT, 'NIL': TEXT, 'MISSING': TEXT, 'BOOL': BOOL,
+                                     'NILBOOL': BOOL, 'PYBOOL': BOOL, 'DATETIME': DATETIME, 'TIME': TIME, 'UUID': UUID,
+                                     'EMPTYUUID': UUID})
+    section = OrderedDict([('TEXT', 'STRDATA'), ('EMPTY', ''), ('NIL', NIL), ('BOOL', 'Y'), ('NILBOOL', NIL),
+                           ('PYBOOL', True), ('DATETIME', '2020-07-14T13:48:20'), ('TIME', '2020-07-14T13:48:20'),
+                           ('UUID', '9316ed0c-cddf-481c-94ee-4662e0b77384'), ('EMPTYUUID', '')])
+    assert build_row(section) == {
+        'TEXT': 'STRDATA', 'EMPTY': None, 'NIL': None, 'MISSING': None, 'BOOL': 1, 'NILBOOL': None, 'PYBOOL': 1,
+        'DATETIME': datetime(2020, 7, 14, 13, 48, 20), 'TIME': time(13, 48, 20),
+        'UUID': '9316ed0c-cddf-481c-94ee-4662e0b77384', 'EMPTYUUID': None}
+
+    assert compile_row_builder({'TIME': TIME})({'TIME': '13:48:20'}) == {'TIME': time(13, 48, 20)}
+
+    with pytest.raises(AssertionError):
+        build_row({'TEXT': OrderedDict([('NESTED', 'STRDATA')])})
+
+    with pytest.raises(AssertionError):
+        build_row({'BOOL': 'X'})
+
+
+def test_row_builder_get_single_attr(crash_data_reader):
+    """The row builders read the same values as get_single_attr"""
+    section = OrderedDict((tag, NIL if i % 2 else 'STRDATA') for i, tag in enumerate(FIELD_MAPS[Roadway]))
+    assert ROW_BUILDERS[Roadway](section) == {tag: crash_data_reader.get_single_attr(tag, section) for tag in section}
@@ -0,0 +1,76 @@
+"""Test suite for trafficstat.acrs_xml"""
+import glob
+import io
+import os
+from xml.parsers.expat import ExpatError
+
+import pytest
+import xmltodict  # type: ignore
+
+from trafficstat import acrs_xml
+
+TEST_FILES = glob.glob(os.path.join(os.path.dirname(__file__), 'testfiles', '*.xml'))
+
+
+@pytest.mark.parametrize('file_name', TEST_FILES)
+def test_parse_report(file_name):
+    """The streamed report should be identical to what xmltodict builds from the whole file"""
+    with open(file_name, encoding='utf-8') as acrs_file:
+        crash_file = acrs_file.read()
+    try:
+        expected = xmltodict.parse(crash_file[crash_file.find('<?xml'):], force_list=acrs_xml.FORCE_LIST)['REPORT']
+    except ExpatError:
+        expected = None
+
+    with open(file_name, 'rb') as acrs_file:
+        if expected is None:
+            with pytest.raises(ExpatError):
+                acrs_xml.parse_report(acrs_file)
+        else:
+            # Small chunks so that tags and blobs are split across reads
+            assert acrs_xml.parse_report(acrs_file, chunk_size=1024) == expected
+
+
+def test_iter_report():
+    """Sections are yielded as soon as they are closed, without reading the rest of the file"""
+    acrs_file = io.BytesIO(b'\xef\xbb\xbf<?xml version="1.0" encoding="utf-8"?>'
+                           b'<REPORT xmlns:i="http://www.w3.org/2001/XMLSchema-instance">'
+                           b'<ACRSREPORTTIMESTAMP>2020-07-14T13:48:20</ACRSREPORTTIMESTAMP>'
+                           b'<DIAGRAM><CRASHDIAGRAM>' + b'A' * 10000 + b'</CRASHDIAGRAM>'
+                           b'<CRASHDIAGRAMNATIVE i:nil="true"/></DIAGRAM>'
+                           b'<People><ACRSPERSON><FIRSTNAME>A</FIRSTNAME></ACRSPERSON></People>'
+                           b'<NARRATIVE/>'
+                           b'</REPORT>')
+
+    sections = acrs_xml.iter_report(acrs_file, chunk_size=128)
+    assert next(sections) == ('@xmlns:i', 'http://www.w3.org/2001/XMLSchema-instance')
+    assert next(sections) == ('ACRSREPORTTIMESTAMP', '2020-07-14T13:48:20')
+    assert acrs_file.tell() < 1024
+
+    tag, diagram = next(sections)
+    assert tag == 'DIAGRAM'
+    assert diagram['CRASHDIAGRAM'] == 'A' * 10000
+    assert diagram['CRASHDIAGRAMNATIVE'] == {'@i:nil': 'true'}
+
+    assert next(sections) == ('People', {'ACRSPERSON': [{'FIRSTNAME': 'A'}]})
+    assert next(sections) == ('NARRATIVE', None)
+    with pytest.raises(StopIteration):
+        next(sections)
+
+
+def test_iter_report_malformed():
+    """Malformed files raise the same error as xmltodict"""
+    with pytest.raises(ExpatError):
+        list(acrs_xml.iter_report(io.BytesIO(b'<?xml version="1.0"?><REPORT><REPORTNUMBER>1</REPORT>')))
+
+
+@pytest.mark.parametrize('tail_size', [acrs_xml.HEADER_TAIL_SIZE, 0])
+def test_read_report_header(tail_size):
+    """The header comes from the end of the file, or from streaming the file if it is not there"""
+    file_name = os.path.join(os.path.dirname(__file__), 'testfiles', 'BALTIMORE_acrs_ADI444005P-v2.xml')
+    with open(file_name, 'rb') as acrs_file:
+        assert acrs_xml.read_report_header(acrs_file, tail_size) == ('ADI444005P', '2')
+
+    acrs_file = io.BytesIO(b'<?xml version="1.0"?><REPORT xmlns:i="http://www.w3.org/2001/XMLSchema-instance">'
+                           b'<REPORTNUMBER>ADI444005P</REPORTNUMBER><VERSIONNUMBER i:nil="true"/></REPORT>')
+    assert acrs_xml.read_report_header(acrs_file, tail_size) == ('ADI444005P', None)
@@ -0,0 +1,58 @@
+"""Test suite for trafficstat.census_tract"""
+import json
+
+import pytest
+
+from trafficstat import census_tract
+
+
+@pytest.fixture(name='topology', scope='module')
+def topology_fixture():
+    """The raw TopoJSON file that the resolver is built from"""
+    with open(census_tract.TOPOJSON_FILE, encoding='utf-8') as topo_file:
+        return json.load(topo_file)
+
+
+def test_get_census_tract(topology):
+    """Every tract's internal point should resolve back to that tract"""
+    resolver = census_tract.CensusTractResolver()
+    geometries = topology['objects']['geob2']['geometries']
+    assert len(resolver.tracts) == len(geometries) == 200
+
+    for geometry in geometries:
+        props = geometry['properties']
+        assert resolver.get_census_tract(float(props['INTPTLAT']), float(props['INTPTLON'])) == props['TRACTCE']
+
+
+def test_get_census_tract_outside_city():
+    """Points outside of the city have no census tract"""
+    resolver = census_tract.CensusTractResolver()
+    assert resolver.get_census_tract(0.0, 0.0) is None
+    assert resolver.get_census_tract(39.4, -76.5) is None  # Baltimore County, north east of the city line
+    assert resolver.reverse_geocode([38.9, -77.03]) is None  # Washington DC
+
+
+def test_reverse_geocode():
+    """Tests the arcgis compatible interface"""
+    assert census_tract.reverse_geocode(['39.25963709558540', '-76.63510458032330']) == \
+        {'census_tract': '250301', 'geoid': '24510250301'}
+    assert census_tract.get_resolver() is census_tract.get_resolver()
+
+
+def test_get_census_tracts(topology):
+    """The batch lookup gives the same tracts as the single point lookup"""
+    resolver = census_tract.CensusTractResolver()
+    geometries = topology['objects']['geob2']['geometries']
+    latitudes = [float(geometry['properties']['INTPTLAT']) for geometry in geometries]
+    longitudes = [float(geometry['properties']['INTPTLON']) for geometry in geometries]
+
+    # A grid of points over the city, duplicated, with some points outside of the city and without coordinates
+    latitudes += [39.19 + i * 0.0025 for i in range(50) for _ in range(50)] * 2 + [0.0, 39.4, float('nan')]
+    longitudes += [-76.72 + j * 0.0035 for _ in range(50) for j in range(50)] * 2 + [0.0, -76.5, -76.6]
+
+    expected = [resolver.get_census_tract(lat, lon) if lat == lat else None  # pylint:disable=comparison-with-itself
+                for lat, lon in zip(latitudes, longitudes)]
+    assert resolver.get_census_tracts(latitudes, longitudes) == expected
+    assert expected[:len(geometries)] == [geometry['properties']['TRACTCE'] for geometry in geometries]
+    assert expected[-3:] == [None, None, None]
+    assert resolver.get_census_tracts([], []) == []
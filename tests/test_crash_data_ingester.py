@@ -1,6 +1,7 @@
 """Pytest suite for src/crash_data_ingestor"""
 # pylint:disable=protected-access
 # pylint:disable=R0801 ; copied code
+import glob
 import os
 import shutil
 import tempfile
@@ -13,6 +14,7 @@ from sqlalchemy import engine as enginetype, inspect  # type: ignore
 from sqlalchemy.ext.declarative import DeclarativeMeta  # type: ignore
 from sqlalchemy.orm import Session  # type: ignore
 
+from trafficstat import census_tract
 from trafficstat.crash_data_ingester import CrashDataReader
 from trafficstat.crash_data_schema import Approval, Base, Crash, Circumstance, CitationCode, CommercialVehicle, \
     CrashDiagram, DamagedArea, Ems, Event, PdfReport, Person, PersonInfo, Roadway, TowedUnit, Vehicle, VehicleUse, \
@@ -140,6 +142,64 @@ def test_read_crash_data_files_by_dir(crash_data_reader, tmpdir):
         check()
 
 
+@clean((Approval, Crash, Circumstance, CitationCode, CommercialVehicle, CrashDiagram, DamagedArea, Ems, Event,
+        PdfReport, Person, PersonInfo, Roadway, TowedUnit, Vehicle, VehicleUse, Witness))
+def test_read_crash_data_files_parallel(crash_data_reader, tmpdir):
+    """Reading a directory with multiple workers should give the same results as reading it serially"""
+    test_dir = os.path.join(tmpdir, 'testfiles')
+    shutil.copytree(os.path.join('tests', 'testfiles'), test_dir)
+
+    crash_data_reader.read_crash_data(dir_name=test_dir, workers=2, writers=2)
+    assert os.listdir(test_dir) == ['.processed']
+
+    with Session(crash_data_reader.engine) as session:
+        check_single_entries(session, 13)
+        for model, expected_rows in [(Circumstance, 40), (CitationCode, 6), (CommercialVehicle, 3),
+                                     (DamagedArea, 47), (Ems, 6), (Event, 15), (Person, 51), (PersonInfo, 30),
+                                     (TowedUnit, 3), (Vehicle, 22), (VehicleUse, 22), (Witness, 3)]:
+            check_database_rows(session, model, expected_rows)
+
+        # The v2 file should win, regardless of the order the workers finish in
+        assert session.query(Crash.VERSIONNUMBER).filter(Crash.REPORTNUMBER == 'ADI444005P').scalar() == 2
+
+
+def test_read_crash_data_bulk_insert(tmpdir):
+    """Bulk inserts give the same results as upserts, and reports that are already in the database are upserted"""
+    reader = CrashDataReader(f'sqlite:///{os.path.join(tmpdir, "bulkinsert.db")}', bulk_insert=True)
+    test_dir = os.path.join(tmpdir, 'testfiles')
+    shutil.copytree(os.path.join('tests', 'testfiles'), test_dir)
+
+    # v1 is inserted, and v2 conflicts with it
+    reader.read_crash_data(file_name=os.path.join(test_dir, 'BALTIMORE_acrs_ADI444005P-v1.xml'), copy=False)
+    reader.read_crash_data(file_name=os.path.join(test_dir, 'BALTIMORE_acrs_ADI444005P-v2.xml'), copy=False)
+    reader.read_crash_data(dir_name=test_dir, copy=False)
+
+    with Session(reader.engine) as session:
+        check_single_entries(session, 13)
+        for model, expected_rows in [(Circumstance, 40), (CitationCode, 6), (CommercialVehicle, 3),
+                                     (DamagedArea, 47), (Ems, 6), (Event, 15), (Person, 51), (PersonInfo, 30),
+                                     (TowedUnit, 3), (Vehicle, 22), (VehicleUse, 22), (Witness, 3)]:
+            check_database_rows(session, model, expected_rows)
+        assert session.query(Crash.VERSIONNUMBER).filter(Crash.REPORTNUMBER == 'ADI444005P').scalar() == 2
+
+
+def test_skip_loaded_reports(crash_data_reader, tmpdir):
+    """Files that are already in the database at the same or a newer version are not read again"""
+    test_dir = os.path.join(tmpdir, 'testfiles')
+    shutil.copytree(os.path.join('tests', 'testfiles'), test_dir)
+    acrs_files = sorted(glob.glob(os.path.join(test_dir, '*.xml')))
+    v1_file = os.path.join(test_dir, 'BALTIMORE_acrs_ADI444005P-v1.xml')
+
+    crash_data_reader.read_crash_data(file_name=v1_file, copy=False)
+    assert crash_data_reader._skip_loaded_reports(acrs_files, copy=False) == \
+        [i for i in acrs_files if i != v1_file]
+    assert os.path.exists(v1_file)
+
+    crash_data_reader.read_crash_data(dir_name=test_dir, copy=False)
+    assert crash_data_reader._skip_loaded_reports(acrs_files) == [os.path.join(test_dir, 'BALTIMORE_emptyxml.xml')]
+    assert sorted(os.listdir(test_dir)) == ['.processed', 'BALTIMORE_emptyxml.xml']
+
+
 @clean((Approval, Crash, Circumstance, CitationCode, CommercialVehicle, CrashDiagram, DamagedArea, Ems, Event,
         PdfReport, Person, PersonInfo, Roadway, TowedUnit, Vehicle, VehicleUse, Witness))
 def test_read_crash_data_files_by_file(crash_data_reader, tmpdir):  # pylint:disable=too-many-statements
@@ -312,6 +372,19 @@ def test_read_crash_data_single(crash_data_reader):
     verify_results(Crash, crash_data_reader.engine, constants_test_data.crash_test_output_data)
 
 
+def test_read_crash_data_offline_geocode(tmpdir):
+    """Census tracts should be populated by the offline geocoder"""
+    reader = CrashDataReader(conn_str=f'sqlite:///{os.path.join(tmpdir, "offline.db")}',
+                             reverse_geocoder=census_tract.reverse_geocode)
+    with Session(reader.engine) as session:
+        session.add(Roadway(ROADID='9316ed0c-cddf-481c-94ee-4662e0b77384'))
+        session.commit()
+    reader._read_main_crash_data(crash_dict=constants_test_data.crash_test_input_data)
+
+    with Session(reader.engine) as session:
+        assert session.query(Crash.CENSUS_TRACT).one()[0] == '250207'
+
+
 @clean(Approval)
 def test_read_approval_data(crash_data_reader):
     """Testing the elements in the APPROVALDATA tag"""
@@ -496,6 +569,30 @@ def test_read_roadway_data(crash_data_reader):
     verify_results(Roadway, crash_data_reader.engine, constants_test_data.roadway_output_data)
 
 
+@clean((Crash, Roadway))
+def test_report_transaction(crash_data_reader):
+    """Objects are only written when the report transaction closes, and nothing is written if it fails"""
+    with Session(crash_data_reader.engine) as session:
+        with pytest.raises(RuntimeError):
+            with crash_data_reader._report_transaction():
+                crash_data_reader._read_roadway_data(roadway_dict=constants_test_data.roadway_input_data)
+                raise RuntimeError('Failure partway through a report')
+        check_database_rows(session, Roadway, 0)
+
+        with crash_data_reader._report_transaction():
+            crash_data_reader._read_roadway_data(roadway_dict=constants_test_data.roadway_input_data)
+            crash_data_reader._read_main_crash_data(crash_dict=constants_test_data.crash_test_input_data)
+            check_database_rows(session, Roadway, 0)
+        check_database_rows(session, Roadway, 1)
+        check_database_rows(session, Crash, 1)
+
+        # Writing the same report again should update the rows in place
+        with crash_data_reader._report_transaction():
+            crash_data_reader._read_roadway_data(roadway_dict=constants_test_data.roadway_input_data)
+        check_database_rows(session, Roadway, 1)
+    verify_results(Roadway, crash_data_reader.engine, constants_test_data.roadway_output_data)
+
+
 @clean(TowedUnit)
 def test_read_towed_vehicle_data(crash_data_reader):
     """Tests the OrderedDict from TOWEDUNITs tag"""
@@ -553,6 +650,16 @@ def test_is_nil(crash_data_reader):
     assert crash_data_reader.is_element_nil(None)
 
 
+def test_check_and_log(crash_data_reader):
+    """Nil sections are skipped, whether they are passed by position or keyword, and every call is counted"""
+    assert crash_data_reader._read_witness_data(OrderedDict([('@i:nil', 'true')])) is False
+    assert crash_data_reader._read_witness_data(witness_dict=None) is False
+    assert crash_data_reader._read_roadway_data(roadway_dict=constants_test_data.roadway_input_data) is None
+
+    assert crash_data_reader.section_metrics.calls == {'_read_witness_data': 2, '_read_roadway_data': 1}
+    assert crash_data_reader.section_metrics.seconds['_read_roadway_data'] > 0
+
+
 def test_convert_to_bool(crash_data_reader):
     """Testing the results of _convert_to_bool"""
     assert not crash_data_reader.convert_to_bool('N')
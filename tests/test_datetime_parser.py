@@ -0,0 +1,49 @@
+"""Test suite for trafficstat.datetime_parser"""
+import timeit
+
+import pytest
+from pandas import to_datetime  # type: ignore
+from pandas.errors import OutOfBoundsDatetime  # type: ignore
+
+from trafficstat.datetime_parser import parse_datetime
+
+DATE_STRINGS = ['2020-07-14T13:48:20', '2020-07-14T13:48:20.123', '2020-07-14T13:48:20.1234',
+                '2020-07-14T13:48:20.12345', '2020-07-14T13:48:20.123456', '2020-07-14 13:48:20',
+                '2020-07-14 13:48:20.1', '2020-07-14', '2020-07-14T13:48:20Z', '2020-07-14T13:48:20-04:00',
+                '07/14/2020', '1677-09-21T00:12:43.145225', '2262-04-11T23:47:16.854775']
+
+
+@pytest.mark.parametrize('dt_str', DATE_STRINGS)
+def test_parse_datetime(dt_str):
+    """Same results as pandas.to_datetime"""
+    assert parse_datetime(dt_str) == to_datetime(dt_str)
+
+
+@pytest.mark.parametrize('dt_str', ['0001-01-01T00:00:00', '1677-09-21T00:12:43.145224', '2262-04-11T23:47:16.854776',
+                                    '9999-12-31T23:59:59.9999', None])
+def test_parse_datetime_out_of_bounds(dt_str):
+    """Dates that pandas can not represent are None"""
+    if dt_str:
+        with pytest.raises(OutOfBoundsDatetime):
+            to_datetime(dt_str)
+    assert parse_datetime(dt_str) is None
+
+
+def test_parse_datetime_invalid():
+    """Invalid dates raise the same errors as pandas.to_datetime"""
+    for dt_str in ('2020-02-30T00:00:00', '2020-07-14T25:00:00.1234', 'not a date'):
+        with pytest.raises(ValueError) as expected:
+            to_datetime(dt_str)
+        with pytest.raises(expected.type):
+            parse_datetime(dt_str)
+
+
+def test_parse_datetime_speed():
+    """
+    Parsing the ACRS formats is faster than pandas.to_datetime. It is about 40 times faster, but the bar is set low so
+    that a busy machine does not fail the test
+    """
+    dt_strs = ['2020-07-14T13:48:20', '2020-07-14T13:48:20.123456', '2020-07-14T13:48:20.1234'] * 100
+    parse_time = min(timeit.repeat(lambda: [parse_datetime(dt_str) for dt_str in dt_strs], number=20, repeat=5))
+    pandas_time = min(timeit.repeat(lambda: [to_datetime(dt_str) for dt_str in dt_strs], number=20, repeat=5))
+    assert parse_time * 3 < pandas_time
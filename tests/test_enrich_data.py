@@ -0,0 +1,88 @@
+"""Test suite for trafficstat.enrich_data"""
+# pylint:disable=protected-access
+import pytest
+from sqlalchemy import create_engine, select, update  # type: ignore
+from sqlalchemy.orm import Session  # type: ignore
+
+from trafficstat import census_tract, enrich_data
+from trafficstat.ms2generator_schema import RoadwaySanitized
+
+
+@pytest.mark.parametrize('road_name,expected', [
+    ('3000 Tivoly Ave', 'TIVOLY AVE'),
+    ('3000 BLOCK OF N CHARLES STREET', 'N CHARLES ST'),
+    ('UNIT BLK OF E. BALTIMORE ST.', 'E BALTIMORE ST'),
+    ('UNIT BLK. OF PRATT ST', 'PRATT ST'),
+    ('S. HANOVER ST. (MD 2)', 'HANOVER ST'),
+    ('W NORTH AVENUE', 'NORTH AVE'),
+    ('FALLS ROAD', 'FALLS RD'),
+    ('GWYNNS FALLS PARKWAY', 'GWYNNS FALLS PKWY'),
+    ('CLINTON CONNECOR', 'CLINTON CONNECTOR'),
+    # Only whole words are replaced
+    ('100 UNIT BLOCK WAYNE AVENUE', 'WAYNE AVE'),
+    ('BLOCKER LANE', 'BLOCKER LN'),
+    ('', ''),
+])
+def test_clean_road_name(road_name, expected):
+    """Block numbers, directions and periods are removed, and suffixes are abbreviated"""
+    assert enrich_data.clean_road_name(road_name) == expected
+
+
+def test_clean_road_name_cache():
+    """Each distinct road name is only cleaned once"""
+    enrich_data.clean_road_name.cache_clear()
+    for _ in range(3):
+        enrich_data.clean_road_name('1700 E 30th St')
+    assert enrich_data.clean_road_name.cache_info().misses == 1
+
+
+@pytest.fixture(name='conn_str_unenriched')
+def unenriched_fixture(conn_str_sanitized):
+    """The sanitized crash database, without census tracts or cleaned road names"""
+    engine = create_engine(conn_str_sanitized, future=True)
+    with engine.begin() as connection:
+        connection.execute(update(RoadwaySanitized).values(CENSUS_TRACT=None, ROAD_NAME_CLEAN=None,
+                                                           REFERENCE_ROAD_NAME_CLEAN=None))
+    yield conn_str_sanitized
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_geocode_acrs_sanitized_batch(conn_str_unenriched, workers):
+    """The census tracts are written in chunks, on any number of connections"""
+    enricher = enrich_data.Enrich(conn_str_unenriched, workers=workers, chunk_size=2)
+    enricher.geocode_acrs_sanitized_batch()
+
+    with Session(enricher.engine) as session:
+        rows = session.execute(select(RoadwaySanitized.X_COORDINATES, RoadwaySanitized.Y_COORDINATES,
+                                      RoadwaySanitized.CENSUS_TRACT)).all()
+    assert len(rows) == 10
+    assert any(row[2] for row in rows)
+    for row in rows:
+        assert row[2] == census_tract.get_resolver().get_census_tract(row[0], row[1])
+
+    # The rows with census tracts are not geocoded again
+    assert len(enricher._roadways()) == len([row for row in rows if row[2] is None])
+
+
+def test_geocode_acrs_sanitized(conn_str_unenriched):
+    """The reverse geocoder is called for each roadway that is missing a census tract"""
+    locations = []
+
+    def reverse_geocoder(location):
+        locations.append(location)
+        return {'census_tract': '123456'} if len(locations) % 2 else None
+
+    enricher = enrich_data.Enrich(conn_str_unenriched, reverse_geocoder=reverse_geocoder)
+    enricher.geocode_acrs_sanitized()
+    assert len(locations) == 10
+    assert len(enricher._roadways()) == 5
+
+
+def test_clean_road_names(conn_str_unenriched):
+    """The cleaned road names are written to the roadway table"""
+    enricher = enrich_data.Enrich(conn_str_unenriched, chunk_size=3)
+    enricher.clean_road_names()
+
+    with Session(enricher.engine) as session:
+        roadway = session.get(RoadwaySanitized, 'A0000001')
+        assert (roadway.ROAD_NAME_CLEAN, roadway.REFERENCE_ROAD_NAME_CLEAN) == ('TIVOLY AVE', '30TH ST')
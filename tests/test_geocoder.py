@@ -0,0 +1,48 @@
+"""Test suite for trafficstat.geocoder"""
+# pylint:disable=protected-access
+import os
+import subprocess
+import sys
+
+import arcgis.geocoding  # type: ignore
+import arcgis.gis  # type: ignore
+
+from trafficstat import geocoder
+
+# Seconds that a cold import of the ingester or enricher can take. It was several seconds when arcgis was imported,
+# and ArcGIS Online was connected to, at import time
+IMPORT_BUDGET = 2.0
+
+
+def test_arcgis_reverse_geocode(monkeypatch):
+    """ArcGIS Online is connected to the first time that it is used, and only once"""
+    connections = []
+    monkeypatch.setattr(arcgis.gis, 'GIS', lambda: connections.append(1))
+    monkeypatch.setattr(arcgis.geocoding, 'reverse_geocode', lambda location: {'census_tract': location})
+    geocoder._arcgis_connection.cache_clear()
+
+    assert geocoder.arcgis_reverse_geocode([39.3, -76.6]) == {'census_tract': [39.3, -76.6]}
+    assert geocoder.arcgis_reverse_geocode([39.2, -76.5]) == {'census_tract': [39.2, -76.5]}
+    assert len(connections) == 1
+    geocoder._arcgis_connection.cache_clear()
+
+
+def test_offline_reverse_geocode():
+    """Same results as census_tract.reverse_geocode"""
+    assert geocoder.GEOCODERS['offline'](['39.25963709558540', '-76.63510458032330']) == \
+        {'census_tract': '250301', 'geoid': '24510250301'}
+
+
+def test_import_time():
+    """Importing the ingester and the enricher does not import the heavy dependencies or connect to ArcGIS"""
+    code = ('import sys, time\n'
+            'start = time.perf_counter()\n'
+            'import trafficstat, trafficstat.crash_data_ingester, trafficstat.enrich_data\n'
+            'print(time.perf_counter() - start)\n'
+            'print(" ".join(sorted({"arcgis", "pandas", "pyarrow", "pyvin", "xmltodict"} & set(sys.modules))))\n')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, check=True, text=True, env=env)
+
+    import_time, heavy_modules = result.stdout.split('\n')[:2]
+    assert heavy_modules == ''
+    assert float(import_time) < IMPORT_BUDGET
@@ -1,13 +1,18 @@
 """Pytest suite for src/ms2generator"""
 # pylint:disable=protected-access
+import datetime
 import os
+import uuid
 
 import pandas as pd  # type: ignore
 import pytest
 from numpy import nan
 from pandas.testing import assert_series_equal  # type: ignore
+from sqlalchemy import create_engine, event  # type: ignore
+from sqlalchemy.orm import Session  # type: ignore
 
-from trafficstat.ms2generator import WorksheetMaker
+from trafficstat.ms2generator import WorksheetMaker, lookup_codes, validate_codes
+from trafficstat.ms2generator_schema import CrashSanitized, EmsSanitized, RoadwaySanitized
 
 
 def test_add_crash_worksheet(tmpdir, conn_str_sanitized, conn_str_unsanitized):  # pylint:disable=unused-argument
@@ -85,6 +90,30 @@ def test_add_vehicle_worksheet(tmpdir, conn_str_sanitized):
     assert len(dfs) == 4
 
 
+def test_add_vehicle_worksheet_circum(tmpdir, conn_str_sanitized):
+    """The vehicle circumstances are queried once, and match calling add_vehicle_circum for each vehicle"""
+    queries = []
+    worksheet_maker = WorksheetMaker(conn_str=conn_str_sanitized, workbook_name=os.path.join(tmpdir, 'sheet.xlsx'))
+    event.listen(worksheet_maker.engine, 'before_cursor_execute', lambda *args: queries.append(args[2]))
+    with worksheet_maker:
+        worksheet_maker.add_vehicle_worksheet()
+    assert len(queries) == 2
+
+    vehicles = pd.read_excel(worksheet_maker.workbook_name, sheet_name='VEHICLE')
+    actual = pd.read_excel(worksheet_maker.workbook_name, sheet_name='VEHICLE_CIRCUM')
+
+    worksheet_maker = WorksheetMaker(conn_str=conn_str_sanitized, workbook_name=os.path.join(tmpdir, 'sheet2.xlsx'))
+    with worksheet_maker:
+        for report_no, vin_no in zip(vehicles['REPORT_NO'], vehicles['VIN_NO']):
+            worksheet_maker.add_vehicle_circum(report_no, str(int(vin_no)))
+    expected = pd.read_excel(worksheet_maker.workbook_name, sheet_name='VEHICLE_CIRCUM')
+
+    assert actual.equals(expected)
+
+    # The circumstances have the same VEHICLE_ID as their vehicle
+    assert set(actual['VEHICLE_ID']) <= set(vehicles['VEHICLE_ID'])
+
+
 def test_add_circum(tmpdir, conn_str_sanitized):
     """test for the add_vehicle_circum and add_road_circum method"""
     worksheet_maker = WorksheetMaker(conn_str=conn_str_sanitized, workbook_name=os.path.join(tmpdir, 'sheet.xlsx'))
@@ -162,6 +191,33 @@ def test_validate_road_value():
         worksheet_maker._validate_road_value('60')
 
 
+def test_column_plan():
+    """Columns without a formatter are standardized"""
+    worksheet_maker = WorksheetMaker(conn_str='sqlite://')
+    column_plan = worksheet_maker._column_plan(['LIGHT_CODE', 'REPORT_NO', 'C_M_ZONE_FLAG', 'ACC_TIME'], {
+        'LIGHT_CODE': worksheet_maker._zero_pad_code,
+        'C_M_ZONE_FLAG': worksheet_maker._format_flag,
+        'ACC_TIME': worksheet_maker._format_time,
+    })
+    assert [formatter(val) for formatter, val in zip(column_plan, [1.0, '123', True, 905])] == \
+           ['01', 123, 'Y', '0905']
+    assert [formatter(val) for formatter, val in zip(column_plan, ['A9.99', 'A9.99', 'A9.99', '1530'])] == \
+           ['A9.99', '', '', '1530']
+
+
+def test_validate_codes():
+    """Validates a whole column of codes, and counts the invalid ones"""
+    validated, invalid = validate_codes(['48.88', 'A9.99', None, '00', '01', 1, '01'], 'vehicle')
+    assert validated == ['48.88', None, None, '00', None, None, None]
+    assert invalid == {'01': 2, '1': 1}
+
+
+def test_lookup_codes():
+    """Looks up a whole column of codes"""
+    assert lookup_codes(['01', '02', '99', 'XX'], 'sex') == ['Male', 'Female', 'Unknown', None]
+    assert lookup_codes(['01', '00'], 'direction') == ['NORTH', 'NOT APPLICABLE']
+
+
 def test_lookup_sex():
     """test for the _lookup_sex method"""
 
@@ -176,7 +232,70 @@ def test_create_worksheet():
 
 def test_get_person_uuid():
     """test for the _get_person_uuid method"""
+    worksheet_maker = WorksheetMaker(conn_str='sqlite://')
+    person_uuid = worksheet_maker._get_person_uuid(1.0)
+    assert person_uuid == str(uuid.UUID(person_uuid))
+    assert worksheet_maker._get_person_uuid('1') == person_uuid
+    assert WorksheetMaker(conn_str='sqlite://')._get_person_uuid(1.0) == person_uuid
+    assert worksheet_maker._get_person_uuid(2.0) != person_uuid
 
 
 def test_get_vehicle_uuid():
     """test for the _get_vehicle_uuid method"""
+    worksheet_maker = WorksheetMaker(conn_str='sqlite://')
+    vehicle_uuid = worksheet_maker._get_vehicle_uuid(1.0)
+    assert worksheet_maker._get_vehicle_uuid('1') == vehicle_uuid
+    assert WorksheetMaker(conn_str='sqlite://')._get_vehicle_uuid(1.0) == vehicle_uuid
+    assert worksheet_maker._get_person_uuid(1.0) != vehicle_uuid
+
+
+def test_incremental(tmpdir, conn_str_sanitized):
+    """Incremental exports only include the reports since the last incremental export"""
+    def export(workbook_name, **kwargs):
+        workbook_name = os.path.join(tmpdir, workbook_name)
+        with WorksheetMaker(conn_str=conn_str_sanitized, workbook_name=workbook_name, **kwargs) as worksheet_maker:
+            worksheet_maker.add_crash_worksheet()
+            worksheet_maker.add_ems_worksheet()
+        return pd.read_excel(workbook_name, sheet_name=None)
+
+    # The first export has everything
+    assert len(export('first.xlsx', incremental=True)['CRASH']) == 10
+
+    engine = create_engine(conn_str_sanitized, future=True)
+    with Session(engine) as session:
+        session.add_all([
+            CrashSanitized(REPORT_NO='A0000099', ACC_DATE=datetime.datetime(2016, 1, 4), ACC_TIME='1200'),
+            RoadwaySanitized(REPORT_NO='A0000099', ROAD_NAME='GUILFORD AVE'),
+            EmsSanitized(EMS_ID=99, REPORT_NO='A0000099', EMS_UNIT_LABEL='A'),
+        ])
+        session.commit()
+
+    sheets = export('second.xlsx', incremental=True, lookback_days=0)
+    assert list(sheets['CRASH']['REPORT_NO']) == ['A0000099']
+    assert list(sheets['EMS']['REPORT_NO']) == ['A0000099']
+
+    sheets = export('third.xlsx', incremental=True, lookback_days=0)
+    assert sheets['CRASH'].empty and sheets['EMS'].empty
+
+    # The watermark is only used by incremental exports
+    assert len(export('full.xlsx')['CRASH']) == 11
+
+
+def test_streaming(tmpdir, conn_str_sanitized):
+    """Streaming mode writes the same sheets, in small chunks"""
+    sheets = {}
+    for streaming in (False, True):
+        workbook_name = os.path.join(tmpdir, f'sheet_{streaming}.xlsx')
+        worksheet_maker = WorksheetMaker(conn_str=conn_str_sanitized, workbook_name=workbook_name,
+                                         streaming=streaming, chunk_size=3)
+        with worksheet_maker:
+            worksheet_maker.add_crash_worksheet()
+            worksheet_maker.add_person_worksheet()
+            worksheet_maker.add_ems_worksheet()
+            worksheet_maker.add_vehicle_worksheet()
+            worksheet_maker.add_road_circum()
+        sheets[streaming] = pd.read_excel(workbook_name, sheet_name=None)
+
+    assert sheets[True].keys() == sheets[False].keys()
+    for sheet_name, expected in sheets[False].items():
+        assert sheets[True][sheet_name].equals(expected), sheet_name
@@ -0,0 +1,48 @@
+"""Test suite for trafficstat.parquet_export"""
+import datetime
+import os
+
+import pyarrow as pa  # type: ignore
+import pyarrow.dataset as ds  # type: ignore
+from sqlalchemy import create_engine, func, select  # type: ignore
+from sqlalchemy.orm import Session  # type: ignore
+
+from trafficstat.ms2generator_schema import CrashSanitized
+from trafficstat.parquet_export import DATASETS, PARTITIONING, ParquetExporter, arrow_schema
+
+
+def test_arrow_schema():
+    """The Arrow types match the database column types"""
+    schema = arrow_schema(DATASETS['crash'])
+    assert schema.field('REPORT_NO').type == pa.string()
+    assert schema.field('ACC_DATE').type == pa.timestamp('us')
+    assert schema.field('COUNTY_NO').type == pa.decimal128(2, 0)
+    assert schema.names[-2:] == ['year', 'month']
+    assert arrow_schema(DATASETS['vehicle']).field('VEHICLE_ID').type == pa.float64()
+
+
+def test_export_all(tmpdir, conn_str_sanitized):
+    """Every table is exported, partitioned by year and month"""
+    exporter = ParquetExporter(conn_str_sanitized, str(tmpdir), chunk_size=3)
+    row_counts = exporter.export_all()
+
+    engine = create_engine(conn_str_sanitized, future=True)
+    with Session(engine) as session:
+        for name, table in DATASETS.items():
+            assert row_counts[name] == session.execute(select(func.count()).select_from(table)).scalar(), name
+    assert os.path.isdir(os.path.join(tmpdir, 'crash', 'year=2015', 'month=10'))
+
+    dataset = ds.dataset(os.path.join(tmpdir, 'crash'), format='parquet', partitioning=PARTITIONING)
+    crashes = dataset.to_table(columns=['REPORT_NO', 'ACC_DATE'],
+                               filter=(ds.field('year') == 2015) & (ds.field('month') == 10))
+    assert crashes.num_rows == row_counts['crash']
+    assert sorted(crashes.column('REPORT_NO').to_pylist())[0] == 'A0000001'
+
+    # Exporting again replaces the partitions instead of adding to them
+    with Session(engine) as session:
+        session.add(CrashSanitized(REPORT_NO='A0000099', ACC_DATE=datetime.datetime(2016, 1, 4)))
+        session.commit()
+    assert exporter.export_table('crash') == row_counts['crash'] + 1
+    dataset = ds.dataset(os.path.join(tmpdir, 'crash'), format='parquet', partitioning=PARTITIONING)
+    assert dataset.count_rows() == row_counts['crash'] + 1
+    assert dataset.to_table(filter=ds.field('year') == 2016).column('REPORT_NO').to_pylist() == ['A0000099']
@@ -0,0 +1,138 @@
+"""Test suite for trafficstat.upsert"""
+import os
+from typing import List
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine  # type: ignore
+from sqlalchemy.dialects import mssql, mysql, postgresql  # type: ignore
+from sqlalchemy.exc import IntegrityError  # type: ignore
+from sqlalchemy.orm import Session  # type: ignore
+
+from trafficstat import upsert
+from trafficstat.crash_data_schema import Base, Crash, Person, Roadway, Witness
+
+
+@pytest.fixture(name='engine')
+def engine_fixture(tmpdir):
+    """Empty sqlite database with the crash data schema"""
+    engine = create_engine(f'sqlite:///{os.path.join(tmpdir, "upsert.db")}', future=True)
+    with engine.begin() as connection:
+        Base.metadata.create_all(connection)
+    yield engine
+
+
+def test_group_rows():
+    """Rows are grouped by table in foreign key order, and by the columns they set"""
+    groups = list(upsert.group_rows([
+        (Person.__table__, {'PERSONID': '21732e90-2796-497f-a5c2-5d7877510d4c', 'FIRSTNAME': 'A'}),
+        (Crash.__table__, {'REPORTNUMBER': 'ADJ063005D', 'ROADID': '1'}),
+        (Roadway.__table__, {'ROADID': '1', 'ROAD_NAME': 'CHARLES ST'}),
+        (Person.__table__, {'PERSONID': 'd978be20-08c7-4ff3-b2e9-a251047ac3a7', 'FIRSTNAME': 'B'}),
+        (Person.__table__, {'PERSONID': '6da1e0f3-0c20-4f7c-9d1c-8a9f2a3e4b5c'}),
+    ]))
+
+    assert [table.name for table, _ in groups] == ['acrs_roadway', 'acrs_crash', 'acrs_person', 'acrs_person']
+    assert [row['FIRSTNAME'] for row in groups[2][1]] == ['A', 'B']
+    assert groups[3][1] == [{'PERSONID': '6da1e0f3-0c20-4f7c-9d1c-8a9f2a3e4b5c'}]
+
+
+def test_upsert(engine):
+    """Inserts new rows, updates existing rows and leaves unset columns alone"""
+    with engine.begin() as connection:
+        upsert.upsert(connection, Roadway.__table__, [
+            {'ROADID': '1', 'ROAD_NAME': 'CHARLES ST', 'ROUTE_NUMBER': '139'},
+            {'ROADID': '2', 'ROAD_NAME': 'ST PAUL ST', 'ROUTE_NUMBER': None},
+        ])
+
+    with engine.begin() as connection:
+        upsert.upsert(connection, Roadway.__table__, [
+            {'ROADID': '1', 'ROAD_NAME': 'N CHARLES ST'},
+            {'ROADID': '3', 'ROAD_NAME': 'CALVERT ST'},
+            {'ROADID': '3', 'ROAD_NAME': 'N CALVERT ST'},
+        ])
+
+    with Session(engine) as session:
+        actual = {road.ROADID: (road.ROAD_NAME, road.ROUTE_NUMBER) for road in session.query(Roadway)}
+    assert actual == {'1': ('N CHARLES ST', '139'),
+                      '2': ('ST PAUL ST', None),
+                      '3': ('N CALVERT ST', None)}
+
+
+def test_upsert_primary_key_only(engine):
+    """Tables where every column is in the primary key are inserted once"""
+    with engine.begin() as connection:
+        upsert.upsert(connection, Crash.__table__, [{'REPORTNUMBER': 'ADJ063005D'}])
+        upsert.upsert(connection, Person.__table__, [{'PERSONID': '21732e90-2796-497f-a5c2-5d7877510d4c'}])
+        for _ in range(2):
+            upsert.upsert(connection, Witness.__table__, [
+                {'PERSONID': '21732e90-2796-497f-a5c2-5d7877510d4c', 'REPORTNUMBER': 'ADJ063005D'}])
+
+    with Session(engine) as session:
+        assert session.query(Witness).count() == 1
+
+
+def test_insert_rows(engine):
+    """Inserts the last row for each primary key, and conflicts with rows that are already in the table"""
+    with engine.begin() as connection:
+        upsert.insert_rows(connection, Roadway.__table__, [
+            {'ROADID': '1', 'ROAD_NAME': 'CHARLES ST'},
+            {'ROADID': '1', 'ROAD_NAME': 'N CHARLES ST'},
+            {'ROADID': '2', 'ROAD_NAME': 'ST PAUL ST'},
+        ])
+
+    with pytest.raises(IntegrityError):
+        with engine.begin() as connection:
+            upsert.insert_rows(connection, Roadway.__table__, [{'ROADID': '3', 'ROAD_NAME': 'CALVERT ST'},
+                                                               {'ROADID': '2', 'ROAD_NAME': 'N ST PAUL ST'}])
+
+    with Session(engine) as session:
+        actual = {road.ROADID: road.ROAD_NAME for road in session.query(Roadway)}
+    assert actual == {'1': 'N CHARLES ST', '2': 'ST PAUL ST'}
+
+
+class RecordingConnection:  # pylint:disable=too-few-public-methods
+    """Stands in for a SQL Server connection, and records the statements that are executed on it"""
+
+    def __init__(self, fail_on: str):
+        self.dialect = mssql.dialect()
+        self.fail_on = fail_on
+        self.statements: List[str] = []
+
+    def execute(self, statement, *_args):
+        """Records the statement, and raises an IntegrityError if it starts with fail_on"""
+        self.statements.append(str(statement))
+        if self.statements[-1].startswith(self.fail_on):
+            raise IntegrityError(self.statements[-1], {}, Exception('Violation of PRIMARY KEY constraint'))
+
+
+@pytest.mark.parametrize('write', [upsert.insert_rows, upsert.upsert])
+def test_identity_insert(write):
+    """IDENTITY_INSERT is turned off again on SQL Server, even when the statement fails"""
+    table = Table('identity_table', MetaData(), Column('ID', Integer, primary_key=True), Column('NAME', String))
+    connection = RecordingConnection(fail_on='INSERT' if write is upsert.insert_rows else 'MERGE')
+    with pytest.raises(IntegrityError):
+        write(connection, table, [{'ID': 1, 'NAME': 'A'}])
+
+    assert connection.statements[0] == 'SET IDENTITY_INSERT identity_table ON'
+    assert connection.statements[-1] == 'SET IDENTITY_INSERT identity_table OFF'
+
+
+def test_merge_statement():
+    """SQL Server gets a MERGE on the primary key"""
+    stmt = str(upsert.merge_statement(Witness.__table__, ['PERSONID', 'REPORTNUMBER'], mssql.dialect()))
+    assert stmt.startswith('MERGE INTO acrs_witness WITH (HOLDLOCK) AS target '
+                           'USING (VALUES (:PERSONID, :REPORTNUMBER))')
+    assert 'ON target.[PERSONID] = source.[PERSONID] AND target.[REPORTNUMBER] = source.[REPORTNUMBER]' in stmt
+    assert 'WHEN MATCHED' not in stmt
+
+    stmt = str(upsert.merge_statement(Roadway.__table__, ['ROADID', 'ROAD_NAME'], mssql.dialect()))
+    assert 'WHEN MATCHED THEN UPDATE SET target.[ROAD_NAME] = source.[ROAD_NAME]' in stmt
+    assert stmt.endswith('WHEN NOT MATCHED THEN INSERT ([ROADID], [ROAD_NAME]) '
+                         'VALUES (source.[ROADID], source.[ROAD_NAME]);')
+
+
+def test_supports_upsert():
+    """Databases without a native upsert fall back to the ORM"""
+    assert upsert.supports_upsert(mssql.dialect())
+    assert upsert.supports_upsert(postgresql.dialect())
+    assert not upsert.supports_upsert(mysql.dialect())
@@ -0,0 +1,75 @@
+"""Test suite for trafficstat.vin_decoder"""
+import os
+import pickle
+
+import pytest
+import pyvin  # type: ignore
+from pyvin import DecodedVIN  # type: ignore
+
+from trafficstat.vin_decoder import VinDecoder, vin_pattern
+
+CAMRY = '4T4BF1FK3ER362881'
+CAMRY_2 = '4T4BF1FK5ER400001'  # Same VIN pattern, different serial number
+UNKNOWN = '10123456789ABCDEF'
+
+
+@pytest.fixture(name='lookups')
+def lookups_fixture(monkeypatch):
+    """Replaces the vPIC lookup, and records the VINs passed to each request"""
+    lookups = []
+
+    def fake_vin(*vins):
+        lookups.append(vins)
+        results = [DecodedVIN({'VIN': vin, 'Make': 'TOYOTA', 'Model': 'Camry', 'ModelYear': '2014'})
+                   for vin in vins if vin.startswith('4T4')]
+        results += [DecodedVIN({'VIN': vin, 'Make': '', 'Model': '', 'ModelYear': ''})
+                    for vin in vins if not vin.startswith('4T4')]
+        return results[0] if len(vins) == 1 else results
+
+    monkeypatch.setattr(pyvin, 'VIN', fake_vin)
+    yield lookups
+
+
+def test_vin_pattern():
+    """WMI + VDS without the check digit, and the model year"""
+    assert vin_pattern(CAMRY) == '4T4BF1FKE'
+    assert vin_pattern(CAMRY) == vin_pattern(CAMRY_2)
+
+
+def test_decode_batch(lookups, tmpdir):
+    """VINs are looked up in one request, and never looked up twice, even by another decoder using the same cache"""
+    cache_file = os.path.join(tmpdir, 'vin_cache.db')
+    decoder = VinDecoder(cache_file)
+
+    decoded = decoder.decode_batch([CAMRY, UNKNOWN, CAMRY, None, 'SHORTVIN'])
+    assert lookups in ([(CAMRY, UNKNOWN)], [(UNKNOWN, CAMRY)])
+    assert list(decoded) == [CAMRY]
+    assert (decoded[CAMRY].Make, decoded[CAMRY].Model, decoded[CAMRY].ModelYear) == ('TOYOTA', 'Camry', '2014')
+
+    assert decoder.decode(UNKNOWN) is None
+    assert VinDecoder(cache_file).decode(CAMRY).Make == 'TOYOTA'
+    assert len(lookups) == 1
+
+    decoder.decode(CAMRY_2)
+    assert lookups[1] == (CAMRY_2,)
+
+
+def test_decode_offline(lookups, tmpdir):
+    """Offline decoding uses the cached VIN patterns"""
+    cache_file = os.path.join(tmpdir, 'vin_cache.db')
+    VinDecoder(cache_file).decode(CAMRY)
+
+    decoder = VinDecoder(cache_file, offline=True)
+    assert decoder.decode(CAMRY_2).Make == 'TOYOTA'
+    assert decoder.decode(UNKNOWN) is None
+    assert len(lookups) == 1
+
+
+def test_pickle(lookups, tmpdir):
+    """Decoders are passed to the process pool workers"""
+    decoder = VinDecoder(os.path.join(tmpdir, 'vin_cache.db'))
+    decoder.decode(CAMRY)
+
+    unpickled = pickle.loads(pickle.dumps(decoder))
+    assert unpickled.decode(CAMRY).Make == 'TOYOTA'
+    assert len(lookups) == 1
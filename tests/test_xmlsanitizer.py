@@ -1,13 +1,15 @@
 """Test suite for xmlsanitizer.py"""
 # pylint:disable=protected-access
 import glob
+import io
 import os
 import re
 import shutil
+import stat
 
 import pytest
 
-from trafficstat import xmlsanitizer
+from trafficstat import acrs_xml, xmlsanitizer
 
 
 def test_sanitize_xml(tmpdir):
@@ -57,3 +59,80 @@ def test_sanitize_xml_file(tmpdir):
     narrative = re.findall('<NARRATIVE>(.*?)</NARRATIVE>', xml_contents, re.DOTALL)[0]
     assert 'LASTNAME' not in narrative
     assert len(narrative) > 1
+
+
+def test_sanitize_xml_str():
+    """Last names are replaced by the person type they are under, even in pretty printed files with large blobs"""
+    xml_str = ('<?xml version="1.0" encoding="utf-8"?>\n<REPORT>\n'
+               '<NARRATIVE>V1 (SMITH) STRUCK V2. DE LA CRUZ WAS DRIVING V2 AND JONES WAS HIS PASSENGER. '
+               'SMITHSON SAW IT. DOE SAID DOE WAS PARKED.</NARRATIVE>\n'
+               '<People><ACRSPERSON><FIRSTNAME>JOHN</FIRSTNAME><LASTNAME>SMITHSON</LASTNAME></ACRSPERSON></People>\n'
+               '<PDFREPORTs><PDFREPORT><PDFREPORT1>' + 'QUJD' * 1000000 + '</PDFREPORT1></PDFREPORT></PDFREPORTs>\n'
+               '<VEHICLEs>\n<ACRSVEHICLE>\n<DRIVERs>\n<DRIVER>\n<PERSON>\n<FIRSTNAME>JUAN</FIRSTNAME>\n'
+               '<LASTNAME>DE LA CRUZ</LASTNAME>\n<MIDDLENAME>C</MIDDLENAME>\n</PERSON>\n</DRIVER>\n</DRIVERs>\n'
+               '<OWNER i:nil="true"/>\n<PASSENGERs><PASSENGER><PERSON><LASTNAME>JONES</LASTNAME></PERSON></PASSENGER>'
+               '</PASSENGERs>\n<OWNER><LASTNAME>DOE</LASTNAME></OWNER>\n</ACRSVEHICLE>\n</VEHICLEs>\n'
+               '<NONMOTORISTs><NONMOTORIST><PERSON><LASTNAME>DOE</LASTNAME></PERSON></NONMOTORIST></NONMOTORISTs>\n'
+               '</REPORT>')
+
+    sanitized = xmlsanitizer.sanitize_xml_str(xml_str)
+    assert re.findall('<NARRATIVE>(.*?)</NARRATIVE>', sanitized) == [
+        'V1 (SMITH) STRUCK V2. **DRIVER** WAS DRIVING V2 AND **PASSENGER** WAS HIS PASSENGER. SMITHSON SAW IT. '
+        '**OWNER** SAID **OWNER** WAS PARKED.']
+    assert set(re.findall('<(?:FIRSTNAME|LASTNAME|MIDDLENAME)>(.*?)</', sanitized)) == {''}
+    assert 'QUJD' * 1000000 in sanitized
+
+    assert xmlsanitizer.sanitize_xml_str('<REPORT><NARRATIVE/></REPORT>') is None
+
+
+@pytest.mark.parametrize('chunk_size', [7, 1024, xmlsanitizer.CHUNK_SIZE])
+def test_sanitize_xml_stream(chunk_size):
+    """Streaming the file in chunks gives the same result as sanitizing the whole string"""
+    for file in glob.glob(os.path.join('tests', 'testfiles', '*.xml')):
+        with open(file, 'r', encoding='utf8') as xml_file:
+            expected = xmlsanitizer.sanitize_xml_str(xml_file.read())
+            xml_file.seek(0)
+
+            output_file = io.StringIO()
+            assert xmlsanitizer.sanitize_xml_stream(xml_file, output_file, chunk_size) == (expected is not None)
+        assert output_file.getvalue() == (expected or '')
+
+
+def test_sanitize_xml_path_workers(tmpdir):
+    """Files are sanitized in a process pool, and the files that are already sanitized are skipped"""
+    sanitized_files = os.path.join(tmpdir, '.sanitized')
+    xmlsanitizer.sanitize_xml_path(os.path.join('tests', 'testfiles'), sanitized_files, workers=2, chunk_size=1024)
+    assert len(os.listdir(sanitized_files)) == 14  # No temporary files left behind, and no output for the empty file
+
+    sanitized_file = os.path.join(sanitized_files, 'BALTIMORE_acrs_ADJ5220059-witness-nonmotorist.xml')
+    with open(sanitized_file, 'w', encoding='utf8') as xml_file:
+        xml_file.write('already sanitized')
+    xmlsanitizer.sanitize_xml_path(os.path.join('tests', 'testfiles'), sanitized_files, workers=2)
+    with open(sanitized_file, 'r', encoding='utf8') as xml_file:
+        assert xml_file.read() == 'already sanitized'
+
+
+def test_sanitize_xml_path_mode(tmpdir):
+    """The sanitized files get the permissions from the umask, like files written with open()"""
+    sanitized_files = os.path.join(tmpdir, '.sanitized')
+    umask = os.umask(0o022)
+    try:
+        xmlsanitizer.sanitize_xml_path(os.path.join('tests', 'testfiles'), sanitized_files)
+    finally:
+        os.umask(umask)
+
+    for file_name in os.listdir(sanitized_files):
+        assert stat.S_IMODE(os.stat(os.path.join(sanitized_files, file_name)).st_mode) == 0o644
+
+
+@pytest.mark.parametrize('file_name', glob.glob(os.path.join('tests', 'testfiles', '*.xml')))
+def test_sanitize_report(file_name):
+    """Sanitizing the parsed report gives the same result as parsing the sanitized file"""
+    with open(file_name, 'r', encoding='utf8') as xml_file:
+        sanitized = xmlsanitizer.sanitize_xml_str(xml_file.read())
+    if sanitized is None:
+        return
+
+    with open(file_name, 'rb') as xml_file:
+        report = acrs_xml.parse_report(xml_file)
+    assert xmlsanitizer.sanitize_report(report) == acrs_xml.parse_report(io.BytesIO(sanitized.encode('utf8')))